@@ -6,6 +6,8 @@ from pyspark.sql import SparkSession
 from pyspark.sql.utils import AnalysisException
 import traceback
 from .spark_config import SparkExecutor
+from .resource_usage import ResourceMeter
+from .compile_cache import compile_cell
 spark_executor = SparkExecutor()
 # Set up logging
 logging.basicConfig(
@@ -95,7 +97,7 @@ def execute_pyspark_code(code, persist_session=True):
 
         logger.info("Executing PySpark code dynamically.")
         exec_globals = {"spark": spark}
-        exec(code, exec_globals)
+        exec(compile_cell(code).code, exec_globals)
 
         # Check for a result DataFrame in the executed code
         result = exec_globals.get("result")
@@ -121,6 +123,26 @@ def execute_pyspark_code(code, persist_session=True):
             logger.info("Terminating Spark session as per user request.")
             spark.stop()
 
+def get_spark_process_id(spark):
+    """PID of the JVM PySpark launched for this session, or None if it is not a local child."""
+    try:
+        return spark.sparkContext._gateway.proc.pid
+    except AttributeError:
+        return None
+
+# Execute PySpark code and measure what it cost
+def execute_pyspark_code_measured(code, persist_session=True):
+    """Execute PySpark code and return (result, error, resources).
+
+    In local mode the work happens in the Spark JVM, so that is the process
+    being measured; without one the driver process is measured instead.
+    """
+    spark = spark_executor.get_spark_session()
+    pid = get_spark_process_id(spark) if spark is not None else None
+    with ResourceMeter(pid=pid) as meter:
+        result, error = execute_pyspark_code(code, persist_session=persist_session)
+    return result, error, meter.usage()
+
 # Execute PySpark code from a file
 def execute_pyspark_code_from_file(file_name, persist_session=True):
     """Execute PySpark code from a file."""
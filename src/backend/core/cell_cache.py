@@ -0,0 +1,254 @@
+import os
+import ast
+import sys
+import types
+import pickle
+import importlib
+import hashlib
+import logging
+import threading
+from .execution_settings import get_execution_setting, WORKSPACE_PATH
+
+logger = logging.getLogger(__name__)
+
+# Cell results are cached next to the other workspace artifacts
+CELL_CACHE_DIR = os.path.join(WORKSPACE_PATH, "cell_cache")
+CELL_CACHE_ENABLED = get_execution_setting("enable_caching", True, bool)
+CELL_CACHE_MAX_BYTES = int(os.getenv("CELL_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+FINGERPRINT_SAMPLE_ROWS = int(os.getenv("FINGERPRINT_SAMPLE_ROWS", 1000))
+FINGERPRINT_PICKLE_LIMIT = 8 * 1024 ** 2  # Larger generic objects are not fingerprinted
+
+CACHE_FORMAT_VERSION = 1
+
+
+class Unfingerprintable(Exception):
+    """Raised when a value cannot be cheaply and reliably fingerprinted."""
+
+
+def _sample_positions(length, limit=FINGERPRINT_SAMPLE_ROWS):
+    """Evenly spaced positions, always including the first and last element."""
+    if length <= limit:
+        return list(range(length))
+    step = (length - 1) / (limit - 1)
+    return sorted({round(i * step) for i in range(limit)})
+
+
+def _fingerprint_pandas(value, pd, exact=False):
+    digest = hashlib.sha256()
+    digest.update(type(value).__name__.encode())
+    digest.update(repr(value.shape).encode())
+    if isinstance(value, pd.DataFrame):
+        digest.update(repr(list(value.columns)).encode())
+        digest.update(repr([str(dtype) for dtype in value.dtypes]).encode())
+    else:
+        digest.update(repr((value.name, str(value.dtype))).encode())
+    sample = value if exact else value.iloc[_sample_positions(len(value))]
+    try:
+        digest.update(pd.util.hash_pandas_object(sample, index=True).values.tobytes())
+    except TypeError:
+        digest.update(pickle.dumps(sample, protocol=pickle.HIGHEST_PROTOCOL))  # Unhashable cells, e.g. lists
+    return digest.hexdigest()
+
+
+def _fingerprint_numpy(value, np, exact=False):
+    digest = hashlib.sha256()
+    digest.update(repr((value.shape, str(value.dtype))).encode())
+    if value.dtype == object:
+        raise Unfingerprintable("object arrays")
+    if exact or value.nbytes <= FINGERPRINT_PICKLE_LIMIT:
+        digest.update(np.ascontiguousarray(value).tobytes())
+    else:
+        flat = value.reshape(-1)
+        digest.update(np.ascontiguousarray(flat[_sample_positions(flat.size)]).tobytes())
+    return digest.hexdigest()
+
+
+def _hash_code(code, digest):
+    """Hash bytecode, names and constants, recursing into nested code objects.
+
+    repr() of a nested code object (a lambda, comprehension or inner def)
+    contains its memory address, which changes between runs, so constants
+    that are code objects are hashed by their own content instead.
+    """
+    digest.update(code.co_code)
+    digest.update(repr((code.co_name, code.co_names, code.co_varnames, code.co_freevars)).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _hash_code(const, digest)
+        else:
+            digest.update(repr(const).encode())
+
+
+def fingerprint(value, exact=False):
+    """Cheap content fingerprint of a namespace value.
+
+    DataFrames/Series are fingerprinted by shape, dtypes and a hash of a row
+    sample; large arrays by a strided element sample; everything else by its
+    pickle, as long as that stays small. `exact=True` hashes every row and
+    element instead of a sample.
+    """
+    pd = sys.modules.get("pandas")
+    np = sys.modules.get("numpy")
+    if pd is not None and isinstance(value, (pd.DataFrame, pd.Series)):
+        return _fingerprint_pandas(value, pd, exact)
+    if np is not None and isinstance(value, np.ndarray):
+        return _fingerprint_numpy(value, np, exact)
+    if isinstance(value, types.ModuleType):
+        return f"module:{value.__name__}:{getattr(value, '__version__', '')}"
+    if isinstance(value, types.MethodType):
+        return fingerprint(value.__func__)  # e.g. the kernel's display()
+    if isinstance(value, types.FunctionType):
+        digest = hashlib.sha256()
+        _hash_code(value.__code__, digest)
+        return digest.hexdigest()
+    if isinstance(value, type):
+        return f"type:{value.__module__}.{value.__qualname__}"
+    try:
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        raise Unfingerprintable(str(e))
+    if len(payload) > FINGERPRINT_PICKLE_LIMIT:
+        raise Unfingerprintable("value too large")
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _referenced_files(tree):
+    """Fingerprints of existing files named by string literals, e.g. read_csv('data.csv')."""
+    files = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str) and len(node.value) < 1024:
+            try:
+                if os.path.isfile(node.value):
+                    stat = os.stat(node.value)
+                    files.append((node.value, stat.st_size, stat.st_mtime_ns))
+            except (OSError, ValueError):
+                continue
+    return sorted(files)
+
+
+class _ModuleRef:
+    """Stands in for an imported module inside a cache entry."""
+
+    def __init__(self, name):
+        self.name = name
+
+
+def pack_variables(namespace, names):
+    """Collect the values a cell defined, replacing modules with references."""
+    packed = {}
+    for name in names:
+        if name not in namespace:
+            continue
+        value = namespace[name]
+        packed[name] = _ModuleRef(value.__name__) if isinstance(value, types.ModuleType) else value
+    return packed
+
+
+def unpack_variables(packed):
+    """Inverse of pack_variables: re-import referenced modules."""
+    return {
+        name: importlib.import_module(value.name) if isinstance(value, _ModuleRef) else value
+        for name, value in packed.items()
+    }
+
+
+class CellCache:
+    """Content-addressed on-disk store of cell outputs and the variables a cell defined.
+
+    Entries are keyed by the cell's normalized AST plus fingerprints of every
+    upstream variable and input file it reads, and evicted least recently
+    used first once the store grows past `max_bytes`.
+    """
+
+    def __init__(self, directory=CELL_CACHE_DIR, max_bytes=CELL_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def make_key(self, tree, reads, namespace):
+        """Return the cache key for a cell, or None if an input cannot be fingerprinted."""
+        digest = hashlib.sha256()
+        digest.update(f"v{CACHE_FORMAT_VERSION}".encode())
+        digest.update(ast.dump(tree).encode())  # Ignores comments and formatting
+        try:
+            for name in sorted(reads):
+                value_print = fingerprint(namespace[name]) if name in namespace else "<unbound>"
+                digest.update(f"{name}={value_print};".encode())
+        except Unfingerprintable as e:
+            logger.debug(f"Cell not cacheable: {e}")
+            return None
+        digest.update(repr(_referenced_files(tree)).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def load(self, key):
+        """Return the cached entry for a key, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+            os.utime(path)  # Mark as recently used
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cache entry {key}: {e}")
+            self._remove(path)
+            return None
+
+    def store(self, key, outputs, variables):
+        """Persist a cell's outputs and defined variables; skip values that cannot be pickled."""
+        try:
+            payload = pickle.dumps({"outputs": outputs, "variables": variables}, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.debug(f"Cell result not cacheable: {e}")
+            return False
+        if len(payload) > self.max_bytes:
+            return False
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(payload)
+            os.replace(temp_path, path)  # Atomic, so readers never see half an entry
+        except OSError as e:
+            logger.error(f"Error writing cache entry {key}: {e}")
+            self._remove(temp_path)
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        """Drop least recently used entries until the store fits in max_bytes."""
+        with self.lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if not name.endswith(".pkl"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                self._remove(os.path.join(self.directory, name))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
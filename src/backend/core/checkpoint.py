@@ -0,0 +1,214 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import logging
+from .execution_settings import get_execution_setting, WORKSPACE_PATH
+from .shared_data import is_shareable, write_shared, open_shared, to_pandas
+from .state_store import check_storable, serialize, deserialize, Unstorable
+from .lazy_variable import LazyVariable
+
+logger = logging.getLogger(__name__)
+
+# Checkpoint settings from the [Execution] section of settings.config
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", os.path.join(WORKSPACE_PATH, "checkpoints"))
+CHECKPOINT_KEEP = get_execution_setting("checkpoint_keep", 2, int)  # Per notebook, older ones are deleted
+CHECKPOINT_ON_EVICT = get_execution_setting("checkpoint_on_evict", True, bool)
+CHECKPOINT_INTERVAL = get_execution_setting("checkpoint_interval_seconds", 900, int)  # 0 disables periodic checkpoints
+CHECKPOINT_TIMEOUT = get_execution_setting("checkpoint_timeout_seconds", 300, int)
+
+MANIFEST_FILE = "manifest.json"
+PENDING_FILE = "PENDING"  # Written for checkpoints taken when a kernel was stopped by the server
+AUTOMATIC_REASONS = ("evicted", "idle", "shutdown")
+RESERVED_NAMES = {"display"}  # Provided by the kernel itself
+
+
+def _notebook_dir(notebook_id):
+    return os.path.join(CHECKPOINT_DIR, re.sub(r"[^A-Za-z0-9_.-]", "_", str(notebook_id)))
+
+
+def _columns_are_strings(value):
+    pd = sys.modules["pandas"]
+    if isinstance(value, pd.Series):
+        return isinstance(value.name, str)
+    return all(isinstance(column, str) for column in value.columns)
+
+
+def _write_variable(directory, name, value):
+    """Write one variable; frames and arrays as files that can be mapped back, the rest serialized."""
+    check_storable(value)
+    np = sys.modules.get("numpy")
+    if is_shareable(value) and (np is not None and isinstance(value, np.ndarray) or _columns_are_strings(value)):
+        try:
+            descriptor = write_shared(value, directory, name=name)
+            descriptor["path"] = os.path.basename(descriptor["path"])
+            return descriptor
+        except Exception as e:
+            logger.debug(f"{name} cannot be written as Arrow, serializing it: {e}")  # e.g. mixed object columns
+    fmt, data = serialize(value)
+    path = f"{name}.bin"
+    with open(os.path.join(directory, path), "wb") as f:
+        f.write(data)
+    return {"kind": "serialized", "format": fmt, "path": path, "nbytes": len(data)}
+
+
+def _read_variable(directory, entry):
+    path = os.path.join(directory, entry["path"])
+    if entry["kind"] == "ndarray":
+        import numpy as np
+        # Copy-on-write mapping, pages are read on first touch; viewed as a plain ndarray like the original
+        return np.load(path, mmap_mode="c", allow_pickle=False).view(np.ndarray)
+    if entry["kind"] == "arrow":
+        descriptor = dict(entry, path=path)
+        return to_pandas(descriptor, open_shared(descriptor))
+    with open(path, "rb") as f:
+        return deserialize(entry["format"], f.read())
+
+
+def _copy_spilled(directory, name, descriptor):
+    """Put a frame the kernel spilled to disk into the checkpoint without reading it back."""
+    path = os.path.join(directory, f"{name}.arrow")
+    try:
+        os.link(descriptor["path"], path)  # Both files are never written again, sharing them is safe
+    except OSError:
+        shutil.copyfile(descriptor["path"], path)
+    return dict(descriptor, path=os.path.basename(path))
+
+
+def write_checkpoint(notebook_id, namespace, reason="manual", spilled=None):
+    """Write a kernel namespace to a new checkpoint directory; returns its manifest.
+
+    `spilled` maps names of frames that were spilled out of the namespace
+    to their files. The manifest is written last, so a checkpoint
+    interrupted half way is never picked up by a restore.
+    """
+    created_at = time.time()
+    checkpoint_id = time.strftime("%Y%m%d-%H%M%S", time.localtime(created_at)) + f"-{int(created_at * 1000) % 1000:03d}"
+    directory = os.path.join(_notebook_dir(notebook_id), checkpoint_id)
+    os.makedirs(directory, exist_ok=True)
+
+    variables, skipped = {}, {}
+    for name, value in list(namespace.items()):
+        if name.startswith("_") or name in RESERVED_NAMES or isinstance(value, LazyVariable):
+            continue  # Spilled frames are copied from their files below, stored ones stay in the state store
+        try:
+            variables[name] = _write_variable(directory, name, value)
+        except Unstorable as e:
+            skipped[name] = str(e)
+        except Exception as e:
+            logger.warning(f"Could not checkpoint variable {name}: {e}")
+            skipped[name] = str(e)
+    for name, descriptor in (spilled or {}).items():
+        try:
+            variables[name] = _copy_spilled(directory, name, descriptor)
+        except Exception as e:
+            logger.warning(f"Could not checkpoint spilled variable {name}: {e}")
+            skipped[name] = str(e)
+
+    manifest = {
+        "checkpoint_id": checkpoint_id,
+        "notebook_id": notebook_id,
+        "reason": reason,
+        "created_at": created_at,
+        "duration": round(time.time() - created_at, 4),
+        "nbytes": sum(entry.get("nbytes", 0) for entry in variables.values()),
+        "variables": variables,
+        "skipped": skipped,
+    }
+    temp_path = os.path.join(directory, f"{MANIFEST_FILE}.tmp")
+    with open(temp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, os.path.join(directory, MANIFEST_FILE))
+    if reason in AUTOMATIC_REASONS:
+        open(os.path.join(directory, PENDING_FILE), "w").close()
+    prune_checkpoints(notebook_id)
+    return manifest
+
+
+def _read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def list_checkpoints(notebook_id):
+    """Complete checkpoints of a notebook, newest first, without their variable tables."""
+    root = _notebook_dir(notebook_id)
+    if not os.path.isdir(root):
+        return []
+    checkpoints = []
+    for checkpoint_id in sorted(os.listdir(root), reverse=True):
+        manifest = _read_manifest(os.path.join(root, checkpoint_id))
+        if manifest is None:
+            continue
+        summary = {key: value for key, value in manifest.items() if key not in ("variables", "skipped")}
+        summary["variables"] = sorted(manifest["variables"])
+        summary["pending"] = os.path.exists(os.path.join(root, checkpoint_id, PENDING_FILE))
+        checkpoints.append(summary)
+    return checkpoints
+
+
+def read_checkpoint(notebook_id, checkpoint_id=None):
+    """Map a checkpoint back into {name: value}; the latest one unless an id is given."""
+    if checkpoint_id is None:
+        checkpoints = list_checkpoints(notebook_id)
+        if not checkpoints:
+            raise FileNotFoundError(f"Notebook {notebook_id} has no checkpoints")
+        checkpoint_id = checkpoints[0]["checkpoint_id"]
+    directory = os.path.join(_notebook_dir(notebook_id), os.path.basename(checkpoint_id))
+    manifest = _read_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(f"Checkpoint {checkpoint_id} of notebook {notebook_id} not found")
+
+    values = {}
+    for name, entry in manifest["variables"].items():
+        try:
+            values[name] = _read_variable(directory, entry)
+        except Exception as e:
+            logger.error(f"Could not restore variable {name} from checkpoint {checkpoint_id}: {e}")
+    clear_pending(notebook_id)
+    return values, manifest
+
+
+def pending_checkpoint(notebook_id):
+    """Id of the latest checkpoint taken when the server stopped the notebook's kernel, or None."""
+    checkpoints = list_checkpoints(notebook_id)
+    if checkpoints and checkpoints[0]["pending"]:
+        return checkpoints[0]["checkpoint_id"]
+    return None
+
+
+def clear_pending(notebook_id):
+    root = _notebook_dir(notebook_id)
+    if not os.path.isdir(root):
+        return
+    for checkpoint_id in os.listdir(root):
+        try:
+            os.remove(os.path.join(root, checkpoint_id, PENDING_FILE))
+        except FileNotFoundError:
+            pass
+
+
+def prune_checkpoints(notebook_id, keep=None):
+    """Delete all but the newest `keep` checkpoints (and any incomplete ones) of a notebook.
+
+    Restored arrays stay valid after their files are deleted: the kernel
+    still holds the mapping.
+    """
+    keep = CHECKPOINT_KEEP if keep is None else keep
+    root = _notebook_dir(notebook_id)
+    if not os.path.isdir(root):
+        return 0
+    complete = {c["checkpoint_id"] for c in list_checkpoints(notebook_id)[:keep]}
+    newest = max(os.listdir(root), default=None)
+    removed = 0
+    for checkpoint_id in os.listdir(root):
+        if checkpoint_id in complete or checkpoint_id == newest:
+            continue  # The newest directory may be a checkpoint being written
+        shutil.rmtree(os.path.join(root, checkpoint_id), ignore_errors=True)
+        removed += 1
+    return removed
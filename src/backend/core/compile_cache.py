@@ -0,0 +1,164 @@
+import ast
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from .execution_settings import get_execution_setting
+from .dataflow import analyze_cell
+from .sql_magic import transform
+
+logger = logging.getLogger(__name__)
+
+# Number of distinct cell sources kept compiled, from the [Execution] section of settings.config
+COMPILE_CACHE_SIZE = get_execution_setting("compile_cache_size", 512, int)
+
+
+# Code Validation
+class CodeValidator(ast.NodeVisitor):
+    """AST-based validator to check code safety."""
+    def __init__(self):
+        self.errors = []
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            if alias.name in {"os", "subprocess", "sys", "importlib"}:
+                self.errors.append(f"Forbidden import: {alias.name}")
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Name) and node.func.id in {"exec", "eval"}:
+            self.errors.append(f"Forbidden function call: {node.func.id}")
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node):
+        if isinstance(node.value, ast.Name) and node.value.id in {"os", "sys"}:
+            self.errors.append(f"Potentially unsafe attribute access: {node.attr}")
+        self.generic_visit(node)
+
+
+class CompiledCell:
+    """One cell source parsed once, with everything derived from the AST computed on first use.
+
+    The tree is shared by every user of the cache and must not be modified.
+    %%sql/%sql magics are rewritten into Python before parsing.
+    """
+
+    def __init__(self, source, filename="<cell>"):
+        self.source = source
+        self.filename = filename
+        self.python_source = source
+        self.tree = None
+        self.syntax_error = None
+        try:
+            self.python_source = transform(source)
+            self.tree = ast.parse(self.python_source, filename)
+        except SyntaxError as e:
+            self.syntax_error = e
+        self._code = None
+        self._split = None
+        self._verdict = None
+        self._analysis = None
+        self._deletes = None
+
+    def _raise_syntax_error(self):
+        error = self.syntax_error
+        raise SyntaxError(error.msg, (error.filename, error.lineno, error.offset, error.text))
+
+    @property
+    def code(self):
+        """Code object of the whole cell, for exec()."""
+        if self._code is None:
+            if self.syntax_error is not None:
+                self._raise_syntax_error()
+            self._code = compile(self.tree, self.filename, "exec")
+        return self._code
+
+    @property
+    def split(self):
+        """(body, last expression) code objects; the last is None unless the cell ends in an expression.
+
+        A trailing semicolon suppresses the value, like in a notebook.
+        """
+        if self._split is None:
+            if self.syntax_error is not None:
+                self._raise_syntax_error()
+            body = self.tree.body
+            if body and isinstance(body[-1], ast.Expr) and not self.python_source.rstrip().endswith(";"):
+                self._split = (
+                    compile(ast.Module(body=body[:-1], type_ignores=[]), self.filename, "exec"),
+                    compile(ast.Expression(body[-1].value), self.filename, "eval"),
+                )
+            else:
+                self._split = (self.code, None)
+        return self._split
+
+    def validate(self):
+        """(is_safe, errors) from CodeValidator; syntax errors count as unsafe."""
+        if self._verdict is None:
+            if self.syntax_error is not None:
+                self._verdict = (False, [f"Python Syntax Error: {self.syntax_error}"])
+            else:
+                validator = CodeValidator()
+                validator.visit(self.tree)
+                self._verdict = (not validator.errors, list(validator.errors))
+        return self._verdict
+
+    def analysis(self):
+        """(defines, reads) as frozensets, see dataflow.analyze_cell."""
+        if self._analysis is None:
+            if self.tree is None:
+                self._analysis = (frozenset(), frozenset())
+            else:
+                defines, reads = analyze_cell(self.python_source, self.tree)
+                self._analysis = (frozenset(defines), frozenset(reads))
+        return self._analysis
+
+    @property
+    def deletes(self):
+        """Names removed with `del name` anywhere in the cell."""
+        if self._deletes is None:
+            self._deletes = frozenset(
+                target.id
+                for node in ast.walk(self.tree) if isinstance(node, ast.Delete)
+                for target in node.targets if isinstance(target, ast.Name)
+            ) if self.tree is not None else frozenset()
+        return self._deletes
+
+
+class CompileCache:
+    """Bounded LRU of CompiledCell keyed by a hash of the source, so unchanged cells skip parsing."""
+
+    def __init__(self, max_entries=COMPILE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, source, filename="<cell>"):
+        key = (hashlib.sha256(source.encode("utf-8", "surrogatepass")).hexdigest(), filename)
+        with self.lock:
+            compiled = self.entries.get(key)
+            if compiled is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+        compiled = CompiledCell(source, filename)  # Parsed outside the lock; a racing duplicate is harmless
+        with self.lock:
+            self.entries[key] = compiled
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return compiled
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+# Per-process cache (the API process and every kernel have their own)
+compile_cache = CompileCache()
+
+
+def compile_cell(source, filename="<cell>"):
+    return compile_cache.get(source, filename)
@@ -0,0 +1,254 @@
+import re
+import sys
+import types
+import inspect
+import keyword
+import builtins
+import logging
+import functools
+import threading
+from .execution_settings import get_execution_setting
+from .lazy_variable import LazyVariable
+
+logger = logging.getLogger(__name__)
+
+# Completion settings from the [Execution] section of settings.config
+COMPLETION_MAX_MATCHES = get_execution_setting("completion_max_matches", 200, int)
+COMPLETION_DOC_CHARS = 500  # Docstring shown with a signature
+
+ATTRIBUTE_CONTEXT = re.compile(r"(?P<expr>[A-Za-z_][\w.]*)\.(?P<prefix>\w*)$")
+KEY_CONTEXT = re.compile(r"(?P<expr>[A-Za-z_][\w.]*)\[\s*(?P<quote>['\"])(?P<prefix>[^'\"]*)$")
+NAME_CONTEXT = re.compile(r"(?P<prefix>[A-Za-z_]\w*)$")
+CALLEE = re.compile(r"(?P<expr>[A-Za-z_][\w.]*)\s*$")
+
+
+def _open_call(text):
+    """Position of the '(' of the call the cursor is inside, ignoring strings and comments, or None."""
+    stack, quote, i = [], None, 0
+    while i < len(text):
+        char = text[i]
+        if quote is not None:
+            if char == "\\":
+                i += 1
+            elif text.startswith(quote, i):
+                i += len(quote) - 1
+                quote = None
+        elif char == "#":
+            newline = text.find("\n", i)
+            i = len(text) if newline < 0 else newline
+        elif char in "'\"":
+            quote = char * 3 if text.startswith(char * 3, i) else char
+            i += len(quote) - 1
+        elif char in "([{":
+            stack.append((char, i))
+        elif char in ")]}" and stack:
+            stack.pop()
+        i += 1
+    calls = [position for char, position in stack if char == "("]
+    return calls[-1] if calls else None
+
+
+def _resolve(namespace, expr):
+    """The object a dotted name refers to, without running properties or __getattr__; None if unknown."""
+    parts = expr.split(".")
+    try:
+        value = namespace[parts[0]]
+        if isinstance(value, LazyVariable):
+            return None  # Still on disk, completion does not load it
+    except KeyError:
+        builtin_names = namespace.get("__builtins__", builtins)
+        builtin_names = builtin_names if isinstance(builtin_names, dict) else vars(builtin_names)
+        if parts[0] not in builtin_names:
+            return None
+        value = builtin_names[parts[0]]
+    for part in parts[1:]:
+        try:
+            static = inspect.getattr_static(value, part)
+        except AttributeError:
+            if isinstance(value, dict) or part not in _keys(value):
+                return None
+            value = value[part]  # df.column, one column of a DataFrame
+            continue
+        if isinstance(static, (property, functools.cached_property)):
+            return None  # Could compute something expensive, or have side effects
+        try:
+            value = getattr(value, part)
+        except Exception:
+            return None
+    return value
+
+
+def _kind(value):
+    if isinstance(value, LazyVariable):
+        return "variable"
+    if isinstance(value, types.ModuleType):
+        return "module"
+    if isinstance(value, type):
+        return "class"
+    if isinstance(value, (property, functools.cached_property)):
+        return "property"
+    if isinstance(value, (staticmethod, classmethod)) or callable(value):
+        return "function"
+    return "variable"
+
+
+def _attributes(value):
+    """(name, kind) of the attributes of a value, looked up statically."""
+    attributes = []
+    for name in dir(value):
+        try:
+            attributes.append((name, _kind(inspect.getattr_static(value, name))))
+        except AttributeError:
+            attributes.append((name, "variable"))  # Added through __dir__, e.g. DataFrame columns
+    return attributes
+
+
+def _keys(value):
+    """String keys of a DataFrame (its columns) or a dict; empty for anything else."""
+    pd = sys.modules.get("pandas")
+    if pd is not None and isinstance(value, pd.DataFrame):
+        keys = value.columns
+    elif isinstance(value, dict):
+        keys = list(value)
+    elif hasattr(type(value), "columns") and type(value).__module__.startswith("pyspark"):
+        keys = value.columns  # pandas-on-Spark: column names are metadata, no Spark job
+    else:
+        return []
+    return [key for key in keys if isinstance(key, str)]
+
+
+def _signature(value, expr):
+    if not callable(value):
+        return None
+    try:
+        signature = f"{expr}{inspect.signature(value)}"
+    except (TypeError, ValueError):
+        signature = None  # Some builtins and C extensions do not expose one
+    doc = inspect.getdoc(value) or ""
+    if signature is None and not doc:
+        return None
+    return {"name": expr, "signature": signature, "doc": doc[:COMPLETION_DOC_CHARS]}
+
+
+class CompletionCache:
+    """Introspection results per expression, for one kernel.
+
+    Entries remember the identity of the object they describe and the root
+    name they hang off, so a cell that rebinds or mutates the name drops
+    them. It is read from the kernel's completion thread while the main
+    thread runs cells, hence the lock.
+    """
+
+    def __init__(self):
+        self.entries = {}  # expr -> {"root", "id", "attributes", "keys", "signature"}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def describe(self, expr, value):
+        """Attributes, keys and signature of `value`, computed once per object."""
+        with self.lock:
+            entry = self.entries.get(expr)
+            if entry is not None and entry["id"] == id(value):
+                self.hits += 1
+                return entry, True
+            self.misses += 1
+        entry = {
+            "root": expr.split(".")[0],
+            "id": id(value),
+            "attributes": _attributes(value),
+            "keys": _keys(value),
+            "signature": _signature(value, expr),
+        }
+        with self.lock:
+            self.entries[expr] = entry
+        return entry, False
+
+    def invalidate(self, names):
+        """Drop entries rooted at any of the names a cell defined, deleted or mutated."""
+        names = set(names)
+        if not names:
+            return
+        with self.lock:
+            self.entries = {expr: entry for expr, entry in self.entries.items() if entry["root"] not in names}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+def _rank(matches, prefix, limit):
+    """Matches starting with the prefix; private names only when the prefix asks for them."""
+    seen, ranked = set(), []
+    for name, kind in matches:
+        if name in seen or not name.startswith(prefix) or (name.startswith("_") and not prefix.startswith("_")):
+            continue
+        seen.add(name)
+        ranked.append({"name": name, "kind": kind})
+    ranked.sort(key=lambda match: (match["kind"] != "column", match["name"].lower()))
+    return ranked[:limit], len(ranked)
+
+
+def complete(namespace, code, cursor=None, cache=None, extra_names=(), limit=COMPLETION_MAX_MATCHES):
+    """Completions and call signature at `cursor` in `code`, answered from the live namespace.
+
+    Handles `obj.attr`, `df["column` / `d["key` and bare names; inside the
+    parentheses of a call the callee's signature is returned as well.
+    Nothing is evaluated apart from plain attribute lookups.
+    """
+    cache = CompletionCache() if cache is None else cache
+    cursor = len(code) if cursor is None else max(0, min(int(cursor), len(code)))
+    text = code[:cursor]
+    namespace = dict(namespace)  # The kernel's main thread may be changing it
+    matches, prefix, hits = [], "", []
+
+    key_context = KEY_CONTEXT.search(text)
+    attribute_context = ATTRIBUTE_CONTEXT.search(text)
+    name_context = NAME_CONTEXT.search(text)
+    if key_context is not None:
+        prefix = key_context.group("prefix")
+        value = _resolve(namespace, key_context.group("expr"))
+        if value is not None:
+            entry, hit = cache.describe(key_context.group("expr"), value)
+            hits.append(hit)
+            matches = [(key, "column") for key in entry["keys"]]
+    elif attribute_context is not None:
+        prefix = attribute_context.group("prefix")
+        value = _resolve(namespace, attribute_context.group("expr"))
+        if value is not None:
+            entry, hit = cache.describe(attribute_context.group("expr"), value)
+            hits.append(hit)
+            matches = [(key, "column") for key in entry["keys"] if key.isidentifier()] + entry["attributes"]
+    elif name_context is not None and not text[:name_context.start()].endswith((".", "'", '"')):
+        prefix = name_context.group("prefix")
+        builtin_names = namespace.get("__builtins__", builtins)
+        builtin_names = builtin_names if isinstance(builtin_names, dict) else vars(builtin_names)
+        matches = (
+            [(name, _kind(value)) for name, value in namespace.items()]
+            + [(name, "variable") for name in extra_names]
+            + [(name, "keyword") for name in keyword.kwlist]
+            + [(name, _kind(value)) for name, value in builtin_names.items()]
+        )
+    ranked, total = _rank(matches, prefix, limit)
+
+    signature = None
+    call = _open_call(text)
+    callee = CALLEE.search(text[:call]) if call is not None else None
+    if callee is not None:
+        value = _resolve(namespace, callee.group("expr"))
+        if value is not None:
+            entry, hit = cache.describe(callee.group("expr"), value)
+            signature = entry["signature"]
+            hits.append(hit)
+    return {
+        "matches": ranked,
+        "total": total,
+        "cursor_start": cursor - len(prefix),
+        "cursor_end": cursor,
+        "signature": signature,
+        "cached": bool(hits) and all(hits),  # Every object introspected came from the cache
+    }
@@ -0,0 +1,320 @@
+import ast
+import builtins
+import logging
+import threading
+from .sql_magic import transform
+
+logger = logging.getLogger(__name__)
+
+BUILTIN_NAMES = frozenset(dir(builtins))
+
+
+class CellAnalyzer(ast.NodeVisitor):
+    """Collect the top-level names a cell defines and the names it reads from earlier cells.
+
+    Statements are walked in order, so a name assigned earlier in the same cell
+    is not treated as an upstream read. Names bound inside functions, lambdas
+    and comprehensions stay local to them. Mutating `df[...]`/`df.attr` counts
+    as both reading and redefining `df`.
+    """
+
+    def __init__(self):
+        self.defines = set()
+        self.reads = set()
+        self.scopes = []  # Stack of local name sets for nested scopes
+
+    def analyze(self, tree):
+        for statement in tree.body:
+            self.visit(statement)
+        return self
+
+    def _is_local(self, name):
+        return name in self.defines or any(name in scope for scope in self.scopes)
+
+    def _bind(self, name):
+        if self.scopes:
+            self.scopes[-1].add(name)
+        else:
+            self.defines.add(name)
+
+    def _read(self, name):
+        if not self._is_local(name) and name not in BUILTIN_NAMES:
+            self.reads.add(name)
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self._read(node.id)
+        else:
+            self._bind(node.id)
+
+    def _visit_mutation_target(self, node):
+        base = node
+        while isinstance(base, (ast.Subscript, ast.Attribute)):
+            base = base.value
+        if isinstance(base, ast.Name) and not self.scopes:
+            self._read(base.id)
+            self.defines.add(base.id)
+        self.generic_visit(node)
+
+    def visit_Subscript(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self.generic_visit(node)
+        else:
+            self._visit_mutation_target(node)
+
+    def visit_Attribute(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self.generic_visit(node)
+        else:
+            self._visit_mutation_target(node)
+
+    def visit_Assign(self, node):
+        self.visit(node.value)  # Right-hand side is evaluated first
+        for target in node.targets:
+            self.visit(target)
+
+    def visit_AugAssign(self, node):
+        self.visit(node.value)
+        if isinstance(node.target, ast.Name):
+            self._read(node.target.id)
+        self.visit(node.target)
+
+    def visit_AnnAssign(self, node):
+        if node.value is not None:
+            self.visit(node.value)
+        self.visit(node.target)
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self._bind((alias.asname or alias.name).split(".")[0])
+
+    def visit_ImportFrom(self, node):
+        for alias in node.names:
+            if alias.name != "*":
+                self._bind(alias.asname or alias.name)
+
+    def visit_ExceptHandler(self, node):
+        if node.type is not None:
+            self.visit(node.type)
+        if node.name:
+            self._bind(node.name)
+        for statement in node.body:
+            self.visit(statement)
+
+    def visit_Global(self, node):
+        for name in node.names:
+            self.defines.add(name)
+
+    def _visit_function(self, node):
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        for default in node.args.defaults + [d for d in node.args.kw_defaults if d is not None]:
+            self.visit(default)
+        self._bind(node.name)
+        arguments = node.args.posonlyargs + node.args.args + node.args.kwonlyargs
+        local_names = {arg.arg for arg in arguments}
+        for extra in (node.args.vararg, node.args.kwarg):
+            if extra is not None:
+                local_names.add(extra.arg)
+        self.scopes.append(local_names)
+        for statement in node.body:
+            self.visit(statement)
+        self.scopes.pop()
+
+    visit_FunctionDef = _visit_function
+    visit_AsyncFunctionDef = _visit_function
+
+    def visit_Lambda(self, node):
+        local_names = {arg.arg for arg in node.args.posonlyargs + node.args.args + node.args.kwonlyargs}
+        self.scopes.append(local_names)
+        self.visit(node.body)
+        self.scopes.pop()
+
+    def visit_ClassDef(self, node):
+        for expression in node.decorator_list + node.bases + [k.value for k in node.keywords]:
+            self.visit(expression)
+        self._bind(node.name)
+        self.scopes.append(set())
+        for statement in node.body:
+            self.visit(statement)
+        self.scopes.pop()
+
+    def _visit_comprehension(self, node):
+        self.scopes.append(set())
+        for generator in node.generators:
+            self.visit(generator.iter)
+            self.visit(generator.target)
+            for condition in generator.ifs:
+                self.visit(condition)
+        for field in ("elt", "key", "value"):
+            if hasattr(node, field):
+                self.visit(getattr(node, field))
+        self.scopes.pop()
+
+    visit_ListComp = _visit_comprehension
+    visit_SetComp = _visit_comprehension
+    visit_GeneratorExp = _visit_comprehension
+    visit_DictComp = _visit_comprehension
+
+
+def analyze_cell(code, tree=None):
+    """Return (defines, reads) for a cell's source, or empty sets if it does not parse."""
+    try:
+        tree = tree or ast.parse(transform(code))
+    except SyntaxError:
+        return set(), set()
+    analyzer = CellAnalyzer().analyze(tree)
+    return analyzer.defines, analyzer.reads
+
+
+class CellNode:
+    def __init__(self, cell_id, code):
+        self.cell_id = cell_id
+        self.code = None
+        self.defines = set()
+        self.reads = set()
+        self.stale = True
+        self.set_code(code)
+
+    def set_code(self, code):
+        """Update the source; return True if it actually changed."""
+        if code == self.code:
+            return False
+        self.code = code
+        self.defines, self.reads = analyze_cell(code)
+        return True
+
+
+class NotebookGraph:
+    """Dataflow graph of one notebook's cells, in notebook order.
+
+    A cell depends on the closest earlier cell that defines a name it reads.
+    Editing a cell marks it and everything downstream of it as stale.
+    """
+
+    def __init__(self, notebook_id):
+        self.notebook_id = notebook_id
+        self.cells = {}  # cell_id -> CellNode
+        self.order = []  # cell_ids in notebook order
+        self.lock = threading.RLock()
+
+    def sync_cells(self, cells):
+        """Replace the cell order and sources with the notebook's current cells."""
+        with self.lock:
+            previous_order = list(self.order)
+            changed = []
+            order = []
+            for cell in cells:
+                cell_id = str(cell.get("cell_id"))
+                order.append(cell_id)
+                if self._set_cell(cell_id, cell.get("code", "")):
+                    changed.append(cell_id)
+            removed = [cell_id for cell_id in previous_order if cell_id not in order]
+            changed.extend(c for c in self.affected_cells(removed) if c in order)  # Lost their upstream
+            for cell_id in removed:
+                self.cells.pop(cell_id, None)
+            self.order = order
+            kept = [cell_id for cell_id in order if cell_id in previous_order]
+            if kept != [cell_id for cell_id in previous_order if cell_id in order]:
+                changed = list(order)  # Reordering can rewire every edge
+            return self._mark_stale(changed)
+
+    def update_cell(self, cell_id, code):
+        """Record a cell edit and return the cells that became stale."""
+        with self.lock:
+            cell_id = str(cell_id)
+            if not self._set_cell(cell_id, code):
+                return []
+            return self._mark_stale([cell_id])
+
+    def mark_executed(self, cell_id, code):
+        """Record that a cell ran with the given source and is now fresh."""
+        with self.lock:
+            cell_id = str(cell_id)
+            if self._set_cell(cell_id, code):
+                self._mark_stale([cell_id])
+            self.cells[cell_id].stale = False
+
+    def _set_cell(self, cell_id, code):
+        node = self.cells.get(cell_id)
+        if node is None:
+            self.cells[cell_id] = CellNode(cell_id, code)
+            if cell_id not in self.order:
+                self.order.append(cell_id)
+            return True
+        return node.set_code(code)
+
+    def _mark_stale(self, cell_ids):
+        affected = self.affected_cells(cell_ids)
+        for cell_id in affected:
+            self.cells[cell_id].stale = True
+        return affected
+
+    def dependencies(self):
+        """Map each cell id to the ids of the cells it reads names from."""
+        with self.lock:
+            edges = {}
+            last_definer = {}
+            for cell_id in self.order:
+                node = self.cells[cell_id]
+                edges[cell_id] = sorted(
+                    {last_definer[name] for name in node.reads if name in last_definer},
+                    key=self.order.index,
+                )
+                for name in node.defines:
+                    last_definer[name] = cell_id
+            return edges
+
+    def affected_cells(self, cell_ids):
+        """Return the given cells plus all transitive dependents, in notebook order."""
+        with self.lock:
+            edges = self.dependencies()
+            affected = {str(c) for c in cell_ids if str(c) in self.cells}
+            for cell_id in self.order:  # Edges always point backwards, one pass suffices
+                if any(parent in affected for parent in edges[cell_id]):
+                    affected.add(cell_id)
+            return [cell_id for cell_id in self.order if cell_id in affected]
+
+    def stale_cells(self):
+        with self.lock:
+            return [cell_id for cell_id in self.order if self.cells[cell_id].stale]
+
+    def to_dict(self):
+        with self.lock:
+            edges = self.dependencies()
+            return {
+                "notebook_id": self.notebook_id,
+                "cells": [
+                    {
+                        "cell_id": cell_id,
+                        "defines": sorted(self.cells[cell_id].defines),
+                        "reads": sorted(self.cells[cell_id].reads),
+                        "depends_on": edges[cell_id],
+                        "stale": self.cells[cell_id].stale,
+                    }
+                    for cell_id in self.order
+                ],
+            }
+
+
+class DataflowRegistry:
+    """Holds one NotebookGraph per notebook."""
+
+    def __init__(self):
+        self.graphs = {}
+        self.lock = threading.Lock()
+
+    def get(self, notebook_id):
+        with self.lock:
+            graph = self.graphs.get(notebook_id)
+            if graph is None:
+                graph = self.graphs[notebook_id] = NotebookGraph(notebook_id)
+            return graph
+
+    def drop(self, notebook_id):
+        with self.lock:
+            self.graphs.pop(notebook_id, None)
+
+
+# Shared registry used by the API routes
+dataflow_registry = DataflowRegistry()
@@ -0,0 +1,129 @@
+import sys
+import json
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from .execution_settings import get_execution_setting
+from .display import DISPLAY_TABLE_ROWS
+
+logger = logging.getLogger(__name__)
+
+# Viewer settings from the [Execution] section of settings.config
+VIEWER_MIN_ROWS = get_execution_setting("viewer_min_rows", DISPLAY_TABLE_ROWS, int)  # Smaller frames are shown inline
+VIEWER_PAGE_SIZE = get_execution_setting("viewer_page_size", 100, int)
+VIEWER_MAX_PAGE_SIZE = 10000
+MAX_VIEWERS = get_execution_setting("viewer_max_handles", 20, int)  # Per kernel, least recently used are closed
+
+# MIME type of the handle inside a display bundle
+VIEWER_MIME = "application/vnd.datavita.dataframe+json"
+
+FILTER_OPS = {
+    "==": lambda column, value: column == value,
+    "!=": lambda column, value: column != value,
+    "<": lambda column, value: column < value,
+    "<=": lambda column, value: column <= value,
+    ">": lambda column, value: column > value,
+    ">=": lambda column, value: column >= value,
+    "contains": lambda column, value: column.astype(str).str.contains(str(value), case=False, regex=False, na=False),
+    "isnull": lambda column, value: column.isna(),
+    "notnull": lambda column, value: column.notna(),
+}
+
+
+def wants_viewer(value):
+    """True for DataFrames/Series too long to send inline."""
+    pd = sys.modules.get("pandas")
+    return pd is not None and isinstance(value, (pd.DataFrame, pd.Series)) and len(value) > VIEWER_MIN_ROWS
+
+
+def _coerce(column, value):
+    """Make a JSON filter value comparable with the column it filters."""
+    pd = sys.modules["pandas"]
+    if value is None or isinstance(value, bool):
+        return value
+    if pd.api.types.is_numeric_dtype(column.dtype) and isinstance(value, str):
+        return float(value)
+    if pd.api.types.is_datetime64_any_dtype(column.dtype):
+        return pd.Timestamp(value)
+    return value
+
+
+class DataFrameViewer:
+    """A DataFrame kept inside the kernel and read one page at a time.
+
+    The last sorted/filtered view is memoized, so scrolling through it costs
+    one slice per page instead of a sort per page.
+    """
+
+    def __init__(self, frame):
+        pd = sys.modules["pandas"]
+        self.frame = frame.to_frame() if isinstance(frame, pd.Series) else frame
+        self.handle_id = uuid.uuid4().hex
+        self.created_at = time.time()
+        self._view_key = None
+        self._view = self.frame
+
+    def schema(self):
+        return [{"name": str(name), "dtype": str(dtype)} for name, dtype in self.frame.dtypes.items()]
+
+    def describe(self, page_size=VIEWER_PAGE_SIZE):
+        return {
+            "handle_id": self.handle_id,
+            "row_count": len(self.frame),
+            "columns": self.schema(),
+            "page": self.page(0, page_size),
+        }
+
+    def _get_view(self, sort=None, ascending=True, filters=None):
+        key = json.dumps([sort, bool(ascending), filters or []], sort_keys=True, default=str)
+        if key == self._view_key:
+            return self._view
+        view = self.frame
+        for condition in filters or []:
+            column_name, op = condition.get("column"), condition.get("op", "==")
+            if column_name not in view.columns:
+                raise KeyError(f"Unknown column: {column_name}")
+            if op not in FILTER_OPS:
+                raise ValueError(f"Unsupported filter operator: {op}")
+            column = view[column_name]
+            view = view[FILTER_OPS[op](column, _coerce(column, condition.get("value")))]
+        if sort is not None:
+            if sort not in view.columns:
+                raise KeyError(f"Unknown column: {sort}")
+            view = view.sort_values(sort, ascending=bool(ascending), kind="stable", na_position="last")
+        self._view_key, self._view = key, view
+        return view
+
+    def page(self, offset=0, limit=VIEWER_PAGE_SIZE, sort=None, ascending=True, filters=None):
+        """One window of rows from the (optionally sorted and filtered) frame."""
+        offset = max(int(offset), 0)
+        limit = min(max(int(limit), 0), VIEWER_MAX_PAGE_SIZE)
+        view = self._get_view(sort, ascending, filters)
+        window = view.iloc[offset:offset + limit]
+        rows = json.loads(window.to_json(orient="split", date_format="iso", default_handler=str))
+        return {"offset": offset, "limit": limit, "row_count": len(view), **rows}
+
+
+class ViewerRegistry:
+    """The open viewers of one kernel, closing the least recently used past a limit."""
+
+    def __init__(self, max_viewers=MAX_VIEWERS):
+        self.max_viewers = max_viewers
+        self.viewers = OrderedDict()
+
+    def open(self, frame):
+        viewer = DataFrameViewer(frame)
+        self.viewers[viewer.handle_id] = viewer
+        while len(self.viewers) > self.max_viewers:
+            self.viewers.popitem(last=False)
+        return viewer
+
+    def get(self, handle_id):
+        viewer = self.viewers.get(handle_id)
+        if viewer is not None:
+            self.viewers.move_to_end(handle_id)
+        return viewer
+
+    def close(self, handle_id):
+        return self.viewers.pop(handle_id, None) is not None
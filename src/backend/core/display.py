@@ -0,0 +1,201 @@
+import io
+import sys
+import json
+import gzip
+import base64
+import logging
+from .execution_settings import get_execution_setting
+
+logger = logging.getLogger(__name__)
+
+# Display settings from the [Execution] section of settings.config
+DISPLAY_DPI = get_execution_setting("display_dpi", 100, int)
+DISPLAY_FIGURE_FORMATS = [
+    fmt.strip().lower() for fmt in get_execution_setting("display_figure_formats", "png").split(",") if fmt.strip()
+]
+DISPLAY_TABLE_ROWS = get_execution_setting("display_table_rows", 50, int)
+DISPLAY_MAX_BUNDLE_BYTES = get_execution_setting("display_max_bundle_bytes", 2 * 1024 ** 2, int)
+DISPLAY_COMPRESS_THRESHOLD = get_execution_setting("display_compress_threshold", 64 * 1024, int)
+
+FIGURE_MIME_TYPES = {"png": "image/png", "svg": "image/svg+xml", "webp": "image/webp"}
+BINARY_MIME_TYPES = {"image/png", "image/webp", "image/jpeg"}
+
+# IPython-style rich repr hooks, checked in order of preference
+REPR_METHODS = (
+    ("_repr_html_", "text/html"),
+    ("_repr_svg_", "image/svg+xml"),
+    ("_repr_png_", "image/png"),
+    ("_repr_jpeg_", "image/jpeg"),
+    ("_repr_json_", "application/json"),
+    ("_repr_markdown_", "text/markdown"),
+    ("_repr_latex_", "text/latex"),
+)
+
+
+def render_figure(figure, formats=None, dpi=None):
+    """Render a matplotlib figure to {mime: bytes/str}, skipping formats the install cannot write."""
+    data = {}
+    for fmt in formats or DISPLAY_FIGURE_FORMATS:
+        mime = FIGURE_MIME_TYPES.get(fmt)
+        if mime is None:
+            continue
+        buffer = io.BytesIO()
+        try:
+            figure.savefig(buffer, format=fmt, dpi=dpi or DISPLAY_DPI, bbox_inches="tight")
+        except (ValueError, ImportError) as e:
+            logger.debug(f"Figure format {fmt} unavailable: {e}")  # e.g. WebP without Pillow
+            continue
+        value = buffer.getvalue()
+        data[mime] = value.decode("utf-8") if mime == "image/svg+xml" else value
+    return data
+
+
+def render_table(frame, max_rows=None):
+    """HTML and JSON views of the first rows of a DataFrame or Series."""
+    pd = sys.modules["pandas"]
+    max_rows = max_rows or DISPLAY_TABLE_ROWS
+    if isinstance(frame, pd.Series):
+        frame = frame.to_frame()
+    head = frame.head(max_rows)
+    table = json.loads(head.to_json(orient="split", date_format="iso", default_handler=str))
+    table.update({"total_rows": len(frame), "truncated": len(frame) > max_rows})
+    return {
+        "text/html": head.to_html(max_cols=100, border=0),
+        "application/json": table,
+    }
+
+
+def format_value(value):
+    """Build the {mime: data} dict for a value, preferring rich representations."""
+    pd = sys.modules.get("pandas")
+    if pd is not None and isinstance(value, (pd.DataFrame, pd.Series)):
+        data = render_table(value)
+    elif type(value).__module__.startswith("matplotlib") and hasattr(value, "savefig"):
+        data = render_figure(value)
+    else:
+        data = {}
+        for method, mime in REPR_METHODS:
+            repr_method = getattr(value, method, None)
+            if repr_method is None or isinstance(value, type):
+                continue
+            try:
+                rendered = repr_method()
+            except Exception as e:
+                logger.debug(f"{method} failed: {e}")
+                continue
+            if rendered is not None:
+                data[mime] = rendered[0] if isinstance(rendered, tuple) else rendered
+    data.setdefault("text/plain", repr(value))
+    return data
+
+
+def _encode(mime, value):
+    """Turn one representation into a JSON-friendly string plus its metadata."""
+    metadata = {}
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, default=str)
+        metadata["json"] = True
+    if isinstance(value, bytes) and mime in BINARY_MIME_TYPES:
+        return base64.b64encode(value).decode("ascii"), {"encoding": "base64"}
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", errors="replace")
+    if len(value) > DISPLAY_COMPRESS_THRESHOLD:
+        compressed = gzip.compress(value.encode("utf-8"), compresslevel=6)
+        metadata["encoding"] = "gzip+base64"
+        return base64.b64encode(compressed).decode("ascii"), metadata
+    return value, metadata
+
+
+def _truncate_text(value, max_bytes):
+    """Cut text/plain before encoding so gzip output stays valid; returns (encoded, metadata)."""
+    text = value.decode("utf-8", errors="replace") if isinstance(value, bytes) else str(value)
+    limit = max_bytes
+    while True:
+        omitted = len(text) - limit
+        cut = f"{text[:limit]}\n... [{omitted} characters truncated]" if omitted > 0 else text
+        encoded, metadata = _encode("text/plain", cut)
+        if len(encoded) <= max_bytes or limit <= 0:
+            return encoded, metadata
+        limit = max(0, int(limit * max_bytes / len(encoded) * 0.9))  # Encoding can grow text by a third
+
+
+def build_bundle(data, max_bytes=None):
+    """Encode a {mime: data} dict as a display bundle within the size cap.
+
+    Images are base64 encoded and large text is gzipped; if the bundle is
+    still too large the biggest representations are dropped, text/plain
+    last; text/plain itself is shortened before it is encoded.
+    """
+    max_bytes = max_bytes or DISPLAY_MAX_BUNDLE_BYTES
+    encoded, metadata = {}, {}
+    for mime, value in data.items():
+        encoded[mime], meta = _encode(mime, value)
+        if meta:
+            metadata[mime] = meta
+
+    dropped = []
+    total = sum(len(value) for value in encoded.values())
+    for mime in sorted(encoded, key=lambda m: (m == "text/plain", -len(encoded[m]))):
+        if total <= max_bytes:
+            break
+        if mime == "text/plain":
+            encoded[mime], meta = _truncate_text(data[mime], max_bytes - (total - len(encoded[mime])))
+            metadata.pop(mime, None)
+            if meta:
+                metadata[mime] = meta
+            dropped.append(mime)
+            break
+        total -= len(encoded.pop(mime))
+        metadata.pop(mime, None)
+        dropped.append(mime)
+    bundle = {"data": encoded, "metadata": metadata}
+    if dropped:
+        bundle["truncated"] = dropped
+    return bundle
+
+
+class DisplayPublisher:
+    """Collects the display bundles one cell produces."""
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.outputs = []
+
+    def display(self, *values):
+        """Show values below the cell, like IPython's display()."""
+        for value in values:
+            self.publish(format_value(value))
+
+    def publish(self, data):
+        self.outputs.append(build_bundle(data, self.max_bytes))
+
+    def flush_figures(self):
+        """Publish and close every open pyplot figure."""
+        plt = sys.modules.get("matplotlib.pyplot")
+        if plt is None:
+            return
+        for number in plt.get_fignums():
+            figure = plt.figure(number)
+            try:
+                self.publish(render_figure(figure))
+            except Exception as e:
+                logger.error(f"Error rendering figure {number}: {e}")
+            finally:
+                plt.close(figure)
+
+
+# Publisher of the cell currently running in this process (kernels run one cell at a time)
+_current_publisher = None
+
+
+def set_current_publisher(publisher):
+    global _current_publisher
+    _current_publisher = publisher
+
+
+def current_publisher():
+    return _current_publisher
+
+
+# Matplotlib backend that turns plt.show() into display output, see display_backend.py
+DISPLAY_BACKEND = f"module://{__package__ or 'core'}.display_backend"
@@ -0,0 +1,18 @@
+"""Matplotlib backend for kernels: renders with Agg, and plt.show() publishes the
+open figures to the running cell's display output instead of opening a window."""
+from matplotlib.backend_bases import FigureManagerBase
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from .display import current_publisher
+
+FigureCanvas = FigureCanvasAgg
+FigureManager = FigureManagerBase
+
+
+def show(*args, **kwargs):
+    publisher = current_publisher()
+    if publisher is not None:
+        publisher.flush_figures()
+
+
+def draw_if_interactive():
+    pass
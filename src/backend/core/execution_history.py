@@ -0,0 +1,238 @@
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from statistics import median
+from .execution_settings import get_execution_setting, WORKSPACE_PATH
+
+logger = logging.getLogger(__name__)
+
+# History lives next to the other workspace artifacts
+EXECUTION_HISTORY_DB = os.getenv("EXECUTION_HISTORY_DB", os.path.join(WORKSPACE_PATH, "execution_history.db"))
+
+RESOURCE_COLUMNS = ("wall_time", "cpu_user", "cpu_system", "peak_rss", "io_read_bytes", "io_write_bytes")
+
+# Slowdown detection, from the [Execution] section of settings.config
+SLOWDOWN_BASELINE_RUNS = get_execution_setting("slowdown_baseline_runs", 20, int)  # Recent runs a cell is compared with
+SLOWDOWN_MIN_RUNS = get_execution_setting("slowdown_min_runs", 5, int)  # No verdict with fewer runs than this
+SLOWDOWN_THRESHOLD = get_execution_setting("slowdown_threshold", 3.5, float)  # Robust z-score above the median
+SLOWDOWN_MIN_RATIO = get_execution_setting("slowdown_min_ratio", 1.5, float)  # And at least this many times the median
+SLOWDOWN_MIN_SECONDS = 0.1  # Differences below this are noise whatever the statistics say
+MAD_TO_STDDEV = 1.4826  # Scales the median absolute deviation to a standard deviation for normal data
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cell_executions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    executed_at REAL NOT NULL,
+    language TEXT NOT NULL,
+    user_id TEXT,
+    notebook_id TEXT,
+    cell_id TEXT,
+    status TEXT,
+    wall_time REAL,
+    cpu_user REAL,
+    cpu_system REAL,
+    peak_rss INTEGER,
+    io_read_bytes INTEGER,
+    io_write_bytes INTEGER,
+    source_hash TEXT,
+    output_bytes INTEGER,
+    cached INTEGER,
+    baseline_wall_time REAL,  -- Median wall time of the cell's baseline when it ran, NULL without one
+    slow INTEGER  -- 1 when the run was flagged as slower than that baseline
+);
+CREATE INDEX IF NOT EXISTS idx_cell_executions_time ON cell_executions (executed_at);
+CREATE INDEX IF NOT EXISTS idx_cell_executions_notebook ON cell_executions (notebook_id, cell_id);
+CREATE INDEX IF NOT EXISTS idx_cell_executions_source ON cell_executions (notebook_id, cell_id, source_hash, executed_at);
+CREATE INDEX IF NOT EXISTS idx_cell_executions_slow ON cell_executions (slow, executed_at);
+"""
+
+
+def source_hash(source):
+    """Short, stable hash identifying a cell's source."""
+    return hashlib.sha256(source.encode("utf-8", "surrogatepass")).hexdigest()[:16]
+
+
+def output_size(reply):
+    """Characters of output a cell produced: stdout, stderr and its encoded display bundles."""
+    summary = reply.get("summary") or {}
+    size = (summary.get("stdout_chars") or 0) + (summary.get("stderr_chars") or 0)
+    for bundle in reply.get("outputs") or []:
+        size += sum(len(value) for value in (bundle.get("data") or {}).values() if isinstance(value, str))
+    return size
+
+
+def baseline_stats(wall_times):
+    """Median and robust spread (scaled MAD) of a cell's past wall times, or None with too few runs."""
+    if len(wall_times) < max(SLOWDOWN_MIN_RUNS, 1):
+        return None
+    middle = median(wall_times)
+    spread = MAD_TO_STDDEV * median(abs(t - middle) for t in wall_times)
+    return {"runs": len(wall_times), "median": middle, "spread": spread}
+
+
+def is_slowdown(wall_time, baseline):
+    """True when a run is well outside its baseline: far in robust z-score, by ratio and in seconds."""
+    if baseline is None or wall_time is None:
+        return False
+    excess = wall_time - baseline["median"]
+    if excess < SLOWDOWN_MIN_SECONDS or wall_time < baseline["median"] * SLOWDOWN_MIN_RATIO:
+        return False
+    return baseline["spread"] == 0 or excess / baseline["spread"] >= SLOWDOWN_THRESHOLD
+
+
+class ExecutionHistory:
+    """SQLite table of per-cell resource usage, one row per execution.
+
+    Rows are only ever appended. Each successful, non-cached run of a cell
+    is compared with the cell's recent runs of the same source, and the
+    verdict is stored with it, so regressions can be listed by time.
+    """
+
+    def __init__(self, path=EXECUTION_HISTORY_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def _connect(self):
+        if self.connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.row_factory = sqlite3.Row
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    def _baseline_times(self, connection, notebook_id, cell_id, digest, limit=SLOWDOWN_BASELINE_RUNS):
+        """Wall times of the cell's latest comparable runs: same source, succeeded, actually executed."""
+        rows = connection.execute(
+            """
+            SELECT wall_time FROM cell_executions
+            WHERE notebook_id = ? AND cell_id = ? AND source_hash = ? AND status = 'succeeded'
+              AND COALESCE(cached, 0) = 0 AND wall_time IS NOT NULL
+            ORDER BY executed_at DESC LIMIT ?
+            """,
+            [notebook_id, cell_id, digest, int(limit)],
+        ).fetchall()
+        return [row["wall_time"] for row in rows]
+
+    def record(self, language, resources, user_id=None, notebook_id=None, cell_id=None, status=None,
+               source=None, output_bytes=None, cached=False):
+        """Store one execution; never lets a history failure break the cell."""
+        if not resources:
+            return None
+        values = [resources.get(column) for column in RESOURCE_COLUMNS]
+        digest = source_hash(source) if source is not None else None
+        comparable = digest is not None and cell_id is not None and status == "succeeded" and not cached
+        try:
+            with self.lock:
+                connection = self._connect()
+                baseline = None
+                if comparable:
+                    baseline = baseline_stats(self._baseline_times(connection, notebook_id, cell_id, digest))
+                slow = is_slowdown(resources.get("wall_time"), baseline)
+                cursor = connection.execute(
+                    f"INSERT INTO cell_executions (executed_at, language, user_id, notebook_id, cell_id, status, "
+                    f"{', '.join(RESOURCE_COLUMNS)}, source_hash, output_bytes, cached, baseline_wall_time, slow) "
+                    f"VALUES ({', '.join('?' * (11 + len(RESOURCE_COLUMNS)))})",
+                    [time.time(), language, user_id, notebook_id, cell_id, status] + values
+                    + [digest, output_bytes, int(bool(cached)), baseline["median"] if baseline else None, int(slow)],
+                )
+                connection.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error recording execution history: {e}")
+            return None
+        if slow:
+            logger.warning(
+                f"Cell {cell_id} of notebook {notebook_id} took {resources['wall_time']:.2f}s, "
+                f"its baseline is {baseline['median']:.2f}s over {baseline['runs']} runs."
+            )
+        return cursor.lastrowid
+
+    def query(self, user_id=None, notebook_id=None, cell_id=None, language=None, since=None, limit=100):
+        """Most recent executions matching the given filters."""
+        clauses, params = [], []
+        for column, value in (("user_id", user_id), ("notebook_id", notebook_id), ("cell_id", cell_id), ("language", language)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("executed_at >= ?")
+            params.append(since)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.lock:
+            rows = self._connect().execute(
+                f"SELECT * FROM cell_executions {where} ORDER BY executed_at DESC LIMIT ?", params + [int(limit)]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def cell_history(self, notebook_id, cell_id, limit=100):
+        """A cell's runs, newest first, with the baseline of its current source.
+
+        Every run also says whether its source differed from the one before,
+        so a slowdown can be told apart from an edit.
+        """
+        with self.lock:
+            connection = self._connect()
+            rows = [dict(row) for row in connection.execute(
+                "SELECT * FROM cell_executions WHERE notebook_id = ? AND cell_id = ? ORDER BY executed_at DESC LIMIT ?",
+                [notebook_id, cell_id, int(limit) + 1],
+            ).fetchall()]
+            latest = next((row["source_hash"] for row in rows if row["source_hash"]), None)
+            baseline = baseline_stats(self._baseline_times(connection, notebook_id, cell_id, latest)) if latest else None
+        for row, previous in zip(rows, rows[1:] + [None]):
+            row["slow"] = bool(row["slow"])
+            row["source_changed"] = previous is not None and row["source_hash"] != previous["source_hash"]
+            if row["slow"] and row["baseline_wall_time"]:
+                row["slowdown_ratio"] = round(row["wall_time"] / row["baseline_wall_time"], 2)
+        return {"notebook_id": notebook_id, "cell_id": cell_id, "source_hash": latest, "baseline": baseline, "executions": rows[:int(limit)]}
+
+    def slowdowns(self, notebook_id=None, since=None, limit=100):
+        """Runs flagged as slower than their cell's baseline, newest first."""
+        clauses, params = ["slow = 1"], []
+        if notebook_id is not None:
+            clauses.append("notebook_id = ?")
+            params.append(notebook_id)
+        if since is not None:
+            clauses.append("executed_at >= ?")
+            params.append(since)
+        with self.lock:
+            rows = self._connect().execute(
+                f"SELECT * FROM cell_executions WHERE {' AND '.join(clauses)} ORDER BY executed_at DESC LIMIT ?",
+                params + [int(limit)],
+            ).fetchall()
+        slow = []
+        for row in map(dict, rows):
+            row["slow"] = True
+            row["slowdown_ratio"] = round(row["wall_time"] / row["baseline_wall_time"], 2) if row["baseline_wall_time"] else None
+            slow.append(row)
+        return slow
+
+    def usage_by_user(self, since=None, limit=20):
+        """Totals per user, heaviest CPU consumers first."""
+        where, params = ("WHERE executed_at >= ?", [since]) if since is not None else ("", [])
+        with self.lock:
+            rows = self._connect().execute(
+                f"""
+                SELECT user_id,
+                       COUNT(*) AS executions,
+                       SUM(wall_time) AS wall_time,
+                       SUM(COALESCE(cpu_user, 0) + COALESCE(cpu_system, 0)) AS cpu_time,
+                       MAX(peak_rss) AS max_peak_rss,
+                       SUM(io_read_bytes) AS io_read_bytes,
+                       SUM(io_write_bytes) AS io_write_bytes
+                FROM cell_executions {where}
+                GROUP BY user_id
+                ORDER BY cpu_time DESC
+                LIMIT ?
+                """,
+                params + [int(limit)],
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+# Shared history store used by the execution routes
+execution_history = ExecutionHistory()
@@ -0,0 +1,30 @@
+import os
+import logging
+from configparser import ConfigParser
+
+logger = logging.getLogger(__name__)
+
+# Root of everything the backend writes at run time (caches, checkpoints, spools...)
+WORKSPACE_PATH = os.getenv("WORKSPACE_PATH", "workspace")
+
+# Same settings file spark_config.py uses; read on its own so kernels don't start Spark
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(BASE_DIR, "settings.config")
+
+config = ConfigParser(inline_comment_prefixes=("#",))
+try:
+    config.read(CONFIG_FILE)
+except Exception as e:
+    logger.error(f"Error loading config file {CONFIG_FILE}: {e}")
+
+
+def get_execution_setting(key, default, cast=str):
+    """Read a value from the [Execution] section, falling back to a default."""
+    try:
+        if cast is bool:
+            return config.getboolean("Execution", key, fallback=default)
+        value = config.get("Execution", key, fallback=None)
+        return default if value is None else cast(value)
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Invalid [Execution] {key} in {CONFIG_FILE}: {e}")
+        return default
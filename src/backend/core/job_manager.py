@@ -0,0 +1,407 @@
+import os
+import time
+import uuid
+import logging
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .execution_settings import get_execution_setting
+from .kernel_manager import kernel_manager, KernelError, KernelPoolFullError
+
+logger = logging.getLogger(__name__)
+
+# Job settings: the wall-clock limit comes from the [Execution] section of settings.config
+JOB_TIME_LIMIT_SECONDS = get_execution_setting("job_time_limit_seconds", 600, int)
+KERNEL_INTERRUPT_GRACE = float(os.getenv("KERNEL_INTERRUPT_GRACE", 5))  # Seconds before a hard kill
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", 3600))
+MAX_JOB_THREADS = int(os.getenv("MAX_JOB_THREADS", 32))
+# Notebooks running cells at the same time; cells of one notebook always run one after another
+EXECUTION_WORKERS = get_execution_setting("execution_workers", MAX_JOB_THREADS, int)
+
+FINISHED_STATES = {"succeeded", "failed", "cancelled", "timed_out", "killed", "rejected", "skipped"}
+
+
+class _JobStopped(Exception):
+    """Raised to abandon a job that was stopped while waiting for its kernel."""
+
+
+class ExecutionJob:
+    """One cell execution submitted to a notebook kernel."""
+
+    def __init__(self, notebook_id, code, cell_id=None, time_limit=None, on_output=None, on_complete=None, options=None):
+        self.job_id = uuid.uuid4().hex
+        self.notebook_id = notebook_id
+        self.code = code
+        self.cell_id = cell_id
+        self.time_limit = time_limit
+        self.on_output = on_output
+        self.on_complete = on_complete
+        self.options = options or {}
+        self.status = "queued"
+        self.reply = None
+        self.error = None
+        self.created_at = time.time()
+        self.dispatched_at = None  # Left the notebook's queue and got a worker
+        self.started_at = None
+        self.finished_at = None
+        self.interrupted_at = None
+        self.stop_reason = None  # "cancelled" or "timed_out" once a stop was requested
+        self.done = threading.Event()
+
+    @property
+    def deadline(self):
+        if self.started_at is None or not self.time_limit:
+            return None
+        return self.started_at + self.time_limit
+
+    @property
+    def queue_wait(self):
+        """Seconds spent waiting behind other cells (so far, while still queued)."""
+        end = self.dispatched_at or self.finished_at or time.time()
+        return round(end - self.created_at, 4)
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def to_dict(self, include_result=False):
+        data = {
+            "job_id": self.job_id,
+            "notebook_id": self.notebook_id,
+            "cell_id": self.cell_id,
+            "status": self.status,
+            "error": self.error,
+            "time_limit": self.time_limit,
+            "queue_wait": self.queue_wait,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if include_result:
+            data["reply"] = self.reply
+        return data
+
+
+class ExecutionBatch:
+    """An ordered list of cell jobs run back to back in one notebook kernel."""
+
+    def __init__(self, notebook_id, jobs, stop_on_error=True, on_finish=None):
+        self.batch_id = uuid.uuid4().hex
+        self.notebook_id = notebook_id
+        self.jobs = jobs
+        self.stop_on_error = stop_on_error
+        self.on_finish = on_finish
+        self.notebook_state = None  # Filled in by on_finish, if it wants to
+        self.stop_reason = None  # "cancelled", or "failed" once a cell failed with stop_on_error
+        self.finished = queue.Queue()  # Jobs in the order they finish, then None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.done = threading.Event()
+
+    @property
+    def status(self):
+        if not self.done.is_set():
+            return "running" if any(job.started_at for job in self.jobs) else "queued"
+        if self.stop_reason == "cancelled":
+            return "cancelled"
+        return "succeeded" if all(job.status == "succeeded" for job in self.jobs) else "failed"
+
+    def results(self, timeout=None):
+        """Yield each job as it finishes, in cell order, until the batch is over."""
+        while True:
+            job = self.finished.get(timeout=timeout)
+            if job is None:
+                return
+            yield job
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            "batch_id": self.batch_id,
+            "notebook_id": self.notebook_id,
+            "status": self.status,
+            "stop_on_error": self.stop_on_error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "jobs": [job.to_dict() for job in self.jobs],
+        }
+
+
+class JobManager:
+    """Runs cell executions in the background and enforces cancellation and time limits.
+
+    Each notebook has a FIFO queue of jobs and batches. Different notebooks
+    run in parallel, up to `workers` at once (never more than the kernel
+    pool holds, so a busy pool queues cells instead of rejecting them);
+    a notebook's next item starts only when its previous one has finished.
+
+    Stopping a job first interrupts the kernel (KeyboardInterrupt in the
+    cell); if the kernel has not answered after KERNEL_INTERRUPT_GRACE seconds
+    it is killed and will be restarted on the next execution.
+    """
+
+    def __init__(self, kernels=kernel_manager, time_limit=JOB_TIME_LIMIT_SECONDS, grace=KERNEL_INTERRUPT_GRACE,
+                 workers=EXECUTION_WORKERS):
+        self.kernels = kernels
+        self.time_limit = time_limit
+        self.grace = grace
+        self.workers = max(1, min(workers, kernels.max_kernels))
+        self.jobs = {}
+        self.batches = {}
+        self.queues = {}  # notebook_id -> deque of queued jobs and batches
+        self.running = set()  # Notebooks whose current item is on a worker
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cell-job")
+        self._monitor = None
+
+    def _enqueue(self, item):
+        """Queue a job or batch behind the notebook's earlier ones (caller holds the lock)."""
+        self.queues.setdefault(item.notebook_id, deque()).append(item)
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand the head of each idle notebook's queue to a free worker, oldest first (caller holds the lock)."""
+        while len(self.running) < self.workers:
+            ready = [(queue[0].created_at, notebook_id) for notebook_id, queue in self.queues.items()
+                     if notebook_id not in self.running]
+            if not ready:
+                return
+            _, notebook_id = min(ready)
+            queue = self.queues[notebook_id]
+            item = queue.popleft()
+            if not queue:
+                del self.queues[notebook_id]
+            self.running.add(notebook_id)
+            self.executor.submit(self._work, item)
+
+    def _work(self, item):
+        try:
+            if isinstance(item, ExecutionBatch):
+                self._run_batch(item)
+            else:
+                self._run(item)
+        finally:
+            with self.lock:
+                self.running.discard(item.notebook_id)
+                self._dispatch()
+
+    def _withdraw(self, item):
+        """Take a job or batch out of its notebook's queue; False if it already left it."""
+        with self.lock:
+            queue = self.queues.get(item.notebook_id)
+            if queue is None or item not in queue:
+                return False
+            queue.remove(item)
+            if not queue:
+                del self.queues[item.notebook_id]
+            return True
+
+    def queue_length(self, notebook_id):
+        with self.lock:
+            return len(self.queues.get(notebook_id, ()))
+
+    def submit(self, notebook_id, code, cell_id=None, time_limit=None, on_output=None, on_complete=None, **options):
+        """Queue a cell for execution and return its job immediately.
+
+        `time_limit` may only tighten the configured limit. `on_complete(job)`
+        runs on the job thread once the job has finished, whatever the outcome.
+        """
+        if time_limit:
+            time_limit = min(float(time_limit), self.time_limit) if self.time_limit else float(time_limit)
+        job = ExecutionJob(notebook_id, code, cell_id, time_limit or self.time_limit, on_output, on_complete, options)
+        with self.lock:
+            self.jobs[job.job_id] = job
+            self._ensure_monitor()
+            self._enqueue(job)
+        return job
+
+    def submit_batch(self, notebook_id, cells, stop_on_error=True, time_limit=None, on_output=None, on_complete=None,
+                     on_finish=None, **options):
+        """Queue cells ({cell_id, code}) to run one after another in the notebook's kernel.
+
+        The whole batch is one item of the notebook's queue and the cells go
+        straight to the kernel, without a round of HTTP and state copying per
+        cell. `time_limit` applies to each cell; `on_output(cell_id)` returns
+        the output sink of a cell. Cells after a failure are skipped when
+        `stop_on_error` is set. `on_finish(batch)` runs once after the last cell.
+        """
+        if time_limit:
+            time_limit = min(float(time_limit), self.time_limit) if self.time_limit else float(time_limit)
+        jobs = [
+            ExecutionJob(
+                notebook_id, cell.get("code", ""), cell.get("cell_id"), time_limit or self.time_limit,
+                on_output(cell.get("cell_id")) if on_output else None, on_complete, options,
+            )
+            for cell in cells
+        ]
+        batch = ExecutionBatch(notebook_id, jobs, stop_on_error, on_finish)
+        with self.lock:
+            self.jobs.update((job.job_id, job) for job in jobs)
+            self.batches[batch.batch_id] = batch
+            self._ensure_monitor()
+            self._enqueue(batch)
+        return batch
+
+    def _run_batch(self, batch):
+        try:
+            for job in batch.jobs:
+                if batch.stop_reason is not None or job.stop_reason is not None:
+                    self._skip(job, job.stop_reason or ("cancelled" if batch.stop_reason == "cancelled" else "skipped"))
+                else:
+                    self._run(job)
+                    if job.status != "succeeded" and batch.stop_on_error and batch.stop_reason is None:
+                        batch.stop_reason = "failed"
+                batch.finished.put(job)
+        finally:
+            batch.finished_at = time.time()
+            if batch.on_finish is not None:
+                try:
+                    batch.on_finish(batch)
+                except Exception as e:
+                    logger.error(f"Error in completion callback of batch {batch.batch_id}: {str(e)}")
+            batch.finished.put(None)
+            batch.done.set()
+
+    def _skip(self, job, status):
+        """Close a batch job that never ran; no completion callback since nothing executed."""
+        job.status = status
+        job.error = "Skipped: an earlier cell failed" if status == "skipped" else "Stopped before it started"
+        job.finished_at = time.time()
+        job.done.set()
+
+    def get_batch(self, batch_id):
+        with self.lock:
+            return self.batches.get(batch_id)
+
+    def cancel_batch(self, batch_id):
+        """Stop the running cell of a batch and skip the rest; returns the batch, or None."""
+        batch = self.get_batch(batch_id)
+        if batch is None:
+            return None
+        if not batch.done.is_set():
+            batch.stop_reason = "cancelled"
+            if self._withdraw(batch):
+                self._run_batch(batch)  # Never started: every cell is closed as cancelled right away
+            for job in batch.jobs:
+                if job.status == "running":
+                    self._stop(job, "cancelled")
+        return batch
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Request cancellation; returns the job, or None if it does not exist."""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        self._stop(job, "cancelled")
+        return job
+
+    def _run(self, job):
+        def mark_running():
+            if job.stop_reason is not None:
+                raise _JobStopped()
+            job.status = "running"
+            job.started_at = time.time()
+
+        job.dispatched_at = time.time()
+        try:
+            if job.stop_reason is not None:
+                raise _JobStopped()
+            job.reply = self.kernels.execute(
+                job.notebook_id, job.code, cell_id=job.cell_id,
+                on_output=job.on_output, on_start=mark_running, **job.options
+            )
+            if job.stop_reason is not None:
+                status = job.stop_reason
+            elif job.reply.get("status") == "success":
+                status = "succeeded"
+            else:
+                status = "failed"
+            self._finish(job, status, error=job.reply.get("error"))
+        except _JobStopped:
+            self._finish(job, job.stop_reason, error="Stopped before it started")
+        except KernelPoolFullError as e:
+            self._finish(job, "rejected", error=str(e))
+        except KernelError as e:
+            self._finish(job, "killed" if job.stop_reason else "failed", error=str(e))
+        except Exception as e:
+            logger.error(f"Unexpected error in job {job.job_id}: {str(e)}")
+            self._finish(job, "failed", error=str(e))
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        if job.stop_reason == "timed_out":
+            error = f"Execution exceeded the time limit of {job.time_limit:g}s. {error or ''}".strip()
+        job.error = error
+        job.finished_at = time.time()
+        if job.on_complete is not None:
+            try:
+                job.on_complete(job)
+            except Exception as e:
+                logger.error(f"Error in completion callback of job {job.job_id}: {str(e)}")
+        job.done.set()
+
+    def _stop(self, job, reason):
+        if job.status in FINISHED_STATES or job.stop_reason is not None:
+            return
+        job.stop_reason = reason
+        if job.status == "running":
+            self._interrupt(job)
+        elif self._withdraw(job):
+            self._finish(job, reason, error="Stopped before it started")
+        # A job taken off the queue just now is dropped by _run before it reaches the kernel
+
+    def _interrupt(self, job):
+        job.interrupted_at = time.time()
+        kernel = self.kernels.find_kernel(job.notebook_id)
+        if kernel is None or not kernel.interrupt():
+            logger.info(f"Kernel for notebook {job.notebook_id} cannot be interrupted, it will be killed.")
+
+    def _ensure_monitor(self):
+        if self._monitor is None or not self._monitor.is_alive():
+            self._monitor = threading.Thread(target=self._monitor_forever, name="job-monitor", daemon=True)
+            self._monitor.start()
+
+    def _monitor_forever(self):
+        while True:
+            time.sleep(0.5)
+            try:
+                self.check_jobs()
+            except Exception as e:
+                logger.error(f"Error monitoring jobs: {str(e)}")
+
+    def check_jobs(self):
+        """Enforce time limits, escalate unanswered interrupts and forget old jobs."""
+        now = time.time()
+        with self.lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            if job.status == "running":
+                if job.stop_reason is None and job.deadline is not None and now > job.deadline:
+                    logger.warning(f"Job {job.job_id} exceeded its time limit, interrupting.")
+                    self._stop(job, "timed_out")
+                elif job.stop_reason is not None and job.interrupted_at is None:
+                    self._interrupt(job)  # Stop requested just as the job started
+                elif job.interrupted_at is not None and now - job.interrupted_at > self.grace:
+                    logger.warning(f"Kernel for notebook {job.notebook_id} ignored the interrupt, killing it.")
+                    job.interrupted_at = None
+                    self.kernels.kill_kernel(job.notebook_id)
+            elif job.status in FINISHED_STATES and now - job.finished_at > JOB_RETENTION_SECONDS:
+                with self.lock:
+                    self.jobs.pop(job.job_id, None)
+        with self.lock:
+            expired = [
+                batch_id for batch_id, batch in self.batches.items()
+                if batch.finished_at is not None and now - batch.finished_at > JOB_RETENTION_SECONDS
+            ]
+            for batch_id in expired:
+                self.batches.pop(batch_id)
+
+
+# Shared job manager used by the API routes
+job_manager = JobManager()
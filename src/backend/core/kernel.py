@@ -0,0 +1,604 @@
+import os
+import sys
+import time
+import types
+import logging
+import threading
+import importlib
+from contextlib import nullcontext
+from .output_stream import StreamCapture, build_summary
+from .compile_cache import compile_cell
+from .cell_cache import CellCache, CELL_CACHE_ENABLED, pack_variables, unpack_variables
+from .shared_data import is_shareable, write_shared
+from .resource_usage import ResourceMeter
+from .display import DisplayPublisher, DISPLAY_BACKEND, set_current_publisher, render_table
+from .dataframe_viewer import ViewerRegistry, VIEWER_MIME, wants_viewer
+from .state_store import state_store, state_storage_enabled
+from .checkpoint import write_checkpoint, read_checkpoint, RESERVED_NAMES
+from .package_installer import activate_overlay
+from .memory_manager import KernelMemoryManager
+from .lazy_variable import LazyVariable
+from . import spark_pandas
+from .sql_magic import sql_engine, SQL_FUNCTION
+from . import variable_explorer
+from .completion import CompletionCache, complete
+from .profiler import SamplingProfiler
+
+logger = logging.getLogger(__name__)
+
+# Types that can be sent back to the browser as part of the notebook state
+JSON_SAFE_TYPES = (str, int, float, list, dict, bool, type(None))
+PRELUDE_MODULES = {"pd": "pandas", "plt": "matplotlib.pyplot"}  # Cells have always been able to use these unimported
+
+
+def get_serializable_state(namespace):
+    """Return the JSON-friendly subset of a kernel namespace."""
+    return {
+        key: value for key, value in namespace.items()
+        if not key.startswith("_") and not isinstance(value, LazyVariable) and isinstance(value, JSON_SAFE_TYPES)
+    }
+
+
+def _stored_type(fmt):
+    """Type of a state store entry known from its format alone, so isinstance() needs no load."""
+    pd, np = sys.modules.get("pandas"), sys.modules.get("numpy")
+    if fmt == "parquet" and pd is not None:
+        return pd.DataFrame
+    if fmt == "parquet-series" and pd is not None:
+        return pd.Series
+    if fmt.startswith("npy") and np is not None:
+        return np.ndarray
+    if fmt == "module":
+        return types.ModuleType
+    return None  # JSON and pickles are only known once read
+
+
+def preload_modules(names):
+    """Import heavy libraries ahead of the first cell; returns the ones that imported."""
+    os.environ.setdefault("MPLBACKEND", DISPLAY_BACKEND)  # Agg-based, plt.show() becomes display output
+    loaded = []
+    for name in names:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except Exception as e:
+            logger.warning(f"Could not preload {name}: {e}")
+    return loaded
+
+
+def prelude_namespace():
+    """The PRELUDE_MODULES that import, bound once when a kernel namespace is created."""
+    modules = {}
+    for alias, name in PRELUDE_MODULES.items():
+        try:
+            modules[alias] = importlib.import_module(name)
+        except Exception as e:
+            logger.warning(f"Could not import {name} as {alias}: {e}")
+    return modules
+
+
+class KernelRuntime:
+    """State owned by a kernel process: its namespace and its pipe to the parent."""
+
+    def __init__(self, conn, notebook_id):
+        self.conn = conn
+        self.notebook_id = notebook_id
+        self.namespace = {
+            "__name__": "__main__", "__builtins__": __builtins__, "display": self.display, SQL_FUNCTION: sql_engine.run,
+            **prelude_namespace(),
+        }
+        self.publisher = None  # Display output of the running cell
+        self.viewers = ViewerRegistry()  # Large DataFrames kept for paging
+        self.viewers_opened = 0
+        self.stored_hashes = {}  # name -> content hash last written to the state store
+        self.unloaded = {}  # Stored variables not read back yet: name -> manifest entry
+        self.dirty_names = set()  # Names touched by cells since the last snapshot
+        self.memory = KernelMemoryManager()  # Spills large, unused variables when over the memory limit
+        self.mode = "pandas"  # Or "pandas_on_spark", see spark_pandas
+        self.completions = CompletionCache()  # Introspection for completion, dropped when cells change a name
+        self.send_lock = threading.Lock()  # Output flushers share the pipe with replies
+        self.cell_cache = None
+
+    def display(self, *values):
+        """display() as seen by cell code: show values below the running cell."""
+        if self.publisher is None:
+            raise RuntimeError("display() can only be used while a cell is running")
+        for value in values:
+            self.show(value)
+
+    def show(self, value):
+        """Display a value; large DataFrames stay here and are sent as a paged viewer handle."""
+        if spark_pandas.is_spark_frame(value):
+            self.publisher.publish(spark_pandas.render_preview(value))  # Only the first rows leave Spark
+            return
+        if not wants_viewer(value):
+            self.publisher.display(value)
+            return
+        viewer = self.viewers.open(value)
+        self.viewers_opened += 1
+        rows, columns = viewer.frame.shape
+        self.publisher.publish({
+            VIEWER_MIME: viewer.describe(),
+            **render_table(value),
+            "text/plain": f"<{type(value).__name__}: {rows} rows x {columns} columns>",
+        })
+
+    def restore_state(self):
+        """Pick up the notebook's stored variables as LazyVariables; each is read back on first use."""
+        if not state_storage_enabled() or self.notebook_id is None:
+            return 0
+        manifest = state_store.manifest(self.notebook_id)
+        self.stored_hashes = {name: entry["hash"] for name, entry in manifest.items()}
+        self.unloaded = {name: entry for name, entry in manifest.items() if name not in self.namespace}
+        for name, entry in self.unloaded.items():
+            self.namespace[name] = LazyVariable(
+                lambda name=name, entry=entry: self._read_stored(name, entry), _stored_type(entry["format"]),
+                self.namespace, name,
+            )
+        if self.unloaded:
+            logger.info(f"Notebook {self.notebook_id}: {len(self.unloaded)} stored variables available.")
+        return len(self.unloaded)
+
+    def _read_stored(self, name, entry):
+        self.unloaded.pop(name, None)
+        return state_store.load(entry)
+
+    def load_stored(self, names):
+        """Read the given stored or spilled variables into the namespace if they are not loaded yet."""
+        self.memory.load(self.namespace, names)
+        for name in set(names) & set(self.unloaded):
+            value = self.namespace.get(name)
+            if not isinstance(value, LazyVariable):
+                self.unloaded.pop(name)  # Rebound or deleted without a cell naming it
+                continue
+            try:
+                value._lazy_resolve()
+            except Exception as e:
+                logger.error(f"Could not restore variable {name}: {e}")
+                self.unloaded.pop(name, None)
+                if self.namespace.get(name) is value:
+                    del self.namespace[name]
+
+    def get_cell_cache(self):
+        if self.cell_cache is None:
+            self.cell_cache = CellCache()
+        return self.cell_cache
+
+    def send(self, message):
+        with self.send_lock:
+            self.conn.send(message)
+
+    def stream_sink(self, msg_id):
+        """Sink that forwards captured output to the parent as it is produced."""
+        def sink(name, text):
+            self.send({"msg_id": msg_id, "type": "stream", "name": name, "text": text})
+        return sink
+
+
+def run_cell(code, namespace, filename="<cell>"):
+    """Execute a cell and return the value of its last expression, like a notebook does.
+
+    A trailing semicolon suppresses the value. Unchanged cells reuse their
+    code objects from the compile cache.
+    """
+    body, last = compile_cell(code, filename).split
+    exec(body, namespace)
+    if last is not None:
+        return eval(last, namespace)
+    return None
+
+
+def _lookup_cached_cell(kernel, code):
+    """Return (cache, key, defines, entry) for a cacheable cell; entry is None on a miss."""
+    compiled = compile_cell(code)
+    if compiled.tree is None:
+        return None, None, None, None
+    defines, reads = compiled.analysis()
+    cache = kernel.get_cell_cache()
+    key = cache.make_key(compiled.tree, reads, kernel.namespace)
+    if key is None:
+        return None, None, None, None
+    return cache, key, defines, cache.load(key)
+
+
+def _track_memory(kernel, reply, names):
+    """Note what the cell used and spill cold variables if the kernel is over its memory limit."""
+    kernel.completions.invalidate(names)  # Reads too: df["x"] = ... changes df's columns in place
+    kernel.memory.touch(kernel.namespace, names)
+    protected = kernel.dirty_names if state_storage_enabled() else ()  # Not in the state store yet
+    reply["spilled"] = kernel.memory.maybe_spill(kernel.namespace, protected)
+    reply["tracked_bytes"] = kernel.memory.tracked_bytes()  # Lets the manager tell data from leaks
+    return reply
+
+
+def handle_execute(kernel, message):
+    """Execute a cell inside the kernel namespace and capture its output.
+
+    The JSON-friendly part of the namespace is sent back too unless
+    `include_state` is false; batches ask for it once, after the last cell.
+    """
+    reply = _execute_cell(kernel, message)
+    if message.get("include_state", True):
+        reply["notebook_state"] = get_serializable_state(kernel.namespace)
+    return reply
+
+
+def _execute_cell(kernel, message):
+    code = message.get("code", "")
+    cell_id = message.get("cell_id")
+    sink = kernel.stream_sink(message.get("msg_id")) if message.get("stream") else None
+
+    started_at = time.time()
+    compiled = compile_cell(code)
+    cell_defines, cell_reads = compiled.analysis()
+    cell_deletes = compiled.deletes
+    kernel.load_stored(cell_reads | cell_deletes)  # Stored and spilled variables are read back on first use
+    kernel.memory.forget(kernel.namespace, cell_defines - cell_reads)
+    used = cell_defines | cell_reads | cell_deletes
+    kernel.unloaded = {k: v for k, v in kernel.unloaded.items() if k not in cell_defines}
+    if state_storage_enabled():
+        kernel.dirty_names |= cell_defines | cell_reads  # Reads cover in-place changes like df.drop(..., inplace=True)
+
+    profile = bool(message.get("profile"))  # A profiled cell always runs, its cached result would say nothing
+    cache = cache_key = defines = None
+    if message.get("cache") and CELL_CACHE_ENABLED and not profile:
+        cache, cache_key, defines, entry = _lookup_cached_cell(kernel, code)
+        if entry is not None:
+            return _track_memory(kernel, _replay_cached_cell(kernel, entry, cell_id, sink, started_at), used)
+
+    stdout_capture = StreamCapture("stdout", sink)
+    stderr_capture = StreamCapture("stderr", sink)
+    meter = ResourceMeter()  # The kernel runs one cell at a time, so process totals are the cell's
+    profiler = SamplingProfiler(root_code=run_cell.__code__) if profile else None
+    publisher = kernel.publisher = DisplayPublisher()
+    kernel.viewers_opened = 0
+    set_current_publisher(publisher)
+    old_stdout, old_stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = stdout_capture, stderr_capture  # Redirect output
+    try:
+        with meter:
+            with profiler or nullcontext():
+                value = run_cell(code, kernel.namespace)
+            if value is not None:
+                kernel.show(value)
+            publisher.flush_figures()  # Figures the cell drew but never showed
+        status = "success"
+        error = None
+    except KeyboardInterrupt:
+        status = "interrupted"
+        error = "KeyboardInterrupt: execution was interrupted"
+    except Exception as e:
+        status = "error"
+        error = f"Error: {str(e)}"
+    finally:
+        sys.stdout, sys.stderr = old_stdout, old_stderr  # Restore default output
+        stdout_capture.close()
+        stderr_capture.close()
+        kernel.publisher = None
+        set_current_publisher(None)
+
+    output = stdout_capture.getvalue().strip()
+    truncated = stdout_capture.omitted_chars > 0 or stderr_capture.omitted_chars > 0  # Spools expire, replays can't
+    if cache_key is not None and status == "success" and not kernel.viewers_opened and not truncated:  # Nor handles
+        cache.store(
+            cache_key,
+            {"stdout": stdout_capture.getvalue(), "stderr": stderr_capture.getvalue(), "display": publisher.outputs},
+            pack_variables(kernel.namespace, defines),
+        )
+    reply = {
+        "status": status,
+        "result": error or output or f"Execution of cell {cell_id} finished successfully!",
+        "error": error,
+        "stderr": stderr_capture.getvalue(),  # Warnings and logging; bounded like stdout
+        "cached": False,
+        "outputs": publisher.outputs,
+        "summary": build_summary(stdout_capture, stderr_capture, started_at),
+        "resources": meter.usage(),
+    }
+    if profiler is not None:
+        reply["profile"] = profiler.report()
+    return _track_memory(kernel, reply, used)
+
+
+def _replay_cached_cell(kernel, entry, cell_id, sink, started_at):
+    """Restore a cached cell's variables and replay its output without running it."""
+    stdout_capture = StreamCapture("stdout", sink)
+    stderr_capture = StreamCapture("stderr", sink)
+    with ResourceMeter() as meter:
+        kernel.namespace.update(unpack_variables(entry["variables"]))
+        stdout_capture.write(entry["outputs"].get("stdout", ""))
+        stderr_capture.write(entry["outputs"].get("stderr", ""))
+        stdout_capture.close()
+        stderr_capture.close()
+
+    output = stdout_capture.getvalue().strip()
+    return {
+        "status": "success",
+        "result": output or f"Execution of cell {cell_id} finished successfully!",
+        "error": None,
+        "stderr": stderr_capture.getvalue(),
+        "cached": True,
+        "outputs": entry["outputs"].get("display", []),
+        "summary": build_summary(stdout_capture, stderr_capture, started_at),
+        "resources": meter.usage(),
+    }
+
+
+def handle_export_variable(kernel, message):
+    """Publish a DataFrame/ndarray variable as a memory-mapped file the API process can read.
+
+    With `rows`, only that many leading rows are written, e.g. for a preview.
+    """
+    name = message.get("name")
+    rows = message.get("rows")
+    kernel.load_stored([name])
+    if name not in kernel.namespace:
+        return {"status": "error", "message": f"Variable '{name}' is not defined"}
+    value = kernel.namespace[name]
+    if not is_shareable(value):
+        return {"status": "error", "message": f"Variable '{name}' of type {type(value).__name__} cannot be shared"}
+    shape = value.shape
+    total_rows = shape[0] if shape else 1
+    if rows is not None and shape:
+        value = value.iloc[:rows] if hasattr(value, "iloc") else value[:rows]
+    descriptor = write_shared(value)
+    descriptor["total_rows"] = total_rows
+    return {"status": "success", "descriptor": descriptor}
+
+
+def handle_view_rows(kernel, message):
+    """Return one page of a DataFrame viewer, optionally sorted and filtered."""
+    viewer = kernel.viewers.get(message.get("handle_id"))
+    if viewer is None:
+        return {"status": "error", "message": "Viewer not found, re-run the cell to reopen it"}
+    page = viewer.page(
+        message.get("offset", 0), message.get("limit", 100),
+        sort=message.get("sort"), ascending=message.get("ascending", True), filters=message.get("filters"),
+    )
+    return {"status": "success", "page": page}
+
+
+def handle_close_view(kernel, message):
+    if not kernel.viewers.close(message.get("handle_id")):
+        return {"status": "error", "message": "Viewer not found"}
+    return {"status": "success"}
+
+
+def handle_snapshot(kernel, message):
+    """Write the variables cells touched since the last snapshot to the state store."""
+    if kernel.notebook_id is None:
+        return {"status": "error", "message": "Kernel is not attached to a notebook"}
+    names = message.get("names")
+    names = set(names) if names is not None else set(kernel.dirty_names)
+    names -= set(kernel.unloaded)  # Still identical to what is stored
+    names -= set(kernel.memory.spilled)  # Left the namespace unchanged since the last cell that used them
+    names -= RESERVED_NAMES
+    report, kernel.stored_hashes = state_store.snapshot(kernel.notebook_id, kernel.namespace, names, kernel.stored_hashes)
+    kernel.dirty_names -= names
+    return {"status": "success", "report": report}
+
+
+def handle_list_variables(kernel, message):
+    """Cheap summaries of the namespace; stored variables not loaded yet are listed from the manifest."""
+    page = variable_explorer.list_variables(
+        kernel.namespace, message.get("offset", 0), message.get("limit", 100),
+        include_modules=bool(message.get("include_modules")), hidden=RESERVED_NAMES,
+    )
+    page["unloaded"] = [
+        {"name": name, "type": entry.get("type_name"), "kind": "stored", "memory_bytes": entry.get("nbytes"), "expandable": True}
+        for name, entry in sorted(kernel.unloaded.items())
+    ]
+    page["spilled"] = kernel.memory.info()
+    return {"status": "success", "page": page}
+
+
+def handle_inspect_variable(kernel, message):
+    """Details of one variable (rows, items, columns, describe, memory...), one page at a time."""
+    name = message.get("name")
+    kernel.load_stored([name])
+    if name not in kernel.namespace or name.startswith("_"):
+        return {"status": "error", "message": f"Variable '{name}' is not defined"}
+    try:
+        page = variable_explorer.inspect(
+            kernel.namespace[name], message.get("section"), message.get("offset", 0), message.get("limit", 100),
+        )
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    return {"status": "success", "page": page}
+
+
+def handle_checkpoint(kernel, message):
+    """Write the whole namespace to a checkpoint that a later kernel can map back."""
+    if kernel.notebook_id is None:
+        return {"status": "error", "message": "Kernel is not attached to a notebook"}
+    manifest = write_checkpoint(
+        kernel.notebook_id, kernel.namespace, message.get("reason", "manual"), spilled=kernel.memory.spilled,
+    )
+    manifest["variables"] = sorted(manifest["variables"])
+    return {"status": "success", "checkpoint": manifest}
+
+
+def handle_restore(kernel, message):
+    """Load a checkpoint into the namespace; arrays stay memory-mapped until written to."""
+    if kernel.notebook_id is None:
+        return {"status": "error", "message": "Kernel is not attached to a notebook"}
+    try:
+        values, manifest = read_checkpoint(kernel.notebook_id, message.get("checkpoint_id"))
+    except FileNotFoundError as e:
+        return {"status": "error", "message": str(e)}
+    kernel.memory.forget(kernel.namespace, values)
+    kernel.namespace.update(values)
+    kernel.completions.invalidate(values)
+    kernel.memory.touch(kernel.namespace, values)
+    for name in values:
+        kernel.unloaded.pop(name, None)  # The checkpoint is newer than the state store
+    kernel.dirty_names |= set(values)
+    return {
+        "status": "success",
+        "checkpoint_id": manifest["checkpoint_id"],
+        "restored": sorted(values),
+        "skipped": manifest["skipped"],
+    }
+
+
+def handle_set_mode(kernel, message):
+    """Switch between plain pandas and pandas-on-Spark for the cells that follow."""
+    mode = message.get("mode")
+    if mode not in spark_pandas.EXECUTION_MODES:
+        return {"status": "error", "message": f"Unknown mode {mode}, expected one of {', '.join(spark_pandas.EXECUTION_MODES)}"}
+    if mode != kernel.mode:
+        if mode == "pandas_on_spark":
+            spark_pandas.enable(kernel.namespace)
+        else:
+            spark_pandas.disable(kernel.namespace)
+        kernel.mode = mode
+        kernel.completions.clear()  # pd is another module now
+    return {"status": "success", "mode": kernel.mode}
+
+
+def handle_attach(kernel, message):
+    """Hand a pre-warmed kernel to a notebook."""
+    kernel.notebook_id = message.get("notebook_id")
+    activate_overlay(kernel.notebook_id)
+    try:
+        kernel.restore_state()
+    except Exception as e:
+        logger.error(f"Could not read stored state of notebook {kernel.notebook_id}: {e}")
+    return {"status": "success"}
+
+
+def handle_state(kernel, message):
+    """The JSON-friendly part of the namespace."""
+    return {"status": "success", "notebook_state": get_serializable_state(kernel.namespace)}
+
+
+def handle_refresh_packages(kernel, message):
+    """Pick up packages just installed into the notebook's overlay."""
+    path = activate_overlay(kernel.notebook_id)
+    return {"status": "success", "overlay": path}
+
+
+def handle_complete(kernel, message):
+    """Completions and call signature at a cursor position, from the live namespace.
+
+    Served on the completion thread, so it answers while a cell is running;
+    stored and spilled variables are offered by name without loading them.
+    """
+    reply = complete(
+        kernel.namespace, message.get("code", ""), message.get("cursor"), kernel.completions,
+        extra_names=list(kernel.unloaded) + list(kernel.memory.spilled),
+    )
+    return {"status": "success", **reply}
+
+
+def handle_ping(kernel, message):
+    """Liveness check used by the kernel manager."""
+    return {"status": "success", "variables": len(kernel.namespace)}
+
+
+# Operations understood by a kernel process
+HANDLERS = {
+    "execute": handle_execute,
+    "ping": handle_ping,
+    "state": handle_state,
+    "refresh_packages": handle_refresh_packages,
+    "attach": handle_attach,
+    "snapshot": handle_snapshot,
+    "checkpoint": handle_checkpoint,
+    "restore": handle_restore,
+    "view_rows": handle_view_rows,
+    "close_view": handle_close_view,
+    "export_variable": handle_export_variable,
+    "variables": handle_list_variables,
+    "inspect_variable": handle_inspect_variable,
+    "set_mode": handle_set_mode,
+}
+
+# Operations served on the side channel by their own thread, next to whatever the main loop is running
+SIDE_HANDLERS = {
+    "complete": handle_complete,
+    "ping": handle_ping,
+}
+
+
+def serve_side_channel(kernel, conn):
+    """Answer side-channel requests until the parent closes the pipe.
+
+    Only SIGINT's target is the main thread, so interrupting a cell never
+    lands here. Handlers must only read kernel state.
+    """
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        op = message.get("op")
+        handler = SIDE_HANDLERS.get(op)
+        try:
+            if handler is None:
+                reply = {"status": "error", "message": f"Unknown side channel operation: {op}"}
+            else:
+                reply = handler(kernel, message)
+        except Exception as e:
+            reply = {"status": "error", "message": str(e)}
+        reply["msg_id"] = message.get("msg_id")
+        try:
+            conn.send(reply)
+        except (EOFError, OSError):
+            break
+
+
+def kernel_main(conn, notebook_id, preload=(), side_conn=None):
+    """Entry point of a kernel process: serve requests until shutdown.
+
+    The namespace lives for as long as the process does, so cells only send
+    code in and get output back instead of shipping the whole state around.
+    Kernels forked from the template already have `preload` imported.
+    `side_conn` is served by a thread for requests (completion) that must
+    not wait for the running cell.
+    """
+    preload_modules(preload)
+    kernel = KernelRuntime(conn, notebook_id)
+    if side_conn is not None:
+        threading.Thread(target=serve_side_channel, args=(kernel, side_conn), name="kernel-side", daemon=True).start()
+    activate_overlay(notebook_id)
+    try:
+        kernel.restore_state()
+    except Exception as e:
+        logger.error(f"Could not read stored state of notebook {notebook_id}: {e}")
+    logger.info(f"Kernel for notebook {notebook_id or '(warm)'} started.")
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break  # Parent went away
+        except KeyboardInterrupt:
+            continue
+
+        op = message.get("op")
+        if op == "shutdown":
+            kernel.send({"msg_id": message.get("msg_id"), "status": "success"})
+            break
+
+        handler = HANDLERS.get(op)
+        try:
+            if handler is None:
+                reply = {"status": "error", "message": f"Unknown kernel operation: {op}"}
+            else:
+                reply = handler(kernel, message)
+        except KeyboardInterrupt:
+            reply = {"status": "interrupted", "message": "Operation was interrupted"}
+        except Exception as e:
+            reply = {"status": "error", "message": str(e)}
+
+        reply["msg_id"] = message.get("msg_id")
+        try:
+            kernel.send(reply)
+        except KeyboardInterrupt:
+            kernel.send(reply)  # An interrupt that arrived just too late must not lose the reply
+        except (EOFError, OSError):
+            break
+
+    kernel.memory.close()
+    logger.info(f"Kernel for notebook {kernel.notebook_id} stopped.")
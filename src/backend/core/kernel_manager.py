@@ -0,0 +1,750 @@
+import os
+import time
+import signal
+import uuid
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from .kernel import kernel_main
+from .kernel_template import KernelTemplate, ForkedKernelProcess, is_supported as template_supported
+from .execution_settings import get_execution_setting
+from .checkpoint import pending_checkpoint, CHECKPOINT_ON_EVICT, CHECKPOINT_INTERVAL, CHECKPOINT_TIMEOUT
+from .spark_pandas import EXECUTION_MODES
+from .resource_usage import current_rss
+from .state_store import state_store, state_storage_enabled, STATE_GC_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Pool settings (overridable through the environment)
+MAX_KERNELS = int(os.getenv("MAX_KERNELS", os.getenv("MAX_WORKERS", 4)))
+KERNEL_IDLE_TIMEOUT = int(os.getenv("KERNEL_IDLE_TIMEOUT", 1800))  # Seconds
+# "template" forks kernels from a process with the preload modules already imported
+KERNEL_START_METHOD = os.getenv("KERNEL_START_METHOD", "template" if template_supported() else "spawn")
+KERNEL_PRELOAD_MODULES = [
+    name.strip() for name in
+    get_execution_setting("kernel_preload_modules", "numpy,pandas,matplotlib.pyplot,pyarrow").split(",")
+    if name.strip()
+]
+KERNEL_WARM_POOL_SIZE = get_execution_setting("kernel_warm_pool_size", 1, int)  # Ready, unassigned kernels
+COMPLETION_TIMEOUT = get_execution_setting("completion_timeout_seconds", 2, float)  # Completion gives up after this
+# Recycling: restart kernels whose memory keeps growing beyond what their variables explain
+KERNEL_RECYCLE_RSS_MB = get_execution_setting("kernel_recycle_rss_mb", 8192, int)  # Hard cap, 0 disables
+KERNEL_LEAK_SAMPLES = get_execution_setting("kernel_leak_samples", 10, int)  # Post-cell samples the trend is judged on
+KERNEL_LEAK_GROWTH_MB = get_execution_setting("kernel_leak_growth_mb", 512, int)  # 0 disables leak detection
+KERNEL_RECYCLE_MIN_INTERVAL = get_execution_setting("kernel_recycle_min_interval_seconds", 600, int)
+LEAK_RISING_SHARE = 0.8  # Share of sample-to-sample steps that must go up to call it a trend
+MB = 1024 ** 2
+
+
+class KernelPoolFullError(RuntimeError):
+    """Raised when every kernel slot is busy and none can be evicted."""
+
+
+class KernelError(RuntimeError):
+    """Raised when a kernel process dies or stops answering."""
+
+
+class KernelRetiredError(KernelError):
+    """Raised when a request reaches a kernel that was replaced or shut down; look the kernel up again."""
+
+
+class KernelProcess:
+    """Parent-side handle of one long-lived kernel process."""
+
+    def __init__(self, notebook_id, context, template=None, preload=()):
+        self.notebook_id = notebook_id
+        self.context = context
+        self.template = template
+        self.preload = preload
+        self.conn = None
+        self.side_conn = None  # Served by a kernel thread, so completion does not wait for the running cell
+        self.process = None
+        self.lock = threading.Lock()  # One request at a time per kernel
+        self.side_lock = threading.Lock()  # And one at a time on the side channel
+        self.started_at = time.time()
+        self.last_used = self.started_at
+        self.attached_at = self.started_at if notebook_id is not None else None
+        self.execution_count = 0
+        self.needs_checkpoint = False  # Namespace changed since the last checkpoint
+        self.checkpointed_at = None
+        self.rss = None  # Last sampled resident set size in bytes
+        self.unexplained_rss = deque(maxlen=max(2, KERNEL_LEAK_SAMPLES))  # RSS minus tracked variables, after each cell
+        self.recycle_reason = None  # Set when the kernel should be restarted at its next idle moment
+        self.recycle_count = 0
+        self.recycled_at = None
+        self.rss_floor = 0  # RSS right after a recycle restored the namespace; the cap only counts growth past it
+        self.retired = False  # Set under the lock once the kernel must not run anything else
+
+    def start(self):
+        """Fork the kernel from the template, or start a fresh interpreter without one."""
+        self.conn, child_conn = self.context.Pipe()
+        self.side_conn, child_side_conn = self.context.Pipe()
+        try:
+            if self.template is not None:
+                self.process = ForkedKernelProcess(self.template.fork(child_conn, self.notebook_id, child_side_conn))
+            else:
+                self.process = self.context.Process(
+                    target=kernel_main,
+                    args=(child_conn, self.notebook_id, self.preload, child_side_conn),
+                    name=f"kernel-{self.notebook_id or 'warm'}",
+                    daemon=True,
+                )
+                self.process.start()
+        finally:
+            child_conn.close()  # Only the kernel holds this end, so its death shows up as EOF
+            child_side_conn.close()
+        logger.info(f"Started kernel for notebook {self.notebook_id or '(warm)'} (pid {self.process.pid}).")
+
+    def attach(self, notebook_id, timeout=5):
+        """Assign a pre-warmed kernel to a notebook."""
+        reply = self.request("attach", timeout=timeout, notebook_id=notebook_id)
+        if reply.get("status") != "success":
+            raise KernelError(f"Warm kernel could not be attached: {reply.get('message')}")
+        self.notebook_id = notebook_id
+        self.attached_at = time.time()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def is_busy(self):
+        return self.lock.locked()
+
+    def request(self, op, timeout=None, on_stream=None, on_start=None, **payload):
+        """Send one operation to the kernel and wait for its reply.
+
+        Output batches the kernel streams while working are passed to
+        `on_stream(name, text)` as they arrive. `on_start()` is called once
+        this request has the kernel to itself, right before it is sent.
+        """
+        with self.lock:
+            if self.retired:
+                raise KernelRetiredError(f"Kernel for notebook {self.notebook_id} was retired.")
+            return self._request(op, timeout, on_stream, on_start, **payload)
+
+    def _request(self, op, timeout=None, on_stream=None, on_start=None, **payload):
+        """request() for a caller that already holds the kernel's lock."""
+        if on_start is not None:
+            on_start()
+        self.last_used = time.time()
+        msg_id = uuid.uuid4().hex
+        try:
+            self.conn.send({"op": op, "msg_id": msg_id, **payload})
+            reply = self._receive(msg_id, timeout, on_stream)
+        except (EOFError, OSError) as e:
+            raise KernelError(f"Kernel for notebook {self.notebook_id} died: {e}")
+        finally:
+            self.last_used = time.time()
+        if op == "execute":
+            self.execution_count += 1
+        if op in ("execute", "restore"):
+            self.needs_checkpoint = True
+        return reply
+
+    def _receive(self, msg_id, timeout, on_stream=None):
+        """Read messages until the reply to msg_id arrives, skipping stale ones."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            if not self.conn.poll(remaining):
+                raise KernelError(f"Kernel for notebook {self.notebook_id} did not answer within {timeout}s.")
+            message = self.conn.recv()
+            if message.get("msg_id") != msg_id:
+                continue
+            if message.get("type") == "stream":
+                if on_stream is not None:
+                    on_stream(message["name"], message["text"])
+                continue
+            return message
+
+    def side_request(self, op, timeout=None, **payload):
+        """Send a read-only operation over the side channel; answered even while a cell runs."""
+        with self.side_lock:
+            msg_id = uuid.uuid4().hex
+            deadline = None if timeout is None else time.time() + timeout
+            try:
+                self.side_conn.send({"op": op, "msg_id": msg_id, **payload})
+                while True:
+                    remaining = None if deadline is None else max(0, deadline - time.time())
+                    if not self.side_conn.poll(remaining):
+                        raise KernelError(f"Kernel for notebook {self.notebook_id} did not answer within {timeout}s.")
+                    reply = self.side_conn.recv()
+                    if reply.get("msg_id") == msg_id:
+                        return reply  # Replies to requests that timed out earlier are skipped
+            except (EOFError, OSError) as e:
+                raise KernelError(f"Kernel for notebook {self.notebook_id} died: {e}")
+
+    def checkpoint(self, reason="manual", timeout=CHECKPOINT_TIMEOUT):
+        """Write the kernel's namespace to a checkpoint; returns its manifest."""
+        reply = self.request("checkpoint", timeout=timeout, reason=reason)
+        if reply.get("status") != "success":
+            raise LookupError(reply.get("message"))
+        self.needs_checkpoint = False
+        self.checkpointed_at = time.time()
+        return reply["checkpoint"]
+
+    def sample_memory(self, tracked_bytes=None):
+        """Sample the kernel's RSS and flag it for recycling when over the cap or leaking.
+
+        After a cell, `tracked_bytes` (the size of its DataFrames and arrays)
+        is subtracted so that loading data does not look like a leak.
+        """
+        self.rss = current_rss(self.process.pid)
+        if self.rss is None:
+            return None
+        if tracked_bytes is not None:
+            self.unexplained_rss.append(self.rss - tracked_bytes)
+        if self.recycle_reason is None:
+            self.recycle_reason = self._recycle_reason()
+        return self.rss
+
+    def _recycle_reason(self):
+        if KERNEL_RECYCLE_RSS_MB > 0 and self.rss > KERNEL_RECYCLE_RSS_MB * MB and \
+                self.rss - self.rss_floor > KERNEL_LEAK_GROWTH_MB * MB:
+            return "rss_cap"
+        samples = list(self.unexplained_rss)
+        if KERNEL_LEAK_GROWTH_MB > 0 and len(samples) == self.unexplained_rss.maxlen:
+            rising = sum(later > earlier for earlier, later in zip(samples, samples[1:]))
+            if rising >= LEAK_RISING_SHARE * (len(samples) - 1) and samples[-1] - samples[0] > KERNEL_LEAK_GROWTH_MB * MB:
+                return "leak"
+        return None
+
+    def interrupt(self):
+        """Raise KeyboardInterrupt in the running cell; returns False where unsupported."""
+        if os.name == "nt" or not self.is_alive():
+            return False  # Windows has no per-process SIGINT
+        try:
+            os.kill(self.process.pid, signal.SIGINT)
+            return True
+        except OSError as e:
+            logger.warning(f"Could not interrupt kernel for notebook {self.notebook_id}: {e}")
+            return False
+
+    def kill(self, timeout=5):
+        """Kill the kernel process immediately; its namespace is lost."""
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout)
+        if not self.is_busy():
+            self.conn.close()
+        if not self.side_lock.locked():
+            self.side_conn.close()
+
+    def shutdown(self, timeout=5):
+        """Ask the kernel to exit, killing it if it does not comply."""
+        try:
+            if self.is_alive() and self.lock.acquire(timeout=timeout):
+                self.retired = True
+                try:
+                    self.conn.send({"op": "shutdown", "msg_id": uuid.uuid4().hex})
+                    if self.conn.poll(timeout):
+                        self.conn.recv()
+                except (EOFError, OSError):
+                    pass
+                finally:
+                    self.lock.release()
+            self.process.join(timeout)
+        finally:
+            if self.process.is_alive():
+                logger.warning(f"Kernel for notebook {self.notebook_id} did not exit, terminating.")
+                self.process.terminate()
+                self.process.join(timeout)
+            self.conn.close()
+            self.side_conn.close()
+
+    def info(self):
+        return {
+            "notebook_id": self.notebook_id,
+            "pid": self.process.pid,
+            "alive": self.is_alive(),
+            "busy": self.is_busy(),
+            "started_at": self.started_at,
+            "attached_at": self.attached_at,
+            "last_used": self.last_used,
+            "execution_count": self.execution_count,
+            "checkpointed_at": self.checkpointed_at,
+            "rss": self.rss,
+            "recycle_count": self.recycle_count,
+            "recycled_at": self.recycled_at,
+        }
+
+
+class KernelManager:
+    """Keeps one kernel per notebook, bounded by an LRU pool with idle eviction.
+
+    A few unassigned kernels are kept warm so that a new notebook gets a
+    running interpreter with the heavy libraries imported straight away.
+    """
+
+    def __init__(self, max_kernels=MAX_KERNELS, idle_timeout=KERNEL_IDLE_TIMEOUT, start_method=KERNEL_START_METHOD,
+                 preload=KERNEL_PRELOAD_MODULES, warm_pool_size=KERNEL_WARM_POOL_SIZE):
+        self.max_kernels = max_kernels
+        self.idle_timeout = idle_timeout
+        self.preload = list(preload)
+        self.warm_pool_size = warm_pool_size
+        if start_method == "template" and not template_supported():
+            logger.warning("Kernel template needs fork and Unix sockets, falling back to spawn.")
+            start_method = "spawn"
+        self.start_method = start_method
+        self.context = multiprocessing.get_context("spawn" if start_method == "template" else start_method)
+        self.template = KernelTemplate(self.preload) if start_method == "template" else None
+        self.kernels = OrderedDict()  # notebook_id -> KernelProcess, least recently used first
+        self.warm = []  # Started kernels not yet assigned to a notebook
+        self.modes = {}  # notebook_id -> execution mode other than plain pandas, re-applied to new kernels
+        self.starting = {}  # notebook_id -> Event set once the kernel being started for it is registered (or failed)
+        self.lock = threading.Lock()
+        self._reaper = None
+        self.state_gc_at = time.time()  # Last sweep of unreferenced state blobs
+        self._filling = False
+
+    def _new_kernel(self, notebook_id):
+        kernel = KernelProcess(notebook_id, self.context, template=self.template, preload=self.preload)
+        try:
+            kernel.start()
+        except (OSError, RuntimeError) as e:
+            if self.template is None:
+                raise KernelError(f"Could not start a kernel: {e}")
+            logger.error(f"Kernel template failed ({e}), starting a plain kernel instead.")
+            kernel = KernelProcess(notebook_id, self.context, preload=self.preload)
+            kernel.start()
+        return kernel
+
+    def _take_warm_kernel(self, notebook_id):
+        """Pop a live warm kernel and attach it to the notebook, or return None; attaching happens outside the lock."""
+        while True:
+            with self.lock:
+                if not self.warm:
+                    return None
+                kernel = self.warm.pop(0)
+            try:
+                if kernel.is_alive():
+                    kernel.attach(notebook_id)
+                    return kernel
+            except KernelError as e:
+                logger.warning(f"Discarding warm kernel: {e}")
+            kernel.kill()
+
+    def prewarm(self):
+        """Top the warm pool up in the background (no-op inside kernel processes)."""
+        if self.warm_pool_size <= 0 or multiprocessing.parent_process() is not None:
+            return
+        with self.lock:
+            if self._filling or len(self.warm) >= self.warm_pool_size:
+                return
+            self._filling = True
+        threading.Thread(target=self._fill_warm_pool, name="kernel-prewarm", daemon=True).start()
+
+    def _fill_warm_pool(self):
+        try:
+            while True:
+                with self.lock:
+                    self.warm = [k for k in self.warm if k.is_alive()]
+                    if len(self.warm) >= self.warm_pool_size:
+                        break
+                kernel = self._new_kernel(None)
+                with self.lock:
+                    self.warm.append(kernel)
+                self._ensure_reaper()
+        except Exception as e:
+            logger.error(f"Error pre-warming kernels: {str(e)}")
+        finally:
+            with self.lock:
+                self._filling = False
+
+    def _retire(self, kernel, reason):
+        """Shut a kernel down, checkpointing its namespace first so the notebook can pick it up again."""
+        if CHECKPOINT_ON_EVICT and kernel.notebook_id is not None and kernel.needs_checkpoint and kernel.is_alive():
+            try:
+                manifest = kernel.checkpoint(reason)
+                logger.info(
+                    f"Checkpointed notebook {kernel.notebook_id} before stopping its kernel "
+                    f"({len(manifest['variables'])} variables, {manifest['duration']}s)."
+                )
+            except Exception as e:
+                logger.error(f"Could not checkpoint notebook {kernel.notebook_id}: {str(e)}")
+        kernel.shutdown()
+
+    def _restore_pending(self, kernel):
+        """Bring back the namespace a notebook had when the server last stopped its kernel."""
+        checkpoint_id = pending_checkpoint(kernel.notebook_id)
+        if checkpoint_id is None:
+            return
+        try:
+            reply = kernel.request("restore", timeout=CHECKPOINT_TIMEOUT, checkpoint_id=checkpoint_id)
+            logger.info(f"Restored {len(reply.get('restored', []))} variables of notebook {kernel.notebook_id} from checkpoint {checkpoint_id}.")
+        except Exception as e:
+            logger.error(f"Could not restore checkpoint {checkpoint_id} of notebook {kernel.notebook_id}: {str(e)}")
+
+    def _apply_mode(self, kernel):
+        mode = self.modes.get(kernel.notebook_id)
+        if mode is None:
+            return
+        try:
+            reply = kernel.request("set_mode", mode=mode)
+            if reply.get("status") != "success":
+                raise KernelError(reply.get("message"))
+        except Exception as e:
+            logger.error(f"Could not switch notebook {kernel.notebook_id} to {mode}: {str(e)}")
+
+    def get_kernel(self, notebook_id):
+        """Return the live kernel for a notebook, starting one if needed.
+
+        The manager lock only covers the bookkeeping. Starting, attaching
+        and restoring a kernel happen outside it, behind a per-notebook
+        placeholder, so other notebooks are not held up meanwhile.
+        """
+        while True:
+            evicted = []
+            with self.lock:
+                kernel = self.kernels.get(notebook_id)
+                if kernel is not None and not kernel.is_alive():
+                    logger.warning(f"Kernel for notebook {notebook_id} is dead, restarting it.")
+                    del self.kernels[notebook_id]
+                    evicted.append(kernel)
+                    kernel = None
+                if kernel is not None:
+                    self.kernels.move_to_end(notebook_id)
+                    break
+                starting = self.starting.get(notebook_id)
+                if starting is None:
+                    while len(self.kernels) + len(self.starting) >= self.max_kernels:
+                        victim_id = next((nid for nid, k in self.kernels.items() if not k.is_busy()), None)
+                        if victim_id is None:
+                            raise KernelPoolFullError(f"All {self.max_kernels} kernels are busy, try again later.")
+                        logger.info(f"Evicting least recently used kernel for notebook {victim_id}.")
+                        evicted.append(self.kernels.pop(victim_id))
+                    self.starting[notebook_id] = threading.Event()
+            if starting is not None:
+                starting.wait()  # Another request is starting this notebook's kernel
+                continue
+            try:
+                kernel = self._take_warm_kernel(notebook_id) or self._new_kernel(notebook_id)
+                self._apply_mode(kernel)
+                self._restore_pending(kernel)
+                with self.lock:
+                    self.kernels[notebook_id] = kernel
+                    self._ensure_reaper()
+            finally:
+                with self.lock:
+                    self.starting.pop(notebook_id).set()
+            break
+
+        for old_kernel in evicted:
+            self._retire(old_kernel, "evicted")
+        self.prewarm()
+        return kernel
+
+    def execute(self, notebook_id, code, cell_id=None, timeout=None, on_output=None, on_start=None, **options):
+        """Run a cell in the notebook's kernel and return the kernel's reply.
+
+        When `on_output` is given the kernel streams stdout/stderr batches to
+        it while the cell runs. Extra options (e.g. cache=True) are passed
+        through to the kernel. A kernel recycled or shut down while the cell
+        waited for it is looked up again, so the cell runs in its successor.
+        """
+        while True:
+            kernel = self.get_kernel(notebook_id)
+            try:
+                reply = kernel.request(
+                    "execute", timeout=timeout, on_stream=on_output, on_start=on_start,
+                    code=code, cell_id=cell_id, stream=on_output is not None, **options,
+                )
+            except KernelRetiredError:
+                continue
+            kernel.sample_memory(reply.get("tracked_bytes"))
+            return reply
+
+    def find_kernel(self, notebook_id):
+        """Return the notebook's running kernel without starting one, or None."""
+        with self.lock:
+            kernel = self.kernels.get(notebook_id)
+            if kernel is not None:
+                self.kernels.move_to_end(notebook_id)
+            return kernel
+
+    def call(self, notebook_id, op, timeout=None, **payload):
+        """Send an operation to a notebook's running kernel; LookupError if the kernel refuses it."""
+        while True:
+            kernel = self.find_kernel(notebook_id)
+            if kernel is None:
+                raise KernelError(f"No running kernel for notebook {notebook_id}.")
+            try:
+                reply = kernel.request(op, timeout=timeout, **payload)
+                break
+            except KernelRetiredError:
+                continue  # Replaced by a recycle; ask its successor
+        if reply.get("status") != "success":
+            raise LookupError(reply.get("message"))
+        return reply
+
+    def complete(self, notebook_id, code, cursor=None, timeout=COMPLETION_TIMEOUT):
+        """Completions and signature at `cursor` from the kernel's namespace, without queuing behind a running cell."""
+        kernel = self.find_kernel(notebook_id)
+        if kernel is None:
+            raise KernelError(f"No running kernel for notebook {notebook_id}.")
+        reply = kernel.side_request("complete", timeout=timeout, code=code, cursor=cursor)
+        if reply.get("status") != "success":
+            raise LookupError(reply.get("message"))
+        return {key: value for key, value in reply.items() if key not in ("status", "msg_id")}
+
+    def export_variable(self, notebook_id, name, rows=None, timeout=None):
+        """Ask a kernel to publish a variable (or its first `rows` rows) as shared data; return its descriptor."""
+        return self.call(notebook_id, "export_variable", timeout=timeout, name=name, rows=rows)["descriptor"]
+
+    def view_rows(self, notebook_id, handle_id, offset=0, limit=100, sort=None, ascending=True, filters=None):
+        """Fetch a window of rows from a DataFrame viewer handle, computed inside the kernel."""
+        return self.call(
+            notebook_id, "view_rows", handle_id=handle_id, offset=offset, limit=limit,
+            sort=sort, ascending=ascending, filters=filters,
+        )["page"]
+
+    def list_variables(self, notebook_id, offset=0, limit=100, include_modules=False):
+        """Summaries (type, shape, dtypes, shallow memory) of a kernel's variables, computed in the kernel."""
+        return self.call(notebook_id, "variables", offset=offset, limit=limit, include_modules=include_modules)["page"]
+
+    def inspect_variable(self, notebook_id, name, section=None, offset=0, limit=100):
+        """One page of a variable's details; LookupError for unknown variables or sections."""
+        return self.call(notebook_id, "inspect_variable", name=name, section=section, offset=offset, limit=limit)["page"]
+
+    def snapshot_state(self, notebook_id, names=None, timeout=None):
+        """Persist the variables that changed since the kernel's last snapshot; returns the report."""
+        return self.call(notebook_id, "snapshot", timeout=timeout, names=names)["report"]
+
+    def checkpoint(self, notebook_id, timeout=CHECKPOINT_TIMEOUT):
+        """Checkpoint a notebook's running kernel now; returns the manifest."""
+        kernel = self.find_kernel(notebook_id)
+        if kernel is None:
+            raise KernelError(f"No running kernel for notebook {notebook_id}.")
+        return kernel.checkpoint("manual", timeout=timeout)
+
+    def restore(self, notebook_id, checkpoint_id=None, timeout=CHECKPOINT_TIMEOUT):
+        """Load a checkpoint (the latest by default) into the notebook's kernel, starting one if needed."""
+        kernel = self.get_kernel(notebook_id)
+        reply = kernel.request("restore", timeout=timeout, checkpoint_id=checkpoint_id)
+        if reply.get("status") != "success":
+            raise LookupError(reply.get("message"))
+        return reply
+
+    def get_mode(self, notebook_id):
+        return self.modes.get(notebook_id, "pandas")
+
+    def set_mode(self, notebook_id, mode, timeout=None):
+        """Run a notebook's cells with plain pandas or pandas-on-Spark; kept across kernel restarts."""
+        kernel = self.find_kernel(notebook_id)
+        if kernel is not None:
+            reply = kernel.request("set_mode", timeout=timeout, mode=mode)
+            if reply.get("status") != "success":
+                raise LookupError(reply.get("message"))
+        elif mode not in EXECUTION_MODES:
+            raise LookupError(f"Unknown mode {mode}")
+        if mode == "pandas":
+            self.modes.pop(notebook_id, None)
+        else:
+            self.modes[notebook_id] = mode
+        return mode
+
+    def recycle(self, notebook_id, reason="manual", timeout=CHECKPOINT_TIMEOUT):
+        """Restart a notebook's kernel without losing its namespace: checkpoint, start fresh, restore.
+
+        The old kernel's lock is held throughout, so nothing runs in it
+        after the checkpoint, and it is marked retired before the lock is
+        released: a cell already waiting for it moves on to the new kernel.
+        Returns a report, or None if the kernel is not running or is busy. A leak recycle that would drop variables the
+        checkpoint cannot store is abandoned; the hard cap goes ahead anyway.
+        """
+        kernel = self.find_kernel(notebook_id)
+        if kernel is None or not kernel.lock.acquire(blocking=False):
+            return None
+        if kernel.retired:
+            kernel.lock.release()
+            return None
+        started_at = time.time()
+        before = current_rss(kernel.process.pid)
+        new_kernel = None
+        try:
+            reply = kernel._request("checkpoint", timeout=timeout, reason="recycle")
+            if reply.get("status") != "success":
+                raise LookupError(reply.get("message"))
+            manifest = reply["checkpoint"]
+            if manifest["skipped"] and reason == "leak":
+                kernel.recycle_reason = None
+                kernel.unexplained_rss.clear()
+                logger.warning(
+                    f"Not recycling kernel for notebook {notebook_id}: {', '.join(sorted(manifest['skipped']))} "
+                    f"cannot be checkpointed and would be lost."
+                )
+                return None
+            new_kernel = self._take_warm_kernel(notebook_id) or self._new_kernel(notebook_id)
+            self._apply_mode(new_kernel)
+            restored = new_kernel.request("restore", timeout=timeout, checkpoint_id=manifest["checkpoint_id"])
+            if restored.get("status") != "success":
+                raise LookupError(restored.get("message"))
+            with self.lock:
+                if self.kernels.get(notebook_id) is not kernel:
+                    raise KernelError(f"Kernel for notebook {notebook_id} was replaced while recycling.")
+                self.kernels[notebook_id] = new_kernel
+            kernel.retired = True
+        except Exception:
+            if new_kernel is not None:
+                new_kernel.shutdown()
+            raise
+        finally:
+            kernel.lock.release()
+        kernel.shutdown()
+
+        new_kernel.needs_checkpoint = False
+        new_kernel.checkpointed_at = time.time()
+        new_kernel.recycle_count = kernel.recycle_count + 1
+        new_kernel.recycled_at = new_kernel.attached_at = time.time()  # A warm kernel was spawned long before
+        after = new_kernel.sample_memory()
+        new_kernel.rss_floor = after or 0
+        report = {
+            "notebook_id": notebook_id,
+            "reason": reason,
+            "rss_before": before,
+            "rss_after": after,
+            "restored": len(restored.get("restored", [])),
+            "skipped": sorted(manifest["skipped"]),
+            "duration": round(time.time() - started_at, 4),
+        }
+        logger.info(
+            f"Recycled kernel for notebook {notebook_id} ({reason}): RSS {(before or 0) // MB} MB -> "
+            f"{(after or 0) // MB} MB, {report['restored']} variables restored in {report['duration']}s."
+        )
+        if report["skipped"]:
+            logger.warning(f"Recycling notebook {notebook_id} dropped variables: {', '.join(report['skipped'])}.")
+        return report
+
+    def recycle_due(self):
+        """Sample idle kernels and recycle the ones flagged as leaking or over the memory cap."""
+        now = time.time()
+        with self.lock:
+            idle = [k for k in self.kernels.values() if k.is_alive() and not k.is_busy()]
+        recycled = []
+        for kernel in idle:
+            kernel.sample_memory()
+            # Time since the kernel started serving this notebook; started_at of a warm kernel is its spawn time
+            if kernel.recycle_reason is None or now - (kernel.attached_at or kernel.started_at) < KERNEL_RECYCLE_MIN_INTERVAL:
+                continue
+            try:
+                if self.recycle(kernel.notebook_id, kernel.recycle_reason) is not None:
+                    recycled.append(kernel.notebook_id)
+            except Exception as e:
+                kernel.recycle_reason = None
+                kernel.unexplained_rss.clear()
+                logger.error(f"Could not recycle kernel for notebook {kernel.notebook_id}: {str(e)}")
+        return recycled
+
+    def close_viewer(self, notebook_id, handle_id):
+        self.call(notebook_id, "close_view", handle_id=handle_id)
+
+    def shutdown_kernel(self, notebook_id):
+        with self.lock:
+            kernel = self.kernels.pop(notebook_id, None)
+        if kernel is None:
+            return False
+        kernel.shutdown()
+        return True
+
+    def kill_kernel(self, notebook_id):
+        """Kill a kernel that stopped responding; the next execution starts a fresh one."""
+        with self.lock:
+            kernel = self.kernels.pop(notebook_id, None)
+        if kernel is None:
+            return False
+        logger.warning(f"Killing kernel for notebook {notebook_id} (pid {kernel.process.pid}).")
+        kernel.kill()
+        return True
+
+    def shutdown_all(self):
+        with self.lock:
+            kernels = list(self.kernels.values())
+            warm = self.warm
+            self.kernels.clear()
+            self.warm = []
+        for kernel in kernels:
+            self._retire(kernel, "shutdown")
+        for kernel in warm:
+            kernel.shutdown()
+        if self.template is not None:
+            self.template.close()
+
+    def list_kernels(self):
+        with self.lock:
+            return [kernel.info() for kernel in self.kernels.values()]
+
+    def pool_info(self):
+        with self.lock:
+            return {
+                "start_method": self.start_method,
+                "preload": self.preload,
+                "warm": len(self.warm),
+                "warm_pool_size": self.warm_pool_size,
+                "kernels": len(self.kernels),
+                "starting": len(self.starting),
+                "max_kernels": self.max_kernels,
+            }
+
+    def evict_idle(self):
+        """Shut down kernels that have been idle longer than the timeout."""
+        now = time.time()
+        with self.lock:
+            idle_ids = [
+                nid for nid, k in self.kernels.items()
+                if not k.is_busy() and (now - k.last_used > self.idle_timeout or not k.is_alive())
+            ]
+            idle = [self.kernels.pop(nid) for nid in idle_ids]
+            self.warm = [k for k in self.warm if k.is_alive()]
+        for kernel in idle:
+            logger.info(f"Evicting idle kernel for notebook {kernel.notebook_id}.")
+            self._retire(kernel, "idle")
+        return idle_ids
+
+    def checkpoint_changed(self):
+        """Checkpoint idle kernels whose namespace changed since their last checkpoint."""
+        if CHECKPOINT_INTERVAL <= 0:
+            return []
+        now = time.time()
+        with self.lock:
+            due = [
+                k for k in self.kernels.values()
+                if k.needs_checkpoint and not k.is_busy() and k.is_alive()
+                and now - (k.checkpointed_at or k.attached_at or k.started_at) > CHECKPOINT_INTERVAL
+            ]
+        for kernel in due:
+            try:
+                kernel.checkpoint("periodic")
+            except Exception as e:
+                logger.error(f"Could not checkpoint notebook {kernel.notebook_id}: {str(e)}")
+        return [kernel.notebook_id for kernel in due]
+
+    def collect_state_garbage(self):
+        """Delete stored variable blobs no notebook refers to any more, once per STATE_GC_INTERVAL."""
+        if not state_storage_enabled() or STATE_GC_INTERVAL <= 0 or time.time() - self.state_gc_at < STATE_GC_INTERVAL:
+            return 0
+        self.state_gc_at = time.time()
+        removed = state_store.collect_garbage()
+        if removed:
+            logger.info(f"Removed {removed} unreferenced state blobs.")
+        return removed
+
+    def _ensure_reaper(self):
+        if self._reaper is None or not self._reaper.is_alive():
+            self._reaper = threading.Thread(target=self._reap_forever, name="kernel-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_forever(self):
+        interval = max(1, min(60, self.idle_timeout // 2))
+        while True:
+            time.sleep(interval)
+            try:
+                self.evict_idle()
+                self.checkpoint_changed()
+                self.recycle_due()
+                self.collect_state_garbage()
+            except Exception as e:
+                logger.error(f"Error evicting idle kernels: {str(e)}")
+
+
+# Shared kernel manager used by the API routes
+kernel_manager = KernelManager()
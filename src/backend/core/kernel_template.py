@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import logging
+import threading
+import subprocess
+from multiprocessing.connection import Connection
+from .display import DISPLAY_BACKEND
+
+logger = logging.getLogger(__name__)
+
+# The template is started as `python -m core.kernel_template` from the backend directory
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_MODULE = f"{__package__ or 'core'}.kernel_template"
+TEMPLATE_START_TIMEOUT = float(os.getenv("KERNEL_TEMPLATE_START_TIMEOUT", 120))
+
+
+def is_supported():
+    """The template forks kernels and hands them their pipes over a Unix socket."""
+    return hasattr(os, "fork") and hasattr(socket, "send_fds")
+
+
+class KernelTemplate:
+    """Parent-side handle of the fork-server that new kernels are forked from.
+
+    The template is a separate interpreter that imports the heavy libraries
+    once. Forking it gives a kernel with everything already imported in a
+    few milliseconds. It is started with `python -m` rather than through
+    multiprocessing so that neither it nor its kernels re-run the server's
+    __main__ module.
+    """
+
+    def __init__(self, preload=()):
+        self.preload = list(preload)
+        self.lock = threading.Lock()
+        self.process = None
+        self.sock = None
+        self.reader = None
+        self.preloaded = []
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        parent_sock, child_sock = socket.socketpair()
+        env = os.environ.copy()
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [BACKEND_DIR, env.get("PYTHONPATH")]))
+        env.setdefault("MPLBACKEND", DISPLAY_BACKEND)  # Agg-based, plt.show() becomes display output
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, "-m", TEMPLATE_MODULE, str(child_sock.fileno()), ",".join(self.preload)],
+                pass_fds=(child_sock.fileno(),),
+                env=env,
+            )
+        finally:
+            child_sock.close()
+        self.sock = parent_sock
+        self.sock.settimeout(TEMPLATE_START_TIMEOUT)
+        self.reader = self.sock.makefile("r")
+        ready = self._read_reply()
+        self.sock.settimeout(None)
+        self.preloaded = ready.get("preloaded", [])
+        logger.info(f"Kernel template started (pid {self.process.pid}), preloaded: {', '.join(self.preloaded) or 'nothing'}.")
+
+    def _read_reply(self):
+        try:
+            line = self.reader.readline()
+        except OSError as e:
+            raise RuntimeError(f"Kernel template stopped answering: {e}")
+        if not line:
+            raise RuntimeError("Kernel template exited.")
+        return json.loads(line)
+
+    def fork(self, child_conn, notebook_id, side_conn=None):
+        """Fork a kernel that serves `child_conn` (and `side_conn` on its side thread); returns its pid."""
+        with self.lock:
+            if not self.is_alive():
+                self.close()
+                self.start()
+            request = json.dumps({"notebook_id": notebook_id}).encode() + b"\n"
+            fds = [child_conn.fileno()] + ([side_conn.fileno()] if side_conn is not None else [])
+            socket.send_fds(self.sock, [request], fds)
+            return self._read_reply()["pid"]
+
+    def close(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()  # EOF tells the template to exit
+            self.sock = self.reader = None
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+
+
+class ForkedKernelProcess:
+    """Stands in for multiprocessing.Process for a kernel forked by the template.
+
+    The template, not this process, is the kernel's parent and reaps it, so
+    liveness is checked by signalling the pid.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+
+    def is_alive(self):
+        try:
+            os.kill(self.pid, 0)
+            return True
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+
+    def _signal(self, signum):
+        try:
+            os.kill(self.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def kill(self):
+        self._signal(signal.SIGKILL)
+
+    def terminate(self):
+        self._signal(signal.SIGTERM)
+
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while self.is_alive() and (deadline is None or time.time() < deadline):
+            time.sleep(0.05)
+
+
+def _run_kernel(sock, fds, notebook_id):
+    """Body of a freshly forked kernel; never returns."""
+    from .kernel import kernel_main
+    code = 0
+    try:
+        sock.close()
+        signal.signal(signal.SIGINT, signal.default_int_handler)  # Interrupts raise KeyboardInterrupt again
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        kernel_main(Connection(fds[0]), notebook_id, side_conn=Connection(fds[1]) if len(fds) > 1 else None)
+    except BaseException:
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def template_main(sock_fd, preload):
+    """Import the preload modules, then fork one kernel per request until the server goes away."""
+    from .kernel import preload_modules
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C on the server is not for us
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # Exited kernels are reaped automatically
+    loaded = preload_modules(preload)
+
+    sock = socket.socket(fileno=sock_fd)
+    sock.sendall(json.dumps({"ready": True, "preloaded": loaded}).encode() + b"\n")
+    while True:
+        try:
+            data, fds, _, _ = socket.recv_fds(sock, 4096, 2)
+        except OSError:
+            break
+        if not data:
+            break  # Server went away
+        request = json.loads(data)
+        pid = os.fork()
+        if pid == 0:
+            _run_kernel(sock, fds, request.get("notebook_id"))
+        for fd in fds:
+            os.close(fd)
+        sock.sendall(json.dumps({"pid": pid}).encode() + b"\n")
+
+
+if __name__ == "__main__":
+    template_main(int(sys.argv[1]), [name for name in sys.argv[2].split(",") if name])
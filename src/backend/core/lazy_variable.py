@@ -0,0 +1,115 @@
+import operator
+
+_UNSET = object()
+
+
+class LazyVariable:
+    """Stands in for a kernel variable whose value is on disk until something uses it.
+
+    The first attribute lookup, subscript, operator, call, len(), iter(),
+    repr()... loads the value and puts it back in the namespace in place
+    of the proxy, so later lookups get the real object. Code that got hold
+    of the proxy itself keeps working through it. isinstance() answers
+    from `value_type` without loading when the type is known up front.
+    """
+
+    __slots__ = ("_lazy_load", "_lazy_type", "_lazy_namespace", "_lazy_name", "_lazy_value")
+
+    def __init__(self, load, value_type=None, namespace=None, name=None):
+        object.__setattr__(self, "_lazy_load", load)
+        object.__setattr__(self, "_lazy_type", value_type)
+        object.__setattr__(self, "_lazy_namespace", namespace)
+        object.__setattr__(self, "_lazy_name", name)
+        object.__setattr__(self, "_lazy_value", _UNSET)
+
+    def _lazy_resolve(self):
+        value = object.__getattribute__(self, "_lazy_value")
+        if value is _UNSET:
+            value = object.__getattribute__(self, "_lazy_load")()
+            object.__setattr__(self, "_lazy_value", value)
+            namespace = object.__getattribute__(self, "_lazy_namespace")
+            name = object.__getattribute__(self, "_lazy_name")
+            if namespace is not None and namespace.get(name) is self:
+                namespace[name] = value
+        return value
+
+    @property
+    def __class__(self):
+        value_type = object.__getattribute__(self, "_lazy_type")
+        return value_type if value_type is not None else type(self._lazy_resolve())
+
+    def __getattr__(self, name):
+        return getattr(self._lazy_resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._lazy_resolve(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._lazy_resolve(), name)
+
+    def __dir__(self):
+        return dir(self._lazy_resolve())
+
+    def __repr__(self):
+        return repr(self._lazy_resolve())
+
+    def __str__(self):
+        return str(self._lazy_resolve())
+
+    def __format__(self, spec):
+        return format(self._lazy_resolve(), spec)
+
+    def __bool__(self):
+        return bool(self._lazy_resolve())
+
+    def __hash__(self):
+        return hash(self._lazy_resolve())
+
+    def __len__(self):
+        return len(self._lazy_resolve())
+
+    def __iter__(self):
+        return iter(self._lazy_resolve())
+
+    def __reversed__(self):
+        return reversed(self._lazy_resolve())
+
+    def __contains__(self, item):
+        return item in self._lazy_resolve()
+
+    def __getitem__(self, key):
+        return self._lazy_resolve()[key]
+
+    def __setitem__(self, key, value):
+        self._lazy_resolve()[key] = value
+
+    def __delitem__(self, key):
+        del self._lazy_resolve()[key]
+
+    def __call__(self, *args, **kwargs):
+        return self._lazy_resolve()(*args, **kwargs)
+
+    def __array__(self, *args, **kwargs):
+        return self._lazy_resolve().__array__(*args, **kwargs)
+
+    def __reduce_ex__(self, protocol):
+        return self._lazy_resolve().__reduce_ex__(protocol)  # Pickle and copy see the real value
+
+
+def _forward(function):
+    return lambda self, *args: function(self._lazy_resolve(), *args)
+
+
+def _forward_reflected(function):
+    return lambda self, other: function(other, self._lazy_resolve())
+
+
+for _name in ("lt", "le", "eq", "ne", "gt", "ge", "neg", "pos", "abs", "invert", "index"):
+    setattr(LazyVariable, f"__{_name}__", _forward(getattr(operator, _name)))
+for _name, _function in (("int", int), ("float", float), ("complex", complex), ("round", round)):
+    setattr(LazyVariable, f"__{_name}__", _forward(_function))
+for _name in ("add", "sub", "mul", "matmul", "truediv", "floordiv", "mod", "pow", "lshift", "rshift", "and", "xor", "or"):
+    _function = getattr(operator, f"{_name}_" if _name in ("and", "or") else _name)
+    setattr(LazyVariable, f"__{_name}__", _forward(_function))
+    setattr(LazyVariable, f"__r{_name}__", _forward_reflected(_function))
+    setattr(LazyVariable, f"__i{_name}__", _forward(getattr(operator, f"i{_name}")))
@@ -0,0 +1,184 @@
+import gc
+import os
+import sys
+import uuid
+import shutil
+import ctypes
+import logging
+from .execution_settings import get_execution_setting, WORKSPACE_PATH
+from .shared_data import write_shared, open_shared, to_pandas, release_shared
+from .resource_usage import current_rss
+from .lazy_variable import LazyVariable
+
+logger = logging.getLogger(__name__)
+
+# Spill settings from the [Execution] section of settings.config
+SPILL_DIR = os.getenv("SPILL_DIR", os.path.join(WORKSPACE_PATH, "spill"))
+KERNEL_MEMORY_LIMIT_MB = get_execution_setting("kernel_memory_limit_mb", 4096, int)  # 0 disables spilling
+SPILL_MIN_VARIABLE_MB = get_execution_setting("spill_min_variable_mb", 64, int)
+SPILL_TARGET_RATIO = 0.8  # Spill until RSS is expected to be below this share of the limit
+
+
+def variable_size(value):
+    """Shallow size in bytes of a spillable value (DataFrame, Series, ndarray), else None."""
+    pd = sys.modules.get("pandas")
+    np = sys.modules.get("numpy")
+    if pd is not None and isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=False).sum())
+    if pd is not None and isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=False))
+    if np is not None and isinstance(value, np.ndarray) and value.dtype != object:
+        if isinstance(value, np.memmap) or isinstance(value.base, np.memmap):
+            return None  # Already backed by a file
+        return int(value.nbytes)
+    return None
+
+
+def _has_string_columns(value):
+    pd = sys.modules["pandas"]
+    names = [value.name] if isinstance(value, pd.Series) else list(value.columns)
+    return all(isinstance(name, str) for name in names)
+
+
+def _malloc_trim():
+    """Hand memory freed by the spill back to the OS (glibc keeps it in its arenas otherwise)."""
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class KernelMemoryManager:
+    """Tracks how large each kernel variable is and spills the least recently used ones to disk.
+
+    Arrays are rewritten as .npy files and replaced by copy-on-write memory
+    maps: still ndarrays, but their pages can be dropped by the OS and read
+    back on demand. DataFrames and Series go to Arrow files and are
+    replaced by a LazyVariable that reads them back on first use, whether
+    a cell names them or a function, globals() or eval() reaches them.
+    """
+
+    def __init__(self, limit_mb=KERNEL_MEMORY_LIMIT_MB, min_variable_mb=SPILL_MIN_VARIABLE_MB, directory=SPILL_DIR):
+        self.limit = limit_mb * 1024 ** 2
+        self.min_size = min_variable_mb * 1024 ** 2
+        self.directory = os.path.join(directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        self.sizes = {}  # name -> shallow bytes, for spillable values
+        self.last_used = {}  # name -> clock of the last cell that touched it
+        self.clock = 0
+        self.spilled = {}  # name -> shared_data descriptor of a frame replaced by a LazyVariable
+        self.mapped = set()  # Arrays already replaced by memory maps
+
+    def touch(self, namespace, names):
+        """Record that a cell used or (re)defined these names."""
+        self.clock += 1
+        for name in names:
+            size = variable_size(namespace[name]) if name in namespace else None
+            if size is None:
+                self.sizes.pop(name, None)
+                self.last_used.pop(name, None)
+                if name not in namespace:
+                    self.mapped.discard(name)
+            else:
+                self.sizes[name] = size
+                self.last_used[name] = self.clock
+                self.mapped.discard(name)
+
+    def _read_back(self, name):
+        descriptor = self.spilled.pop(name)
+        try:
+            return to_pandas(descriptor, open_shared(descriptor))
+        finally:
+            release_shared(descriptor)
+
+    def load(self, namespace, names):
+        """Bring spilled frames among `names` back into the namespace."""
+        for name in set(names) & set(self.spilled):
+            value = namespace.get(name)
+            if isinstance(value, LazyVariable):
+                value._lazy_resolve()
+            else:
+                release_shared(self.spilled.pop(name))  # Rebound or deleted without the cell naming it
+
+    def forget(self, namespace, names):
+        """Drop spilled copies of names that are about to be redefined or restored from elsewhere."""
+        for name in set(names) & set(self.spilled):
+            value = namespace.get(name)
+            # The namespace, `value` and getrefcount's argument; more means the proxy was assigned elsewhere too
+            if isinstance(value, LazyVariable) and sys.getrefcount(value) > 3:
+                value._lazy_resolve()
+            else:
+                release_shared(self.spilled.pop(name))
+
+    def _only_in_namespace(self, namespace, name):
+        # getrefcount sees the dict's reference and its own argument; anything more keeps the value alive
+        return sys.getrefcount(namespace[name]) <= 2
+
+    def _spill(self, namespace, name):
+        value = namespace[name]
+        np = sys.modules.get("numpy")
+        is_array = np is not None and isinstance(value, np.ndarray)
+        if not is_array and not _has_string_columns(value):
+            return 0  # Arrow would turn the labels into strings
+        descriptor = write_shared(value, self.directory, name=f"{name}-{self.clock}")
+        size = self.sizes[name]
+        if is_array:
+            namespace[name] = np.load(descriptor["path"], mmap_mode="c", allow_pickle=False).view(np.ndarray)
+            if os.name != "nt":
+                release_shared(descriptor)  # The mapping keeps the data reachable
+            self.mapped.add(name)
+        else:
+            self.spilled[name] = descriptor
+            namespace[name] = LazyVariable(lambda: self._read_back(name), type(value), namespace, name)
+        del value
+        return size
+
+    def maybe_spill(self, namespace, protected=()):
+        """Spill least recently used large variables while the process is over its memory limit.
+
+        Returns the names spilled.
+        """
+        if self.limit <= 0:
+            return []
+        rss = current_rss()
+        if rss is None or rss <= self.limit:
+            return []
+        target = self.limit * SPILL_TARGET_RATIO
+        candidates = sorted(
+            (name for name, size in self.sizes.items()
+             if size >= self.min_size and name in namespace and name not in protected
+             and name not in self.mapped and name not in self.spilled),
+            key=lambda name: self.last_used.get(name, 0),
+        )
+        spilled, freed = [], 0
+        for name in candidates:
+            if rss - freed <= target:
+                break
+            if not self._only_in_namespace(namespace, name):
+                continue  # Spilling would not free anything
+            try:
+                size = self._spill(namespace, name)
+            except Exception as e:
+                logger.warning(f"Could not spill {name}: {e}")
+                continue
+            if size:
+                freed += size
+                spilled.append(name)
+        if spilled:
+            gc.collect()
+            _malloc_trim()
+            logger.info(f"Kernel over {self.limit // 1024 ** 2} MB, spilled {', '.join(spilled)} ({freed // 1024 ** 2} MB).")
+        return spilled
+
+    def tracked_bytes(self):
+        """Bytes held by the DataFrames, Series and arrays still in the namespace."""
+        return sum(size for name, size in self.sizes.items() if name not in self.spilled)
+
+    def info(self):
+        return [
+            {"name": name, "kind": "spilled", "memory_bytes": self.sizes.get(name), "expandable": True}
+            for name in sorted(self.spilled)
+        ]
+
+    def close(self):
+        self.spilled.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
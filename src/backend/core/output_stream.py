@@ -0,0 +1,366 @@
+import io
+import os
+import re
+import gzip
+import time
+import uuid
+import logging
+import threading
+from .execution_settings import WORKSPACE_PATH
+
+logger = logging.getLogger(__name__)
+
+# Coalescing and backpressure settings (overridable through the environment)
+OUTPUT_FLUSH_INTERVAL = float(os.getenv("OUTPUT_FLUSH_INTERVAL", 0.1))  # Seconds between batches
+OUTPUT_MAX_CHUNK = int(os.getenv("OUTPUT_MAX_CHUNK", 16384))  # Characters per batch
+STREAM_MAX_INFLIGHT = int(os.getenv("STREAM_MAX_INFLIGHT", 8))  # Unacknowledged batches per room
+STREAM_ACK_TIMEOUT = float(os.getenv("STREAM_ACK_TIMEOUT", 10))  # Seconds before a slow client is ignored
+
+# Bounded capture: the start and end of each stream stay in memory, the middle goes to a gzipped spool file
+OUTPUT_HEAD_CHARS = int(os.getenv("OUTPUT_HEAD_CHARS", 65536))
+OUTPUT_TAIL_CHARS = int(os.getenv("OUTPUT_TAIL_CHARS", 65536))
+OUTPUT_SPOOL_DIR = os.getenv("OUTPUT_SPOOL_DIR", os.path.join(WORKSPACE_PATH, "output_spool"))
+OUTPUT_SPOOL_TTL = int(os.getenv("OUTPUT_SPOOL_TTL", 86400))  # Seconds a spool file is kept
+OUTPUT_PAGE_MAX_CHARS = 1024 ** 2  # Largest page of spooled output returned at once
+SPOOL_WRITE_CHARS = 256 * 1024  # Text past the head is moved to the tail and spool in batches of this size
+SPOOL_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _spool_path(spool_id):
+    return os.path.join(OUTPUT_SPOOL_DIR, f"{spool_id}.txt.gz")
+
+
+def _prune_spools(now=None):
+    """Delete spool files older than OUTPUT_SPOOL_TTL."""
+    now = now or time.time()
+    try:
+        entries = list(os.scandir(OUTPUT_SPOOL_DIR))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.name.endswith(".txt.gz") and now - entry.stat().st_mtime > OUTPUT_SPOOL_TTL:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def read_spooled_output(spool_id, offset=0, limit=65536):
+    """One page of the spooled part of a stream.
+
+    Offsets count characters from the end of the in-memory head, so
+    0..omitted_chars is exactly the part left out of the cell's reply.
+    """
+    if not SPOOL_ID.match(spool_id or ""):
+        raise ValueError(f"Invalid output id: {spool_id}")
+    offset, limit = max(int(offset), 0), min(max(int(limit), 0), OUTPUT_PAGE_MAX_CHARS)
+    path = _spool_path(spool_id)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Output {spool_id} not found, it may have expired")
+    with gzip.open(path, "rt", encoding="utf-8") as spool:
+        skipped = 0
+        while skipped < offset:  # gzip cannot seek by character, decompress up to the page
+            chunk = spool.read(min(offset - skipped, OUTPUT_PAGE_MAX_CHARS))
+            if not chunk:
+                break
+            skipped += len(chunk)
+        text = spool.read(limit)
+        eof = not spool.read(1)
+    return {"spool_id": spool_id, "offset": offset, "limit": limit, "text": text, "chars": len(text), "eof": eof}
+
+
+class StreamCapture(io.TextIOBase):
+    """File-like replacement for sys.stdout/sys.stderr that emits output in batches.
+
+    Text is handed to `sink(name, text)` once OUTPUT_MAX_CHUNK characters are
+    pending or OUTPUT_FLUSH_INTERVAL has passed, whichever comes first. A slow
+    sink blocks the writer, so a cell cannot outrun the client.
+
+    Only the first `head_chars` and last `tail_chars` characters are kept
+    in memory. Once a stream outgrows both, everything after the head is
+    also written to a gzipped spool file that can be paged through with
+    read_spooled_output(), so memory and replies stay bounded.
+    """
+
+    def __init__(self, name, sink=None, flush_interval=OUTPUT_FLUSH_INTERVAL, max_chunk=OUTPUT_MAX_CHUNK,
+                 head_chars=OUTPUT_HEAD_CHARS, tail_chars=OUTPUT_TAIL_CHARS):
+        super().__init__()
+        self.name = name
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self.max_chunk = max_chunk
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self.buffer_lock = threading.Lock()
+        self.sink_lock = threading.Lock()
+        self.pending = []
+        self.pending_size = 0
+        self.head = io.StringIO()
+        self.head_size = 0
+        self.overflow = []  # Text written after the head, not yet moved to the tail and spool
+        self.overflow_size = 0
+        self.tail = ""  # Last tail_chars characters of what was moved
+        self.spool = None  # Opened once the output no longer fits in head + tail
+        self.spool_id = None
+        self.chars_written = 0
+        self.chunks_sent = 0
+        self._stop = threading.Event()
+        self._flusher = None
+        if sink is not None:
+            self._flusher = threading.Thread(target=self._flush_periodically, name=f"{name}-flusher", daemon=True)
+            self._flusher.start()
+
+    @property
+    def encoding(self):
+        return "utf-8"
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+        with self.buffer_lock:
+            self._capture(text)
+            self.chars_written += len(text)
+            if self.sink is None:
+                return len(text)
+            self.pending.append(text)
+            self.pending_size += len(text)
+            should_flush = self.pending_size >= self.max_chunk
+        if should_flush:
+            self.flush()
+        return len(text)
+
+    def _capture(self, text):
+        if self.head_size < self.head_chars:
+            room = self.head_chars - self.head_size
+            self.head.write(text[:room])
+            self.head_size += min(room, len(text))
+            text = text[room:]
+            if not text:
+                return
+        self.overflow.append(text)  # Just an append: print() calls write twice per line
+        self.overflow_size += len(text)
+        if self.overflow_size >= SPOOL_WRITE_CHARS:
+            self._drain_overflow()
+
+    def _drain_overflow(self):
+        """Move text past the head into the tail, spooling it once the output outgrows head + tail."""
+        if not self.overflow:
+            return
+        text = "".join(self.overflow)
+        self.overflow = []
+        self.overflow_size = 0
+        if self.spool is None and len(self.tail) + len(text) > self.tail_chars:
+            self._open_spool()
+        if self.spool is not None:
+            self.spool.write(text)
+        self.tail = (self.tail + text)[-self.tail_chars:] if self.tail_chars > 0 else ""
+
+    def _open_spool(self):
+        """Start spooling; everything after the head so far is still in the tail and goes first."""
+        try:
+            os.makedirs(OUTPUT_SPOOL_DIR, exist_ok=True)
+            _prune_spools()
+            spool_id = uuid.uuid4().hex
+            self.spool = gzip.open(_spool_path(spool_id), "wt", encoding="utf-8", compresslevel=1)
+            self.spool_id = spool_id
+        except OSError as e:
+            logger.error(f"Could not spool {self.name}, the middle of the output is dropped: {e}")
+            self.spool = open(os.devnull, "w")
+        self.spool.write(self.tail)
+
+    @property
+    def omitted_chars(self):
+        return max(0, self.chars_written - self.head_size - self.tail_chars)
+
+    def spool_info(self):
+        """Where the omitted middle of the output went, or None if nothing was left out."""
+        omitted = self.omitted_chars
+        if omitted <= 0:
+            return None
+        return {
+            "spool_id": self.spool_id,
+            "total_chars": self.chars_written,
+            "head_chars": self.head_size,
+            "tail_chars": self.tail_chars,
+            "omitted_chars": omitted,
+        }
+
+    def flush(self):
+        if self.sink is None:
+            return
+        with self.sink_lock:
+            with self.buffer_lock:
+                if not self.pending:
+                    return
+                text = "".join(self.pending)
+                self.pending = []
+                self.pending_size = 0
+            for start in range(0, len(text), self.max_chunk):
+                self.sink(self.name, text[start:start + self.max_chunk])
+                self.chunks_sent += 1
+
+    def getvalue(self):
+        """The captured output; when it was too long, the head and tail around an omission marker."""
+        with self.buffer_lock:
+            self._drain_overflow()
+            head, tail = self.head.getvalue(), self.tail
+            omitted = self.omitted_chars
+        if omitted <= 0:
+            return head + tail
+        where = f", see output {self.spool_id}" if self.spool_id else ""
+        return f"{head}\n... [{omitted} characters omitted{where}] ...\n{tail}"
+
+    def close(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing {self.name}: {str(e)}")
+        with self.buffer_lock:
+            self._drain_overflow()
+            if self.spool is not None and not self.spool.closed:
+                self.spool.close()
+        super().close()
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing {self.name}: {str(e)}")
+                return
+
+
+class _RoomState:
+    def __init__(self):
+        self.sent = 0
+        self.acked = 0
+        self.ack_subscribers = 0
+        self.lagging = False
+        self.condition = threading.Condition()
+
+
+class CellOutputStreamer:
+    """Pushes cell output to per-cell Socket.IO rooms.
+
+    Clients join `cell:<notebook_id>:<cell_id>` and receive `cell_output`
+    events. Clients that subscribe with acknowledgements get backpressure:
+    once STREAM_MAX_INFLIGHT batches are unacknowledged the producer waits,
+    and a client silent for STREAM_ACK_TIMEOUT stops holding the cell back.
+    """
+
+    def __init__(self, socketio=None, max_inflight=STREAM_MAX_INFLIGHT, ack_timeout=STREAM_ACK_TIMEOUT):
+        self.socketio = socketio
+        self.max_inflight = max_inflight
+        self.ack_timeout = ack_timeout
+        self.rooms = {}
+        self.lock = threading.Lock()
+
+    def init_app(self, socketio):
+        self.socketio = socketio
+
+    @staticmethod
+    def room_name(notebook_id, cell_id):
+        return f"cell:{notebook_id}:{cell_id}"
+
+    def _room(self, room):
+        with self.lock:
+            return self.rooms.setdefault(room, _RoomState())
+
+    def subscribe(self, room, ack=False):
+        state = self._room(room)
+        if ack:
+            with state.condition:
+                state.ack_subscribers += 1
+                state.lagging = False
+
+    def unsubscribe(self, room, ack=False):
+        state = self._room(room)
+        with state.condition:
+            if ack and state.ack_subscribers:
+                state.ack_subscribers -= 1
+            state.condition.notify_all()
+        with self.lock:
+            if not state.ack_subscribers and room in self.rooms:
+                del self.rooms[room]
+
+    def acknowledge(self, room, seq):
+        state = self._room(room)
+        with state.condition:
+            state.acked = max(state.acked, int(seq))
+            state.lagging = False
+            state.condition.notify_all()
+
+    def _wait_for_client(self, state):
+        with state.condition:
+            if not state.ack_subscribers or state.lagging:
+                return
+            if not state.condition.wait_for(
+                lambda: state.sent - state.acked < self.max_inflight or not state.ack_subscribers,
+                timeout=self.ack_timeout,
+            ):
+                logger.warning("Client stopped acknowledging output, streaming without backpressure.")
+                state.lagging = True
+
+    def emit_output(self, notebook_id, cell_id, name, text):
+        """Send one batch of output to the cell's room, waiting if the client is behind."""
+        if self.socketio is None:
+            return
+        room = self.room_name(notebook_id, cell_id)
+        state = self._room(room)
+        self._wait_for_client(state)
+        with state.condition:
+            state.sent += 1
+            seq = state.sent
+        self.socketio.emit("cell_output", {
+            "notebook_id": notebook_id,
+            "cell_id": cell_id,
+            "name": name,
+            "text": text,
+            "seq": seq,
+        }, to=room)
+
+    def emit_status(self, notebook_id, cell_id, status, summary=None):
+        """Tell the cell's room that execution finished."""
+        if self.socketio is None:
+            return
+        room = self.room_name(notebook_id, cell_id)
+        self.socketio.emit("cell_status", {
+            "notebook_id": notebook_id,
+            "cell_id": cell_id,
+            "status": status,
+            "summary": summary or {},
+        }, to=room)
+        with self.lock:
+            state = self.rooms.get(room)
+            if state is not None and not state.ack_subscribers:
+                del self.rooms[room]
+
+    def sink_for(self, notebook_id, cell_id):
+        """Return a StreamCapture sink that forwards batches to this cell's room."""
+        def sink(name, text):
+            self.emit_output(notebook_id, cell_id, name, text)
+        return sink
+
+
+# Shared streamer, bound to the app's SocketIO instance in main.py
+output_streamer = CellOutputStreamer()
+
+
+def build_summary(stdout_capture, stderr_capture, started_at):
+    """Small execution summary returned instead of the full output."""
+    summary = {
+        "stdout_chars": stdout_capture.chars_written,
+        "stderr_chars": stderr_capture.chars_written,
+        "chunks": stdout_capture.chunks_sent + stderr_capture.chunks_sent,
+        "duration": round(time.time() - started_at, 4),
+    }
+    spooled = {capture.name: capture.spool_info() for capture in (stdout_capture, stderr_capture) if capture.spool_info()}
+    if spooled:
+        summary["spooled"] = spooled  # Truncated streams and the ids to page through what was left out
+    return summary
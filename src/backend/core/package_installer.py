@@ -0,0 +1,220 @@
+import os
+import re
+import sys
+import time
+import uuid
+import logging
+import importlib
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from .execution_settings import get_execution_setting, WORKSPACE_PATH
+
+logger = logging.getLogger(__name__)
+
+# Installer settings from the [Execution] section of settings.config
+PACKAGE_OVERLAY_DIR = os.getenv("PACKAGE_OVERLAY_DIR", os.path.join(WORKSPACE_PATH, "packages"))
+WHEELHOUSE_DIR = os.getenv("WHEELHOUSE_DIR", os.path.join(WORKSPACE_PATH, "wheelhouse"))
+PACKAGE_INSTALL_WORKERS = get_execution_setting("package_install_workers", 2, int)
+PACKAGE_INSTALL_TIMEOUT = get_execution_setting("package_install_timeout_seconds", 600, int)
+INSTALL_LOG_CHARS = 4000  # Tail of pip's output kept per task
+INSTALL_RETENTION_SECONDS = 3600
+
+FINISHED_STATES = {"succeeded", "failed"}
+
+# A requirement such as pandas, scikit-learn[alldeps]>=1.3,<2 or numpy==1.26.*; never a pip option or URL
+REQUIREMENT_PATTERN = re.compile(
+    r"^[A-Za-z0-9][A-Za-z0-9._-]*(\[[A-Za-z0-9._,-]+\])?"
+    r"(\s*(==|!=|<=|>=|~=|<|>)\s*[A-Za-z0-9.*+!_-]+(\s*,\s*(==|!=|<=|>=|~=|<|>)\s*[A-Za-z0-9.*+!_-]+)*)?$"
+)
+
+
+def overlay_dir(notebook_id):
+    """Directory the packages of one notebook are installed into."""
+    return os.path.abspath(os.path.join(PACKAGE_OVERLAY_DIR, re.sub(r"[^A-Za-z0-9_.-]", "_", str(notebook_id))))
+
+
+def activate_overlay(notebook_id):
+    """Make a notebook's packages importable in this process.
+
+    The overlay goes at the end of sys.path, so it adds packages but never
+    shadows the server's own copies of libraries that are already imported.
+    """
+    if notebook_id is None:
+        return None
+    path = overlay_dir(notebook_id)
+    os.makedirs(path, exist_ok=True)  # Must exist before the first import, or the path finder caches a miss
+    if path not in sys.path:
+        sys.path.append(path)
+    importlib.invalidate_caches()
+    return path
+
+
+def normalize_requirement(spec):
+    """Validate a requirement string and return it in a canonical form for deduplication."""
+    spec = (spec or "").strip()
+    if not REQUIREMENT_PATTERN.match(spec):
+        raise ValueError(f"Invalid package requirement: {spec!r}")
+    name, rest = re.match(r"^([A-Za-z0-9._-]+)(.*)$", spec).groups()
+    return re.sub(r"[-_.]+", "-", name).lower() + re.sub(r"\s+", "", rest)
+
+
+class InstallTask:
+    """One requirement being installed into one notebook's overlay."""
+
+    def __init__(self, notebook_id, requirement):
+        self.task_id = uuid.uuid4().hex
+        self.notebook_id = notebook_id
+        self.requirement = requirement
+        self.status = "queued"
+        self.source = None  # "wheelhouse" when no download was needed
+        self.log = ""
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            "task_id": self.task_id,
+            "notebook_id": self.notebook_id,
+            "requirement": self.requirement,
+            "status": self.status,
+            "source": self.source,
+            "error": self.error,
+            "log": self.log,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class PackageInstaller:
+    """Background pip installs into per-notebook overlay directories.
+
+    Wheels are first built or downloaded into a shared wheelhouse and then
+    installed from it with --no-index, so installing the same package again
+    (for another notebook, or after a reset) needs no network. Requests for
+    a requirement that is already queued or running for the same notebook
+    share one task.
+    """
+
+    def __init__(self, workers=PACKAGE_INSTALL_WORKERS, wheelhouse=WHEELHOUSE_DIR, timeout=PACKAGE_INSTALL_TIMEOUT):
+        self.wheelhouse = os.path.abspath(wheelhouse)
+        self.timeout = timeout
+        self.tasks = {}
+        self.active = {}  # (notebook_id, requirement) -> queued or running task
+        self.overlay_locks = {}  # pip --target must not run twice at once on one directory
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="pip-install")
+        self.on_installed = []  # Callbacks (notebook_id, requirement) run after a successful install
+
+    def submit(self, notebook_id, requirement):
+        """Queue an install and return its task (an existing one for a duplicate request)."""
+        requirement = normalize_requirement(requirement)
+        key = (notebook_id, requirement)
+        with self.lock:
+            self._forget_old_tasks()
+            task = self.active.get(key)
+            if task is not None:
+                return task
+            task = InstallTask(notebook_id, requirement)
+            self.tasks[task.task_id] = task
+            self.active[key] = task
+            overlay_lock = self.overlay_locks.setdefault(notebook_id, threading.Lock())
+        self.executor.submit(self._run, task, overlay_lock)
+        return task
+
+    def install(self, notebook_id, requirement, timeout=None):
+        """Install and wait for it; returns the finished (or still running, on timeout) task."""
+        task = self.submit(notebook_id, requirement)
+        task.wait(timeout or self.timeout)
+        return task
+
+    def get(self, task_id):
+        with self.lock:
+            return self.tasks.get(task_id)
+
+    def list_tasks(self, notebook_id=None):
+        with self.lock:
+            return [t.to_dict() for t in self.tasks.values() if notebook_id is None or t.notebook_id == notebook_id]
+
+    def installed_packages(self, notebook_id):
+        """Distributions present in a notebook's overlay as [{name, version}]."""
+        path = overlay_dir(notebook_id)
+        if not os.path.isdir(path):
+            return []
+        packages = []
+        for entry in sorted(os.listdir(path)):
+            if entry.endswith(".dist-info"):
+                name, _, version = entry[:-len(".dist-info")].partition("-")
+                packages.append({"name": name, "version": version})
+        return packages
+
+    def _pip(self, task, *args):
+        command = [sys.executable, "-m", "pip", "--disable-pip-version-check", "--no-input", *args]
+        result = subprocess.run(
+            command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=self.timeout,
+        )
+        task.log = (task.log + result.stdout)[-INSTALL_LOG_CHARS:]
+        return result.returncode == 0
+
+    def _install_from_wheelhouse(self, task):
+        return self._pip(
+            task, "install", "--no-index", "--find-links", self.wheelhouse,
+            "--target", overlay_dir(task.notebook_id), "--upgrade", task.requirement,
+        )
+
+    def _run(self, task, overlay_lock):
+        task.status = "running"
+        task.started_at = time.time()
+        try:
+            os.makedirs(self.wheelhouse, exist_ok=True)
+            with overlay_lock:
+                if self._install_from_wheelhouse(task):
+                    task.source = "wheelhouse"
+                else:
+                    # Not (all) cached yet: collect wheels for it and its dependencies, then install offline
+                    task.source = "index"
+                    if not self._pip(task, "wheel", "--wheel-dir", self.wheelhouse, "--find-links", self.wheelhouse,
+                                     task.requirement):
+                        raise RuntimeError(f"Could not download or build {task.requirement}")
+                    if not self._install_from_wheelhouse(task):
+                        raise RuntimeError(f"Could not install {task.requirement}")
+            task.status = "succeeded"
+            logger.info(f"Installed {task.requirement} for notebook {task.notebook_id} from the {task.source}.")
+        except subprocess.TimeoutExpired:
+            task.status = "failed"
+            task.error = f"Installing {task.requirement} took longer than {self.timeout}s"
+        except Exception as e:
+            task.status = "failed"
+            task.error = str(e)
+            logger.error(f"Installing {task.requirement} for notebook {task.notebook_id} failed: {str(e)}")
+        finally:
+            task.finished_at = time.time()
+            with self.lock:
+                self.active.pop((task.notebook_id, task.requirement), None)
+            task.done.set()
+
+        if task.status == "succeeded":
+            for callback in self.on_installed:
+                try:
+                    callback(task.notebook_id, task.requirement)
+                except Exception as e:
+                    logger.error(f"Error in package install callback: {str(e)}")
+
+    def _forget_old_tasks(self):
+        now = time.time()
+        for task_id in [
+            task_id for task_id, task in self.tasks.items()
+            if task.status in FINISHED_STATES and now - task.finished_at > INSTALL_RETENTION_SECONDS
+        ]:
+            self.tasks.pop(task_id)
+
+
+# Shared installer used by the API routes
+package_installer = PackageInstaller()
@@ -0,0 +1,151 @@
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+from .execution_settings import get_execution_setting
+
+logger = logging.getLogger(__name__)
+
+# Sampling settings from the [Execution] section of settings.config
+PROFILE_INTERVAL_MS = get_execution_setting("profile_interval_ms", 10, float)  # Time between two stack samples
+PROFILE_TOP_N = get_execution_setting("profile_top_functions", 25, int)  # Rows of the hot function table
+PROFILE_MAX_DEPTH = 128  # Frames kept per sample, counted from the cell's own code
+PROFILE_MAX_STACKS = 5000  # Distinct stacks kept; rarer ones beyond this are counted as "[other]"
+
+CELL_FILENAME = "<cell>"
+OTHER_STACK = ("[other]",)
+
+
+def _frame_label(frame):
+    """module:function for library code; cell code keeps its line number so loops stand out."""
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    if code.co_filename == CELL_FILENAME:
+        return f"{CELL_FILENAME}:{name}:{frame.f_lineno}"
+    return f"{frame.f_globals.get('__name__', '?')}:{name}"
+
+
+def _package(label):
+    """Top-level package a frame label belongs to: pandas, numpy, <cell>..."""
+    if label.startswith(CELL_FILENAME):
+        return CELL_FILENAME
+    return label.split(":", 1)[0].split(".", 1)[0]
+
+
+class SamplingProfiler:
+    """Samples the stack of one thread at a fixed interval from a background thread.
+
+    Only frames above `root_code` (the kernel's run_cell) are kept, so a
+    profile starts at the cell. The traced code runs at full speed; the
+    cost is one sys._current_frames() call per interval, unlike cProfile
+    which hooks every call.
+    """
+
+    def __init__(self, root_code=None, interval_ms=PROFILE_INTERVAL_MS, thread_id=None):
+        self.root_code = root_code
+        self.interval = max(interval_ms, 1) / 1000
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = Counter()  # Tuple of frame labels, outermost first -> samples
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample_forever, name="kernel-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.stopped_at = time.perf_counter()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _stack(self, frame):
+        labels = []
+        while frame is not None and frame.f_code is not self.root_code:
+            labels.append(_frame_label(frame))
+            frame = frame.f_back
+        if frame is None and self.root_code is not None:
+            return None  # The thread is not inside the cell (before or after it)
+        return tuple(reversed(labels[-PROFILE_MAX_DEPTH:]))
+
+    def _sample_forever(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = self._stack(frame) if frame is not None else None
+            del frame
+            if not stack:
+                continue
+            if stack not in self.stacks and len(self.stacks) >= PROFILE_MAX_STACKS:
+                stack = OTHER_STACK
+            self.stacks[stack] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        """Brendan Gregg's collapsed format, one "a;b;c count" line per stack, for flamegraph.pl or speedscope."""
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in sorted(self.stacks.items()))
+
+    def flame_graph(self):
+        """Nested {name, value, children} tree, the format d3-flame-graph renders."""
+        root = {"name": "cell", "value": 0, "children": {}}
+        for stack, count in self.stacks.items():
+            root["value"] += count
+            node = root
+            for label in stack:
+                node = node["children"].setdefault(label, {"name": label, "value": 0, "children": {}})
+                node["value"] += count
+
+        def to_list(node):
+            node["children"] = sorted((to_list(child) for child in node["children"].values()), key=lambda c: -c["value"])
+            return node
+        return to_list(root)
+
+    def top(self, limit=PROFILE_TOP_N):
+        """Hottest functions by self time (the sample's leaf) and total time (anywhere on the stack)."""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        samples = self.samples or 1
+        return [
+            {
+                "function": label,
+                "package": _package(label),
+                "self_samples": own[label],
+                "total_samples": total[label],
+                "self_percent": round(100 * own[label] / samples, 1),
+                "total_percent": round(100 * total[label] / samples, 1),
+            }
+            for label, _ in sorted(total.items(), key=lambda item: (-own[item[0]], -item[1]))[:limit]
+        ]
+
+    def by_package(self):
+        """Self samples per top-level package, e.g. how much went to pandas versus the cell's own code."""
+        packages = Counter()
+        for stack, count in self.stacks.items():
+            packages[_package(stack[-1])] += count
+        return dict(packages.most_common())
+
+    def report(self, limit=PROFILE_TOP_N):
+        return {
+            "interval_ms": round(self.interval * 1000, 3),
+            "samples": self.samples,
+            "duration": round((self.stopped_at or time.perf_counter()) - self.started_at, 4),
+            "top": self.top(limit),
+            "by_package": self.by_package(),
+            "collapsed": self.collapsed(),
+            "flame_graph": self.flame_graph(),
+        }
@@ -2,7 +2,6 @@ import os
 import sys
 import subprocess
 import logging
-import ast
 import sqlite3
 from time import time
 from io import StringIO
@@ -12,6 +11,9 @@ from pygments import highlight
 from pygments.lexers import PythonLexer, SqlLexer
 from pygments.formatters import HtmlFormatter
 from pathlib import Path
+from .compile_cache import CodeValidator, compile_cell
+from .package_installer import package_installer, PACKAGE_INSTALL_TIMEOUT
+from .job_manager import job_manager
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -25,102 +27,45 @@ os.makedirs(WORKSPACE_PATH, exist_ok=True)
 connection = sqlite3.connect(":memory:", check_same_thread=False)
 cursor = connection.cursor()
 
-# Global namespace for Python code execution
-global_namespace = {}
-
-# Code Validation
-class CodeValidator(ast.NodeVisitor):
-    """AST-based validator to check code safety."""
-    def __init__(self):
-        self.errors = []
-
-    def visit_Import(self, node):
-        for alias in node.names:
-            if alias.name in {"os", "subprocess", "sys", "importlib"}:
-                self.errors.append(f"Forbidden import: {alias.name}")
-        self.generic_visit(node)
-
-    def visit_Call(self, node):
-        if isinstance(node.func, ast.Name) and node.func.id in {"exec", "eval"}:
-            self.errors.append(f"Forbidden function call: {node.func.id}")
-        self.generic_visit(node)
-
-    def visit_Attribute(self, node):
-        if isinstance(node.value, ast.Name) and node.value.id in {"os", "sys"}:
-            self.errors.append(f"Potentially unsafe attribute access: {node.attr}")
-        self.generic_visit(node)
-
 def validate_python_syntax(code):
-    """Validate Python code syntax and ensure safety."""
-    try:
-        tree = ast.parse(code)
-        validator = CodeValidator()
-        validator.visit(tree)
-        if validator.errors:
-            return False, validator.errors
-        return True, "Code is safe."
-    except SyntaxError as e:
-        logger.error(f"SyntaxError: {str(e)}")
-        return False, [f"Python Syntax Error: {e}"]
+    """Validate Python code syntax and ensure safety (parsed and checked once per distinct source)."""
+    compiled = compile_cell(code)
+    if compiled.syntax_error is not None:
+        logger.error(f"SyntaxError: {str(compiled.syntax_error)}")
+    is_safe, errors = compiled.validate()
+    if not is_safe:
+        return False, errors
+    return True, "Code is safe."
+
+def execute_python_code(cell_id, code, on_output=None, notebook_id="default"):
+    """Execute Python code in the notebook's kernel and capture all outputs.
+
+    The cell is queued behind the notebook's earlier cells like any other
+    job, so each notebook keeps its own namespace and notebooks run in
+    parallel. If `on_output(name, text)` is given, stdout/stderr are also
+    streamed to it in batches while the code runs.
+
+    Returns (stdout, stderr, outputs, error); `error` is None when the cell
+    succeeded, whatever it wrote to stderr.
+    """
+    # Validate code
+    is_safe, validation_msg = validate_python_syntax(code)
+    if not is_safe:
+        return "", "", [], "\n".join(validation_msg)
 
-def execute_python_code(cell_id, code):
-    """Execute Python code in a shared namespace and capture all outputs."""
     try:
-        # Validate code
-        is_safe, validation_msg = validate_python_syntax(code)
-        if not is_safe:
-            return "", "\n".join(validation_msg), []
-
-        # Redirect stdout and stderr to capture text outputs
-        old_stdout, old_stderr = sys.stdout, sys.stderr
-        sys.stdout = StringIO()
-        sys.stderr = StringIO()
-
-        # Track generated files (e.g., images, CSVs)
-        generated_files = []
-
-        # Execute code in a shared namespace
-        exec_globals = global_namespace.copy()
-        exec_globals.update({
-            "plt": plt,  # Allow matplotlib usage
-            "pd": pd,    # Allow pandas usage
-        })
-
-        # Override plt.show to save figures
-        def save_figure(*args, **kwargs):
-            file_path = os.path.join(WORKSPACE_PATH, f"cell_{cell_id}_figure.png")
-            plt.savefig(file_path)
-            generated_files.append({"type": "image", "path": file_path})
-            plt.close()
-
-        exec_globals["plt"].show = save_figure
-
-        # Override pd.DataFrame.to_csv to save CSVs
-        original_to_csv = pd.DataFrame.to_csv
-        def save_csv(df, path=None, *args, **kwargs):
-            if not path:
-                path = os.path.join(WORKSPACE_PATH, f"cell_{cell_id}_output.csv")
-            original_to_csv(df, path, *args, **kwargs)
-            generated_files.append({"type": "csv", "path": path})
-
-        pd.DataFrame.to_csv = save_csv
-
-        # Execute the code
-        exec(code, exec_globals)
-
-        # Capture text outputs
-        stdout_output = sys.stdout.getvalue()
-        stderr_output = sys.stderr.getvalue()
-
-        # Restore original stdout and stderr
-        sys.stdout, sys.stderr = old_stdout, old_stderr
-
-        # Return results
-        return stdout_output, stderr_output, generated_files
+        # `pd` and `plt` are bound by the kernel when its namespace is created
+        job = job_manager.submit(notebook_id, code, cell_id=cell_id, on_output=on_output, include_state=False)
+        job.wait()
+        reply = job.reply or {}
+        if job.status != "succeeded":
+            return "", reply.get("stderr", ""), reply.get("outputs", []), reply.get("error") or job.error or f"Execution {job.status}"
+        stdout_output = reply.get("result", "") if (reply.get("summary") or {}).get("stdout_chars") else ""
+        return stdout_output, reply.get("stderr", ""), reply.get("outputs", []), None
 
     except Exception as e:
         logger.error(f"Execution Error: {str(e)}")
-        return "", str(e), []
+        return "", "", [], str(e)
 
 def save_cell_input(cell_id, content):
     """Save the input code of a cell."""
@@ -159,8 +104,8 @@ def save_cell_output(cell_id, content):
         logger.error(f"Error saving cell {cell_id} output: {str(e)}")
         return f"Error saving cell {cell_id} output: {str(e)}"
     
-def install_library(library_name):
-    """Install a Python library if not already installed, with enhanced debugging messages."""
+def install_library(library_name, notebook_id="default"):
+    """Install a Python library into the notebook's package overlay, with enhanced debugging messages."""
     try:
         if library_name == "random":
             return "No installation required for 'random' as it is part of Python's standard library."
@@ -169,10 +114,12 @@ def install_library(library_name):
             return "Error: No library name provided. Please specify the library you want to install."
         
         logger.info(f"Attempting to install library: {library_name}")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", library_name])
+        task = package_installer.install(notebook_id, library_name)  # Queued, deduplicated, cached wheels
+        if task.status != "succeeded":
+            raise RuntimeError(task.error or f"Installation still running after {PACKAGE_INSTALL_TIMEOUT}s")
         logger.info(f"Library '{library_name}' installed successfully.")
         return f"Success: Library '{library_name}' has been installed."
-    except subprocess.CalledProcessError as e:
+    except (ValueError, RuntimeError) as e:
         logger.error(f"Library Installation Error for '{library_name}': {str(e)}")
         return (
             f"Error: Failed to install library '{library_name}'.\n"
@@ -0,0 +1,196 @@
+import os
+import sys
+import time
+import logging
+import threading
+
+try:
+    import psutil  # Optional: portable process metrics
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+# How often the peak-memory sampler looks at the process while a cell runs
+RESOURCE_SAMPLE_INTERVAL = float(os.getenv("RESOURCE_SAMPLE_INTERVAL", 0.05))
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def _proc_path(pid, name):
+    return f"/proc/{'self' if pid is None else pid}/{name}"
+
+
+def _read_proc_io(pid):
+    """Bytes read from / written to storage according to /proc/<pid>/io."""
+    try:
+        with open(_proc_path(pid, "io")) as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["read_bytes"]), int(fields["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _read_proc_status_kb(pid, field):
+    try:
+        with open(_proc_path(pid, "status")) as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _read_proc_cpu(pid):
+    """User and system CPU seconds from /proc/<pid>/stat."""
+    try:
+        with open(_proc_path(pid, "stat")) as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return int(fields[11]) / _CLOCK_TICKS, int(fields[12]) / _CLOCK_TICKS
+    except (OSError, ValueError, IndexError):
+        return None, None
+
+
+def _reset_peak_rss(pid):
+    """Reset the kernel's high-water mark (VmHWM) so it covers only what runs next. Linux only."""
+    try:
+        with open(_proc_path(pid, "clear_refs"), "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _current_rss(pid, process):
+    if process is not None:
+        try:
+            return process.memory_info().rss
+        except psutil.Error:
+            return None
+    return _read_proc_status_kb(pid, "VmRSS")
+
+
+def current_rss(pid=None):
+    """Resident set size of a process in bytes, or None where the platform cannot tell."""
+    process = None
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+        except psutil.Error:
+            return None
+    return _current_rss(pid, process)
+
+
+def _cpu_times(pid, process):
+    if process is not None:
+        try:
+            times = process.cpu_times()
+            return times.user, times.system
+        except psutil.Error:
+            return None, None
+    if pid is None and not os.path.exists("/proc/self/stat"):
+        times = os.times()
+        return times.user, times.system
+    return _read_proc_cpu(pid)
+
+
+def _io_bytes(pid, process):
+    if process is not None and hasattr(process, "io_counters"):
+        try:
+            counters = process.io_counters()
+            return counters.read_bytes, counters.write_bytes
+        except (psutil.Error, NotImplementedError):
+            return None, None
+    return _read_proc_io(pid)
+
+
+def _delta(after, before):
+    if after is None or before is None:
+        return None
+    return max(after - before, 0)
+
+
+class ResourceMeter:
+    """Measure wall time, CPU, peak RSS and storage I/O of a process over a block.
+
+    Meant to wrap a single cell in a process that runs one cell at a time (a
+    notebook kernel, or the Spark JVM); `pid=None` measures the current
+    process. Metrics the platform cannot provide are reported as None.
+
+        with ResourceMeter() as meter:
+            exec(code, namespace)
+        meter.usage()
+    """
+
+    def __init__(self, pid=None, sample_interval=RESOURCE_SAMPLE_INTERVAL):
+        self.pid = pid
+        self.sample_interval = sample_interval
+        self.process = None
+        if psutil is not None:
+            try:
+                self.process = psutil.Process(pid)
+            except psutil.Error:
+                self.process = None
+        self.peak_rss = None
+        self.hwm_reset = False
+        self._stop = threading.Event()
+        self._sampler = None
+        self._start = None
+        self._end = None
+
+    def __enter__(self):
+        self.hwm_reset = _reset_peak_rss(self.pid)
+        self._sample_rss()
+        self._start = self._snapshot()
+        self._sampler = threading.Thread(target=self._sample_forever, name="resource-meter", daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._end = self._snapshot()
+        self._stop.set()
+        self._sampler.join()
+        self._sample_rss()
+        return False
+
+    def _snapshot(self):
+        user, system = _cpu_times(self.pid, self.process)
+        read_bytes, write_bytes = _io_bytes(self.pid, self.process)
+        return {"wall": time.perf_counter(), "user": user, "system": system, "read": read_bytes, "write": write_bytes}
+
+    def _sample_rss(self):
+        rss = _current_rss(self.pid, self.process)
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+
+    def _sample_forever(self):
+        while not self._stop.wait(self.sample_interval):
+            self._sample_rss()
+
+    def _peak_rss(self):
+        if self.hwm_reset:
+            hwm = _read_proc_status_kb(self.pid, "VmHWM")  # Exact, unlike the sampled value
+            if hwm is not None:
+                return hwm
+        if self.peak_rss is None and self.pid is None and sys.platform != "win32":
+            import resource
+            scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is in KB on Linux
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale  # Process lifetime peak
+        return self.peak_rss
+
+    def usage(self):
+        """Resource usage of the measured block as a JSON-friendly dict."""
+        start, end = self._start, self._end or self._snapshot()
+        return {
+            "wall_time": round(end["wall"] - start["wall"], 6),
+            "cpu_user": _round(_delta(end["user"], start["user"])),
+            "cpu_system": _round(_delta(end["system"], start["system"])),
+            "peak_rss": self._peak_rss(),
+            "io_read_bytes": _delta(end["read"], start["read"]),
+            "io_write_bytes": _delta(end["write"], start["write"]),
+        }
+
+
+def _round(value):
+    return None if value is None else round(value, 6)
@@ -0,0 +1,109 @@
+import os
+import sys
+import uuid
+import logging
+from contextlib import contextmanager
+from .execution_settings import WORKSPACE_PATH
+
+logger = logging.getLogger(__name__)
+
+# RAM-backed tmpfs when the OS has one, otherwise the workspace directory
+SHARED_DATA_DIR = os.getenv(
+    "SHARED_DATA_DIR",
+    "/dev/shm/datavita" if os.path.isdir("/dev/shm") else os.path.join(WORKSPACE_PATH, "shared"),
+)
+
+
+def is_shareable(value):
+    """True for values that have a zero-copy representation (DataFrames, Series, ndarrays)."""
+    pd = sys.modules.get("pandas")
+    np = sys.modules.get("numpy")
+    if pd is not None and isinstance(value, (pd.DataFrame, pd.Series)):
+        return True
+    return np is not None and isinstance(value, np.ndarray) and value.dtype != object
+
+
+def write_shared(value, directory=SHARED_DATA_DIR, name=None):
+    """Write a DataFrame/Series as an Arrow IPC file or an ndarray as a .npy file.
+
+    Returns a small, picklable descriptor another process can map without
+    copying the data again.
+    """
+    import numpy as np
+    pd = sys.modules.get("pandas")
+
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, name or uuid.uuid4().hex)
+
+    if pd is not None and isinstance(value, (pd.DataFrame, pd.Series)):
+        import pyarrow as pa
+        frame = value.to_frame() if isinstance(value, pd.Series) else value
+        table = pa.Table.from_pandas(frame, preserve_index=True)
+        path = f"{base}.arrow"
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        return {
+            "kind": "arrow",
+            "path": path,
+            "rows": table.num_rows,
+            "columns": [str(c) for c in frame.columns],
+            "series": isinstance(value, pd.Series),
+            "nbytes": os.path.getsize(path),
+        }
+
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        path = f"{base}.npy"
+        np.save(path, value, allow_pickle=False)
+        return {
+            "kind": "ndarray",
+            "path": path,
+            "shape": list(value.shape),
+            "dtype": str(value.dtype),
+            "nbytes": os.path.getsize(path),
+        }
+
+    raise TypeError(f"Values of type {type(value).__name__} cannot be shared without pickling")
+
+
+def open_shared(descriptor):
+    """Map a shared value: a pyarrow.Table for frames, a read-only np.memmap for arrays."""
+    if descriptor["kind"] == "arrow":
+        import pyarrow as pa
+        source = pa.memory_map(descriptor["path"], "r")
+        return pa.ipc.open_file(source).read_all()  # Buffers point into the mapping
+    if descriptor["kind"] == "ndarray":
+        import numpy as np
+        return np.load(descriptor["path"], mmap_mode="r", allow_pickle=False)
+    raise ValueError(f"Unknown shared data kind: {descriptor['kind']}")
+
+
+def to_pandas(descriptor, value):
+    """Turn an opened shared value back into the pandas object it came from."""
+    if descriptor["kind"] != "arrow":
+        return value
+    frame = value.to_pandas()
+    if descriptor.get("series"):
+        return frame.iloc[:, 0]
+    return frame
+
+
+def release_shared(descriptor):
+    """Delete the file backing a shared value."""
+    try:
+        os.remove(descriptor["path"])
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not remove shared data file {descriptor['path']}: {e}")
+
+
+@contextmanager
+def borrowed(descriptor):
+    """Map a shared value for the duration of a block, then release its file."""
+    value = open_shared(descriptor)
+    try:
+        yield value
+    finally:
+        del value
+        release_shared(descriptor)
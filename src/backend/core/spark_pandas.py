@@ -0,0 +1,83 @@
+import sys
+import builtins
+import logging
+from .execution_settings import get_execution_setting
+from .display import render_table
+
+logger = logging.getLogger(__name__)
+
+# Rows collected to the kernel to show a pandas-on-Spark value, from the [Execution] section of settings.config
+SPARK_PANDAS_PREVIEW_ROWS = get_execution_setting("spark_pandas_preview_rows", 50, int)
+# "distributed" avoids pulling all rows to one executor to number them, at the cost of non-sequential labels
+SPARK_PANDAS_INDEX_TYPE = get_execution_setting("spark_pandas_default_index", "distributed")
+
+EXECUTION_MODES = ("pandas", "pandas_on_spark")
+
+
+def _pyspark_pandas():
+    return sys.modules.get("pyspark.pandas")
+
+
+def is_spark_frame(value):
+    """True for pandas-on-Spark DataFrames, Series and Indexes."""
+    ps = _pyspark_pandas()
+    return ps is not None and isinstance(value, (ps.DataFrame, ps.Series, ps.Index))
+
+
+def preview(value, rows=None):
+    """The first rows of a pandas-on-Spark value as a plain pandas object; never the whole dataset."""
+    rows = rows or SPARK_PANDAS_PREVIEW_ROWS
+    return value.head(rows).to_pandas()
+
+
+def render_preview(value, rows=None):
+    """Display bundle for a pandas-on-Spark value, built from a bounded preview.
+
+    One extra row is fetched to tell whether the data was cut; the total
+    row count is not computed since it would scan the whole input.
+    """
+    rows = rows or SPARK_PANDAS_PREVIEW_ROWS
+    head = preview(value, rows + 1)
+    truncated = len(head) > rows
+    head = head.iloc[:rows]
+    bundle = render_table(head, max_rows=rows)
+    bundle["application/json"].update(total_rows=None, truncated=truncated)
+    shape = f"{rows}+ rows" if truncated else f"{len(head)} rows"
+    columns = head.shape[1] if head.ndim == 2 else 1
+    bundle["text/plain"] = f"<pandas-on-Spark {type(value).__name__}: {shape} x {columns} columns>"
+    return bundle
+
+
+def _redirecting_import(name, globals=None, locals=None, fromlist=(), level=0):
+    # Only `import pandas` / `from pandas import ...` written in a cell; libraries keep the real pandas
+    if name == "pandas" and level == 0:
+        ps = _pyspark_pandas()
+        if ps is not None:
+            return ps
+    return builtins.__import__(name, globals, locals, fromlist, level)
+
+
+def enable(namespace):
+    """Switch a kernel namespace to pandas-on-Spark: `pd` and `import pandas` resolve to pyspark.pandas.
+
+    The Spark session comes from SparkExecutor, started in this process on
+    first use and reused for every later cell.
+    """
+    from .spark_config import SparkExecutor
+    if SparkExecutor().get_spark_session() is None:
+        raise RuntimeError("Spark session could not be started, pandas-on-Spark is unavailable")
+    import pyspark.pandas as ps
+    ps.set_option("compute.default_index_type", SPARK_PANDAS_INDEX_TYPE)
+
+    namespace["__builtins__"] = dict(vars(builtins), __import__=_redirecting_import)
+    if namespace.get("pd") is None or namespace.get("pd") is sys.modules.get("pandas"):
+        namespace["pd"] = ps
+    logger.info("Kernel namespace switched to pandas-on-Spark.")
+
+
+def disable(namespace):
+    """Back to plain pandas; pandas-on-Spark values already defined stay as they are."""
+    namespace["__builtins__"] = builtins
+    if namespace.get("pd") is not None and namespace.get("pd") is _pyspark_pandas():
+        import pandas
+        namespace["pd"] = pandas
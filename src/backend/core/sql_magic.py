@@ -0,0 +1,189 @@
+import re
+import sys
+import shlex
+import logging
+import threading
+from .execution_settings import get_execution_setting
+
+logger = logging.getLogger(__name__)
+
+# DuckDB settings from the [Execution] section of settings.config
+SQL_MAGIC_THREADS = get_execution_setting("sql_magic_threads", 0, int)  # 0 lets DuckDB use every core
+SQL_MAGIC_MEMORY_LIMIT = get_execution_setting("sql_magic_memory_limit", "")  # e.g. 4GB, empty keeps DuckDB's default
+
+SQL_FUNCTION = "__sql__"  # Name the rewritten cells call; provided by the kernel namespace
+LINE_MAGIC = re.compile(r"^(?P<indent>\s*)(?:(?P<target>[A-Za-z_]\w*)\s*=\s*)?%sql\b(?P<query>.*)$")
+# Strings, quoted identifiers and comments, removed before looking for table names
+SQL_NOISE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/", re.S)
+SQL_TOKEN = re.compile(r"[A-Za-z_]\w*|[(),.;]")
+
+
+# Words that can follow a table name and are not an alias
+SQL_CLAUSE_WORDS = {
+    "where", "group", "order", "having", "limit", "offset", "join", "inner", "left", "right", "full", "outer",
+    "cross", "natural", "on", "using", "union", "except", "intersect", "window", "qualify", "sample",
+    "positional", "asof", "anti", "semi", "lateral", "pivot", "unpivot", "returning", "set", "values",
+}
+
+
+def has_magic(source):
+    return "%sql" in source
+
+
+def referenced_tables(query):
+    """Bare names used after FROM/JOIN (including FROM a, b) that are not CTEs of the query itself."""
+    tokens = SQL_TOKEN.findall(SQL_NOISE.sub(" ", query))
+    lowered = [token.lower() for token in tokens]
+    ctes = {
+        tokens[i] for i in range(len(tokens) - 2)
+        if lowered[i + 1] == "as" and tokens[i + 2] == "(" and tokens[i] not in "(),.;"
+    }
+    names = []
+    i = 0
+    while i < len(tokens):
+        if lowered[i] in ("from", "join"):
+            i += 1
+            while i < len(tokens) and tokens[i] not in "(),.;":  # FROM (subquery) is scanned on its own
+                name, following = tokens[i], tokens[i + 1] if i + 1 < len(tokens) else None
+                if following not in ("(", ".") and name not in ctes and name not in names:
+                    names.append(name)  # Table functions and schema.table are DuckDB's own
+                i += 1
+                # Skip an alias, then continue a comma-separated list
+                if i < len(tokens) and lowered[i] == "as":
+                    i += 1
+                if i < len(tokens) and tokens[i] not in ",();." and lowered[i] not in SQL_CLAUSE_WORDS:
+                    i += 1
+                if i < len(tokens) and tokens[i] == ",":
+                    i += 1
+                    continue
+                break
+        else:
+            i += 1
+    return names
+
+
+def _call(query, arrow):
+    # Each table is passed as a lambda so the cell's dataflow sees it as read, yet a name that
+    # only exists inside DuckDB (a table created by an earlier statement) is not an error
+    tables = ", ".join(f"{name!r}: lambda: {name}" for name in referenced_tables(query))
+    return f"{SQL_FUNCTION}({query!r}, {{{tables}}}, arrow={arrow})"
+
+
+def _parse_options(line):
+    """Options of a %%sql line: -o/--out NAME binds the result, --arrow returns an Arrow table."""
+    target, arrow = None, False
+    words = shlex.split(line)
+    i = 0
+    while i < len(words):
+        if words[i] in ("-o", "--out") and i + 1 < len(words):
+            target = words[i + 1]
+            i += 1
+        elif words[i] == "--arrow":
+            arrow = True
+        else:
+            raise SyntaxError(f"Unknown %%sql option: {words[i]}")
+        i += 1
+    if target is not None and not target.isidentifier():
+        raise SyntaxError(f"%%sql -o needs a variable name, got {target!r}")
+    return target, arrow
+
+
+def transform(source):
+    """Rewrite %%sql cells and %sql lines into plain Python calling the SQL engine.
+
+    Python source without magics is returned unchanged. A %%sql cell ends
+    with the result as its value, so it is shown like any other DataFrame.
+    """
+    if not has_magic(source):
+        return source
+    lines = source.split("\n")
+    first = next((i for i, line in enumerate(lines) if line.strip()), None)
+    if first is not None and lines[first].lstrip().startswith("%%sql"):
+        target, arrow = _parse_options(lines[first].strip()[len("%%sql"):])
+        query = "\n".join(lines[first + 1:]).strip()
+        call = _call(query, arrow)
+        return f"{target} = {call}\n{target}" if target else call
+
+    rewritten = []
+    for line in lines:
+        match = LINE_MAGIC.match(line)
+        if match is None:
+            rewritten.append(line)
+            continue
+        call = _call(match.group("query").strip(), False)
+        target = match.group("target")
+        rewritten.append(f"{match.group('indent')}{target + ' = ' if target else ''}{call}")
+    return "\n".join(rewritten)
+
+
+class SqlEngine:
+    """An in-process DuckDB connection that queries Python DataFrames by variable name.
+
+    pandas DataFrames and Arrow tables are registered as views over the
+    existing memory for the duration of one query, so DuckDB scans them in
+    place with all its threads; nothing is copied in. Tables created with
+    SQL stay in the connection for later cells.
+    """
+
+    def __init__(self, threads=SQL_MAGIC_THREADS, memory_limit=SQL_MAGIC_MEMORY_LIMIT):
+        self.threads = threads
+        self.memory_limit = memory_limit
+        self.connection = None  # Opened on first use, after a kernel is forked from the template
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        if self.connection is None:
+            import duckdb
+            self.connection = duckdb.connect(":memory:")
+            if self.threads > 0:
+                self.connection.execute(f"SET threads = {int(self.threads)}")
+            if self.memory_limit:
+                self.connection.execute("SET memory_limit = ?", [self.memory_limit])
+        return self.connection
+
+    def _registrable(self, value):
+        pd = sys.modules.get("pandas")
+        pa = sys.modules.get("pyarrow")
+        if pd is not None and isinstance(value, pd.Series):
+            return value.to_frame()  # Shares the column's memory
+        if pd is not None and isinstance(value, pd.DataFrame):
+            return value
+        if pa is not None and isinstance(value, (pa.Table, pa.RecordBatch)):
+            return value
+        return None
+
+    def run(self, query, tables=None, arrow=False):
+        """Run SQL over the given {name: getter} tables; the last statement's result as a DataFrame (or Arrow table)."""
+        with self.lock:
+            connection = self._connect()
+            registered = []
+            try:
+                for name, getter in (tables or {}).items():
+                    try:
+                        value = self._registrable(getter())
+                    except NameError:
+                        continue  # Not a Python variable, DuckDB resolves it
+                    if value is not None:
+                        connection.register(name, value)
+                        registered.append(name)
+                result = connection.execute(query)
+                if result.description is None:
+                    return None  # The last statement returned no rows (CREATE, INSERT...)
+                if arrow:
+                    # to_arrow_table() replaced fetch_arrow_table() in newer DuckDB releases
+                    fetch = getattr(result, "to_arrow_table", None) or result.fetch_arrow_table
+                    return fetch()
+                return result.df()
+            finally:
+                for name in registered:
+                    connection.unregister(name)
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+# Per-process engine (each kernel has its own connection)
+sql_engine = SqlEngine()
@@ -0,0 +1,285 @@
+import io
+import os
+import sys
+import json
+import zlib
+import time
+import types
+import pickle
+import sqlite3
+import hashlib
+import logging
+import threading
+import importlib
+from .cell_cache import fingerprint, Unfingerprintable
+from .execution_settings import get_execution_setting, WORKSPACE_PATH
+
+try:
+    import zstandard  # Optional: faster and smaller than zlib
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# "memory" keeps only the JSON view of the last cell; "database" persists every variable
+STATE_STORAGE = os.getenv("STATE_STORAGE", "memory")
+NOTEBOOK_STATE_DB = os.getenv("NOTEBOOK_STATE_DB", "notebook_states.db")
+STATE_BLOB_DIR = os.getenv("STATE_BLOB_DIR", os.path.join(WORKSPACE_PATH, "state_store"))
+STATE_BLOB_GRACE_SECONDS = 3600  # Unreferenced blobs younger than this may belong to a snapshot in progress
+STATE_GC_INTERVAL = get_execution_setting("state_gc_interval_seconds", 3600, int)  # 0 disables
+
+CODEC = "zstd" if zstandard is not None else "zlib"
+JSON_SAFE_TYPES = (str, int, float, bool, type(None), list, dict)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notebook_variables (
+    notebook_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    format TEXT NOT NULL,
+    type_name TEXT,
+    nbytes INTEGER,
+    updated_at REAL,
+    PRIMARY KEY (notebook_id, name)
+);
+"""
+
+
+def state_storage_enabled():
+    return STATE_STORAGE == "database"
+
+
+def compress(data):
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+
+def decompress(data, codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Variable was stored with zstd but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class Unstorable(Exception):
+    """Raised for values that cannot be restored in another process (cell-defined functions/classes)."""
+
+
+def _is_frame(value):
+    pd = sys.modules.get("pandas")
+    return pd is not None and isinstance(value, (pd.DataFrame, pd.Series))
+
+
+def _is_array(value):
+    np = sys.modules.get("numpy")
+    return np is not None and isinstance(value, np.ndarray) and value.dtype != object
+
+
+def check_storable(value):
+    if isinstance(value, (types.FunctionType, types.MethodType, type)) or type(value).__module__ == "__main__":
+        raise Unstorable(f"{type(value).__name__} defined in the notebook is restored by re-running its cell")
+
+
+def value_hash(value):
+    """Content hash of a value, plus its serialized form when computing the hash produced it."""
+    check_storable(value)
+    if isinstance(value, types.ModuleType):
+        return f"module-{value.__name__}", None
+    if _is_frame(value) or _is_array(value):
+        try:
+            return fingerprint(value, exact=True), None
+        except (Unfingerprintable, TypeError):
+            pass  # e.g. object columns that pandas cannot hash; the serialized bytes are hashed instead
+    stored = serialize(value)
+    return hashlib.sha256(stored[0].encode() + stored[1]).hexdigest(), stored
+
+
+def serialize(value):
+    """Return (format, bytes): Parquet for frames, .npy for arrays, JSON or pickle for the rest."""
+    check_storable(value)
+    if isinstance(value, types.ModuleType):
+        return "module", value.__name__.encode()
+    if _is_frame(value):
+        pd = sys.modules["pandas"]
+        frame = value.to_frame() if isinstance(value, pd.Series) else value
+        if all(isinstance(column, str) for column in frame.columns):
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                buffer = io.BytesIO()
+                pq.write_table(pa.Table.from_pandas(frame, preserve_index=True), buffer, compression="zstd")
+                return ("parquet-series" if isinstance(value, pd.Series) else "parquet"), buffer.getvalue()
+            except Exception as e:
+                logger.debug(f"Parquet not usable for this frame, pickling it: {e}")
+    elif _is_array(value):
+        import numpy as np
+        buffer = io.BytesIO()
+        np.save(buffer, value, allow_pickle=False)
+        return f"npy+{CODEC}", compress(buffer.getvalue())
+    elif isinstance(value, JSON_SAFE_TYPES):
+        try:
+            encoded = json.dumps(value)
+            if json.loads(encoded) == value:  # Tuples, int keys etc. would not round-trip
+                return "json", encoded.encode()
+        except (TypeError, ValueError):
+            pass
+    return f"pickle+{CODEC}", compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def deserialize(fmt, data):
+    kind, _, codec = fmt.partition("+")
+    if kind == "module":
+        return importlib.import_module(data.decode())
+    if kind in ("parquet", "parquet-series"):
+        import pyarrow.parquet as pq
+        frame = pq.read_table(io.BytesIO(data)).to_pandas()
+        return frame.iloc[:, 0] if kind == "parquet-series" else frame
+    if kind == "npy":
+        import numpy as np
+        return np.load(io.BytesIO(decompress(data, codec)), allow_pickle=False)
+    if kind == "json":
+        return json.loads(data)
+    if kind == "pickle":
+        return pickle.loads(decompress(data, codec))
+    raise ValueError(f"Unknown stored variable format: {fmt}")
+
+
+class StateStore:
+    """Persistent, content-addressed store of notebook variables.
+
+    Each variable is serialized on its own into a blob named after its
+    content hash, so unchanged variables are never rewritten and identical
+    values are stored once. A SQLite manifest maps (notebook, name) to blobs.
+    """
+
+    def __init__(self, db_path=NOTEBOOK_STATE_DB, blob_dir=STATE_BLOB_DIR):
+        self.db_path = db_path
+        self.blob_dir = blob_dir
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    def _blob_path(self, blob_hash):
+        return os.path.join(self.blob_dir, blob_hash[:2], blob_hash)
+
+    def _write_blob(self, blob_hash, data):
+        path = self._blob_path(blob_hash)
+        if os.path.exists(path):
+            os.utime(path)  # Same content is already stored
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def snapshot(self, notebook_id, namespace, names, known_hashes):
+        """Write the given variables that changed since `known_hashes` and drop the deleted ones.
+
+        Returns a report and the updated {name: hash} map.
+        """
+        hashes = dict(known_hashes)
+        report = {"written": [], "unchanged": [], "removed": [], "skipped": {}}
+        rows = []
+        for name in sorted(names):
+            if name.startswith("_"):
+                continue
+            if name not in namespace:
+                if name in hashes:
+                    hashes.pop(name)
+                    report["removed"].append(name)
+                continue
+            value = namespace[name]
+            try:
+                blob_hash, stored = value_hash(value)
+                if hashes.get(name) == blob_hash:
+                    report["unchanged"].append(name)
+                    continue
+                fmt, data = stored or serialize(value)
+                self._write_blob(blob_hash, data)
+            except Exception as e:
+                if not isinstance(e, Unstorable):
+                    logger.warning(f"Could not store variable {name}: {e}")
+                report["skipped"][name] = str(e)
+                if hashes.pop(name, None) is not None:
+                    report["removed"].append(name)  # The stored value is out of date
+                continue
+            hashes[name] = blob_hash
+            rows.append((notebook_id, name, blob_hash, fmt, type(value).__name__, len(data), time.time()))
+            report["written"].append(name)
+
+        with self.lock:
+            connection = self._connect()
+            connection.executemany(
+                "INSERT OR REPLACE INTO notebook_variables "
+                "(notebook_id, name, hash, format, type_name, nbytes, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            connection.executemany(
+                "DELETE FROM notebook_variables WHERE notebook_id = ? AND name = ?",
+                [(notebook_id, name) for name in report["removed"]],
+            )
+            connection.commit()
+        return report, hashes
+
+    def manifest(self, notebook_id):
+        """{name: {hash, format, type_name, nbytes, updated_at}} of a notebook's stored variables."""
+        with self.lock:
+            rows = self._connect().execute(
+                "SELECT name, hash, format, type_name, nbytes, updated_at FROM notebook_variables WHERE notebook_id = ?",
+                (notebook_id,),
+            ).fetchall()
+        return {
+            name: {"hash": blob_hash, "format": fmt, "type_name": type_name, "nbytes": nbytes, "updated_at": updated_at}
+            for name, blob_hash, fmt, type_name, nbytes, updated_at in rows
+        }
+
+    def load(self, entry):
+        """Read one variable back from a manifest entry."""
+        with open(self._blob_path(entry["hash"]), "rb") as f:
+            return deserialize(entry["format"], f.read())
+
+    def load_json_state(self, notebook_id):
+        """The JSON-friendly variables of a notebook, read without unpickling anything."""
+        state = {}
+        for name, entry in self.manifest(notebook_id).items():
+            if entry["format"] == "json":
+                try:
+                    state[name] = self.load(entry)
+                except OSError as e:
+                    logger.warning(f"Stored variable {name} of notebook {notebook_id} is unreadable: {e}")
+        return state
+
+    def clear(self, notebook_id):
+        with self.lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM notebook_variables WHERE notebook_id = ?", (notebook_id,))
+            connection.commit()
+
+    def collect_garbage(self):
+        """Delete blobs no notebook refers to any more; returns how many were removed."""
+        with self.lock:
+            referenced = {row[0] for row in self._connect().execute("SELECT DISTINCT hash FROM notebook_variables")}
+        removed = 0
+        cutoff = time.time() - STATE_BLOB_GRACE_SECONDS
+        for root, _, files in os.walk(self.blob_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if name not in referenced and os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+        return removed
+
+
+# Shared state store (the API process and every kernel open their own connection)
+state_store = StateStore()
@@ -0,0 +1,223 @@
+import sys
+import json
+import types
+import logging
+import reprlib
+from .dataframe_viewer import VIEWER_PAGE_SIZE, VIEWER_MAX_PAGE_SIZE
+from .spark_pandas import is_spark_frame
+from .lazy_variable import LazyVariable
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_CHARS = 80  # repr() shown next to scalars and strings in the variable list
+ITEM_REPR_CHARS = 200  # repr() of each item on an inspected page
+SECTIONS = ("rows", "items", "columns", "describe", "memory", "attributes")
+
+
+def _pandas():
+    return sys.modules.get("pandas")
+
+
+def _numpy():
+    return sys.modules.get("numpy")
+
+
+def _short_repr(value, limit=PREVIEW_CHARS):
+    """repr() cut to `limit` chars without building the full repr of long strings, bytes, ints or containers."""
+    if isinstance(value, (str, bytes, bytearray)) and len(value) > limit:
+        value = value[:limit]  # Only the head is ever shown
+    elif isinstance(value, int) and value.bit_length() > 4 * limit:
+        return f"<{type(value).__name__} of {value.bit_length()} bits>"  # More digits than could be shown
+    bounded = reprlib.Repr()
+    bounded.maxstring = bounded.maxother = bounded.maxlong = limit
+    try:
+        text = bounded.repr(value)
+    except Exception as e:
+        text = f"<repr failed: {e}>"
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def _kind(value):
+    pd, np = _pandas(), _numpy()
+    if is_spark_frame(value):
+        return "spark_frame"
+    if pd is not None and isinstance(value, pd.DataFrame):
+        return "dataframe"
+    if pd is not None and isinstance(value, pd.Series):
+        return "series"
+    if np is not None and isinstance(value, np.ndarray):
+        return "ndarray"
+    if isinstance(value, types.ModuleType):
+        return "module"
+    if isinstance(value, (types.FunctionType, types.BuiltinFunctionType, types.MethodType, type)):
+        return "callable"
+    if isinstance(value, dict):
+        return "mapping"
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return "sequence"
+    if isinstance(value, (str, bytes, int, float, complex, bool, type(None))):
+        return "scalar"
+    return "object"
+
+
+def summarize(name, value):
+    """Cheap summary of a variable: nothing here walks the data or copies it."""
+    kind = _kind(value)
+    summary = {"name": name, "type": type(value).__name__, "kind": kind, "expandable": kind not in ("scalar", "module")}
+    if kind == "dataframe":
+        summary["shape"] = list(value.shape)
+        summary["dtypes"] = {str(dtype): int(count) for dtype, count in value.dtypes.astype(str).value_counts().items()}
+        summary["memory_bytes"] = int(value.memory_usage(index=True, deep=False).sum())
+    elif kind == "spark_frame":
+        # Metadata only: the row count of a pandas-on-Spark value is a Spark job over the whole input
+        if hasattr(value, "columns"):
+            summary["columns"] = len(value.columns)
+            summary["dtypes"] = {str(dtype): int(count) for dtype, count in value.dtypes.astype(str).value_counts().items()}
+        else:
+            summary["dtype"] = str(value.dtype)
+    elif kind == "series":
+        summary["shape"] = list(value.shape)
+        summary["dtype"] = str(value.dtype)
+        summary["memory_bytes"] = int(value.memory_usage(index=True, deep=False))
+    elif kind == "ndarray":
+        summary["shape"] = list(value.shape)
+        summary["dtype"] = str(value.dtype)
+        summary["memory_bytes"] = int(value.nbytes)
+    elif kind in ("mapping", "sequence"):
+        summary["length"] = len(value)
+        summary["memory_bytes"] = sys.getsizeof(value)  # The container only, not its items
+    elif kind == "scalar":
+        if isinstance(value, (str, bytes)):
+            summary["length"] = len(value)
+        summary["preview"] = _short_repr(value)
+        summary["memory_bytes"] = sys.getsizeof(value)
+    elif kind == "module":
+        summary["preview"] = value.__name__
+    else:
+        summary["preview"] = _short_repr(value)
+    return summary
+
+
+def list_variables(namespace, offset=0, limit=VIEWER_PAGE_SIZE, include_modules=False, hidden=()):
+    """One page of variable summaries, sorted by name."""
+    names = sorted(
+        name for name, value in namespace.items()
+        if not name.startswith("_") and name not in hidden and not isinstance(value, LazyVariable)  # Listed by the kernel
+        and (include_modules or not isinstance(value, types.ModuleType))
+    )
+    offset, limit = max(int(offset), 0), min(max(int(limit), 0), VIEWER_MAX_PAGE_SIZE)
+    variables = []
+    for name in names[offset:offset + limit]:
+        try:
+            variables.append(summarize(name, namespace[name]))
+        except Exception as e:
+            variables.append({"name": name, "type": type(namespace[name]).__name__, "error": str(e)})
+    return {"offset": offset, "limit": limit, "total": len(names), "variables": variables}
+
+
+def _page(items, offset, limit):
+    return [_short_repr(item, ITEM_REPR_CHARS) for item in items[offset:offset + limit]]
+
+
+def _frame_json(frame):
+    return json.loads(frame.to_json(orient="split", date_format="iso", default_handler=str))
+
+
+def _inspect_spark_frame(value, section, offset, limit, page):
+    if section == "rows":
+        rows = value.head(offset + limit).to_pandas().iloc[offset:]  # Never more than one page past the offset
+        page.update(total=None, **_frame_json(rows))
+    elif section == "columns" and hasattr(value, "columns"):
+        columns = value.columns[offset:offset + limit]
+        page.update(total=len(value.columns), columns=[{"name": str(c), "dtype": str(value[c].dtype)} for c in columns])
+    elif section == "describe" and hasattr(value, "columns"):
+        columns = list(value.columns[offset:offset + limit])
+        page.update(total=len(value.columns), **_frame_json(value[columns].describe().to_pandas()))
+    else:
+        raise ValueError(f"{section} is not available for pandas-on-Spark {type(value).__name__}")
+    return page
+
+
+def inspect(value, section=None, offset=0, limit=VIEWER_PAGE_SIZE):
+    """Expensive details of one variable, one page at a time.
+
+    Sections: rows (DataFrame/Series/ndarray), items (containers),
+    columns and describe (DataFrames, paged by column), memory (deep size)
+    and attributes (other objects). pandas-on-Spark values only collect
+    the rows of the requested page.
+    """
+    kind = _kind(value)
+    section = section or {
+        "dataframe": "rows", "series": "rows", "ndarray": "rows", "spark_frame": "rows", "mapping": "items", "sequence": "items",
+    }.get(kind, "attributes")
+    if section not in SECTIONS:
+        raise ValueError(f"Unknown section {section}, expected one of {', '.join(SECTIONS)}")
+    offset, limit = max(int(offset), 0), min(max(int(limit), 0), VIEWER_MAX_PAGE_SIZE)
+    page = {"section": section, "offset": offset, "limit": limit}
+    if kind == "spark_frame":
+        return _inspect_spark_frame(value, section, offset, limit, page)
+
+    if section == "memory":
+        if kind in ("dataframe", "series"):
+            usage = value.memory_usage(index=True, deep=True)
+            page["memory_bytes"] = int(usage.sum()) if kind == "dataframe" else int(usage)
+        elif kind == "ndarray":
+            page["memory_bytes"] = int(value.nbytes)
+        elif kind == "mapping":
+            page["memory_bytes"] = sys.getsizeof(value) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+        elif kind == "sequence":
+            page["memory_bytes"] = sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value)
+        else:
+            page["memory_bytes"] = sys.getsizeof(value)
+        return page
+
+    if section == "rows":
+        if kind in ("dataframe", "series"):
+            page.update(total=len(value), **_frame_json(value.iloc[offset:offset + limit]))
+        elif kind == "ndarray":
+            rows = value[offset:offset + limit] if value.ndim else value.reshape(1)
+            page.update(total=len(value) if value.ndim else 1, data=json.loads(json.dumps(rows.tolist(), default=str)))
+        else:
+            raise ValueError(f"{type(value).__name__} has no rows")
+        return page
+
+    if section in ("columns", "describe"):
+        if kind != "dataframe":
+            raise ValueError(f"{section} is only available for DataFrames")
+        columns = value.columns[offset:offset + limit]
+        page["total"] = len(value.columns)
+        if section == "columns":
+            part = value[columns]
+            non_null = part.count()
+            memory = part.memory_usage(index=False, deep=True)
+            page["columns"] = [
+                {"name": str(c), "dtype": str(part[c].dtype), "non_null": int(non_null[c]), "memory_bytes": int(memory[c])}
+                for c in columns
+            ]
+        else:
+            page.update(_frame_json(value[columns].describe(include="all")))
+        return page
+
+    if section == "items":
+        if kind == "mapping":
+            keys = list(value)
+            page.update(total=len(keys), items=[
+                {"key": _short_repr(k, ITEM_REPR_CHARS), "value": _short_repr(value[k], ITEM_REPR_CHARS)}
+                for k in keys[offset:offset + limit]
+            ])
+        elif kind == "sequence":
+            items = sorted(value, key=repr) if isinstance(value, (set, frozenset)) else value
+            page.update(total=len(items), items=_page(items, offset, limit))
+        else:
+            raise ValueError(f"{type(value).__name__} has no items")
+        return page
+
+    names = [name for name in dir(value) if not name.startswith("_")]
+    attributes = []
+    for name in names[offset:offset + limit]:
+        try:
+            attributes.append({"name": name, "value": _short_repr(getattr(value, name), ITEM_REPR_CHARS)})
+        except Exception as e:
+            attributes.append({"name": name, "error": str(e)})
+    page.update(total=len(names), repr=_short_repr(value, ITEM_REPR_CHARS), attributes=attributes)
+    return page
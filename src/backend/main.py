@@ -1,16 +1,23 @@
 from flask import Flask, request, jsonify, send_file, Response
 from datetime import datetime
 from sqlalchemy import DateTime
-from concurrent.futures import ProcessPoolExecutor
 import threading
-import multiprocessing
 from flask_cors import CORS
-from flask_socketio import SocketIO
-from routes.python_routes import python_bp  # Python routes blueprint
+from flask_socketio import SocketIO, join_room, leave_room
+from routes.python_routes import python_bp, resolve_notebook_id  # Python routes blueprint
 from routes.Pyspark_routes import pyspark_bp  # PySpark routes blueprint
 from routes.sql_routes import sql_bp
+from routes.notebook_routes import notebook_bp
 from sqlalchemy.exc import IntegrityError
 from core.auth import auth_bp
+from core.kernel_manager import kernel_manager
+from core.job_manager import job_manager
+from core.output_stream import output_streamer, read_spooled_output
+from core.dataflow import dataflow_registry
+from core.execution_history import execution_history, output_size
+from core.state_store import state_store, STATE_STORAGE
+from core.checkpoint import list_checkpoints
+from core.package_installer import package_installer
 from playground.files import file_manager_bp
 from playground.projects import project_bp
 from scripts import scan_and_store_files
@@ -25,6 +32,7 @@ from models.models import db
 from models.models import User, FileAccess
 from sqlalchemy.exc import SQLAlchemyError
 import urllib.parse
+import atexit
 import difflib
 import duckdb
 import os
@@ -61,6 +69,16 @@ CORS(app, resources={r"/*": {
 })
 
 socketio = SocketIO(app, cors_allowed_origins="http://localhost:5173")
+output_streamer.init_app(socketio)  # ✅ Cell output is pushed to per-cell rooms
+kernel_manager.prewarm()  # ✅ Have a kernel with pandas & co. imported before the first notebook asks
+atexit.register(kernel_manager.shutdown_all)  # ✅ Kernels are checkpointed on the way down and restored on next use
+
+# ✅ A running kernel picks up packages installed into its notebook's overlay
+def refresh_kernel_packages(notebook_id, requirement):
+    if kernel_manager.find_kernel(notebook_id) is not None:
+        kernel_manager.call(notebook_id, "refresh_packages", timeout=5)
+
+package_installer.on_installed.append(refresh_kernel_packages)
  
 # Register Blueprints for Python and PySpark execution
 app.register_blueprint(python_bp, url_prefix='/python')
@@ -70,16 +88,16 @@ app.register_blueprint(auth_bp, url_prefix='/auth')
 app.register_blueprint(scripts_bp, url_prefix="/scripts")
 app.register_blueprint(file_manager_bp, url_prefix='/playground_files')
 app.register_blueprint(project_bp, url_prefix='/playground_project')
+app.register_blueprint(notebook_bp, url_prefix='/notebooks')
 
-MAX_WORKERS = int(os.getenv("MAX_WORKERS", 2))  # Use process-based execution
-STATE_STORAGE_TYPE = os.getenv("STATE_STORAGE", "memory")  # Can be "database" or "memory"
+STATE_STORAGE_TYPE = STATE_STORAGE  # Can be "database" or "memory", see core/state_store.py
 
-# ✅ Initialize process-based execution pool
-state_lock = threading.Lock()
-executor = ProcessPoolExecutor(max_workers=MAX_WORKERS)  # 🛠️ Use processes, not threads
+# ✅ Python cells run in per-notebook kernel processes (see core/kernel_manager.py), scheduled
+# per notebook by core/job_manager.py: different notebooks run in parallel, one cell at a time each
 
-# ✅ State management (default: in-memory, but can be DB)
-notebook_state = {}
+# ✅ State management (default: in-memory, but can be DB), one entry per notebook
+notebook_states = {}
+notebook_states_lock = threading.Lock()  # Guards the dict only, never held while a cell runs
 
 # ✅ Logging configuration
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -97,90 +115,435 @@ if not os.path.exists(USER_WORKSPACE):
     os.makedirs(USER_WORKSPACE)
 
 # ✅ Functions to manage state persistence
-def save_state_to_db(state):
+def snapshot_notebook_state(notebook_id):
+    try:
+        report = kernel_manager.snapshot_state(notebook_id)
+        if report["written"] or report["removed"]:
+            logger.info(f"Stored state of notebook {notebook_id}: {len(report['written'])} written, {len(report['removed'])} removed.")
+    except Exception as e:
+        logger.error(f"Error storing state of notebook {notebook_id}: {str(e)}")
+
+def save_state_to_db(state, notebook_id="default"):
     """Save notebook state to memory or database."""
-    global notebook_state
+    with notebook_states_lock:
+        notebook_states[notebook_id] = state.copy()  # Save to memory
     if STATE_STORAGE_TYPE == "database":
-        pass  # TODO: Implement DB saving logic
-    else:
-        notebook_state = state.copy()  # Save to memory
+        # ✅ The kernel writes only the variables that changed, off the request path
+        threading.Thread(target=snapshot_notebook_state, args=(notebook_id,), daemon=True).start()
 
-def get_state_from_db():
+def get_state_from_db(notebook_id="default"):
     """Retrieve notebook state from memory or database."""
     if STATE_STORAGE_TYPE == "database":
-        pass  # TODO: Implement DB retrieval logic
-    return notebook_state.copy()
+        return state_store.load_json_state(notebook_id)
+    with notebook_states_lock:
+        return dict(notebook_states.get(notebook_id, {}))
 
-# ✅ Function to execute Python code in a separate process
-def run_python_code(code, cell_id, previous_state):
-    """Executes Python code in a safe and isolated process."""
-    try:
-        # Redirect output to capture print statements
-        output_capture = io.StringIO()
-        sys.stdout = output_capture  # Redirect stdout
+# ✅ Bookkeeping once a cell has finished (sync or async)
+def finish_python_execution(job, stream=False, user_id=None):
+    reply = job.reply or {}
+    if "notebook_state" in reply:  # Batches leave it out and save the state once at the end
+        save_state_to_db(reply["notebook_state"], job.notebook_id)
 
-        # Merge previous state into execution context
-        local_namespace = previous_state.copy()
-        global_namespace = {}  # Ensure globals remain separate
-
-        # ✅ Execute code inside a controlled process
-        exec(code, global_namespace, local_namespace)
-
-        # Capture execution output
-        result = output_capture.getvalue().strip() or f"Execution of cell {cell_id} finished successfully!"
-
-        # ✅ Update notebook state safely
-        with state_lock:
-            notebook_state.update(local_namespace)
-            save_state_to_db(notebook_state)
+    # ✅ Resource usage goes into the queryable history table
+    execution_history.record(
+        "python", reply.get("resources"), user_id=user_id,
+        notebook_id=job.notebook_id, cell_id=job.cell_id, status=job.status,
+        source=job.code, output_bytes=output_size(reply), cached=reply.get("cached", False),
+    )
 
-        return result, notebook_state
+    # ✅ Keep the notebook's dataflow graph current for incremental re-runs
+    if job.cell_id is not None and job.status == "succeeded":
+        dataflow_registry.get(job.notebook_id).mark_executed(job.cell_id, job.code)
 
-    except Exception as e:
-        return f"Error: {str(e)}", previous_state
-    finally:
-        sys.stdout = sys.__stdout__  # Restore default stdout
+    if stream:
+        output_streamer.emit_status(job.notebook_id, job.cell_id, job.status, reply.get("summary"))
 
 # ✅ API Route: Execute Python Code
 @app.route("/python/execute", methods=["POST"])
 def execute_python_code_endpoint():
-    """Flask API route to execute Python code safely using multiprocessing."""
+    """Flask API route to execute Python code in the notebook's persistent kernel."""
     data = request.json
     code = data.get("code")
     cell_id = data.get("cell_id")  # Track execution
+    notebook_id = resolve_notebook_id(data)
+    stream = bool(data.get("stream"))  # Output goes to the cell's Socket.IO room instead of the response
+    cache = bool(data.get("cache"))  # Reuse a memoized result if the cell and its inputs are unchanged
+    run_async = bool(data.get("async"))  # Return a job id right away instead of waiting
+    time_limit = data.get("time_limit")  # Optional, can only tighten job_time_limit_seconds
+    include_state = data.get("notebook_state", True) is not False  # Clients using the variable explorer can skip the dump
+    profile = bool(data.get("profile"))  # Sample the cell's stacks and return a flame graph with the result
+    user_id = request.headers.get("X-User-ID")
 
     if not code:
         return jsonify({"error": "No code provided"}), 400
 
     try:
-        # ✅ Fetch previous state safely
-        with state_lock:
-            previous_state = get_state_from_db()
+        # ✅ Only the code goes in; the namespace stays inside the kernel
+        on_output = output_streamer.sink_for(notebook_id, cell_id) if stream else None
+        job = job_manager.submit(
+            notebook_id, code, cell_id=cell_id, time_limit=time_limit, on_output=on_output,
+            on_complete=lambda finished: finish_python_execution(finished, stream, user_id), cache=cache,
+            include_state=include_state, profile=profile,
+        )
+        if run_async:
+            return jsonify({"job_id": job.job_id, "status": job.status}), 202
 
-        # ✅ Use ProcessPoolExecutor to avoid threading issues
-        future = executor.submit(run_python_code, code, cell_id, previous_state)
-        result, updated_state = future.result()  # Wait for execution
+        job.wait()
+        reply = job.reply or {}
+        if job.status == "rejected":
+            return jsonify({"error": job.error, "status": job.status}), 503  # Every kernel slot is busy
+        if job.status in ("timed_out", "cancelled", "killed") or not reply:
+            return jsonify({"error": job.error, "status": job.status, "job_id": job.job_id}), 500
 
-        # ✅ Ensure state is JSON serializable
-        serializable_updated_state = {
-            key: value for key, value in updated_state.items() if isinstance(value, (str, int, float, list, dict, bool, type(None)))
-        }
+        if stream:
+            return jsonify({
+                "status": reply.get("status"),
+                "error": reply.get("error"),
+                "cached": reply.get("cached", False),
+                "outputs": reply.get("outputs", []),
+                "summary": reply.get("summary"),
+                "resources": reply.get("resources"),
+                "queue_wait": job.queue_wait,
+                "profile": reply.get("profile"),
+            })
+
+        return jsonify({
+            "result": reply.get("result"),
+            "outputs": reply.get("outputs", []),
+            "cached": reply.get("cached", False),
+            "resources": reply.get("resources"),
+            "queue_wait": job.queue_wait,  # Seconds spent behind the notebook's earlier cells
+            "notebook_state": reply.get("notebook_state", {}),
+            "profile": reply.get("profile"),  # Top functions, collapsed stacks and flame graph when profiled
+        })
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ✅ One NDJSON line per finished cell of a batch
+def batch_cell_result(job):
+    reply = job.reply or {}
+    return {
+        "cell_id": job.cell_id,
+        "job_id": job.job_id,
+        "status": job.status,
+        "error": job.error,
+        "result": reply.get("result"),
+        "outputs": reply.get("outputs", []),
+        "cached": reply.get("cached", False),
+        "resources": reply.get("resources"),
+        "queue_wait": job.queue_wait,
+        "profile": reply.get("profile"),
+    }
+
+def stream_batch_results(batch):
+    yield json.dumps({"batch_id": batch.batch_id, "cells": [job.cell_id for job in batch.jobs]}) + "\n"
+    for job in batch.results():
+        yield json.dumps(batch_cell_result(job), default=str) + "\n"
+    yield json.dumps({"done": True, "status": batch.status, "notebook_state": batch.notebook_state or {}}, default=str) + "\n"
+
+# ✅ The notebook state is read and saved once per batch instead of once per cell
+def finish_python_batch(batch):
+    if not any(job.reply is not None for job in batch.jobs):
+        return
+    batch.notebook_state = kernel_manager.call(batch.notebook_id, "state")["notebook_state"]
+    save_state_to_db(batch.notebook_state, batch.notebook_id)
+
+# ✅ API Route: Run several cells (a whole notebook or a range of it) in one request
+@app.route("/python/execute_batch", methods=["POST"])
+def execute_batch_endpoint():
+    """Run cells back to back in the notebook's kernel, streaming one NDJSON line per cell.
+
+    Either send the ordered `cells` ([{cell_id, code}]), or leave them out to
+    run the cells last synced to /notebooks/<notebook_id>/cells, optionally
+    limited to `start_cell_id`..`end_cell_id` (inclusive).
+    """
+    data = request.json or {}
+    notebook_id = resolve_notebook_id(data)
+    cells = data.get("cells")
+    stop_on_error = data.get("stop_on_error", True)
+    stream = bool(data.get("stream"))  # Cell output also goes to each cell's Socket.IO room
+    user_id = request.headers.get("X-User-ID")
+
+    try:
+        if cells is None:
+            graph = dataflow_registry.get(notebook_id)
+            with graph.lock:
+                order = list(graph.order)
+                start = order.index(str(data["start_cell_id"])) if data.get("start_cell_id") else 0
+                end = order.index(str(data["end_cell_id"])) + 1 if data.get("end_cell_id") else len(order)
+                cells = [{"cell_id": cell_id, "code": graph.cells[cell_id].code} for cell_id in order[start:end]]
+        if not isinstance(cells, list) or not all(isinstance(cell, dict) for cell in cells):
+            return jsonify({"error": "cells must be a list of {cell_id, code}"}), 400
+        cells = [cell for cell in cells if (cell.get("code") or "").strip()]
+        if not cells:
+            return jsonify({"error": "No cells to run"}), 400
+
+        batch = job_manager.submit_batch(
+            notebook_id, cells, stop_on_error=bool(stop_on_error), time_limit=data.get("time_limit"),
+            on_output=(lambda cell_id: output_streamer.sink_for(notebook_id, cell_id)) if stream else None,
+            on_complete=lambda finished: finish_python_execution(finished, stream, user_id),
+            on_finish=finish_python_batch, cache=bool(data.get("cache")), include_state=False,
+            profile=bool(data.get("profile")),  # Every cell of the batch is profiled
+        )
+        if data.get("async"):
+            return jsonify({"batch_id": batch.batch_id, "status": batch.status}), 202
+        return Response(stream_batch_results(batch), mimetype="application/x-ndjson")
+
+    except ValueError:
+        return jsonify({"error": "start_cell_id/end_cell_id is not a cell of this notebook"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ✅ API Route: Batch status
+@app.route("/python/batches/<batch_id>", methods=["GET"])
+def get_batch_status(batch_id):
+    batch = job_manager.get_batch(batch_id)
+    if batch is None:
+        return jsonify({"error": "Batch not found"}), 404
+    return jsonify(batch.to_dict())
+
+# ✅ API Route: Cancel a batch (stops the running cell and skips the rest)
+@app.route("/python/batches/<batch_id>/cancel", methods=["POST"])
+def cancel_batch(batch_id):
+    batch = job_manager.cancel_batch(batch_id)
+    if batch is None:
+        return jsonify({"error": "Batch not found"}), 404
+    return jsonify(batch.to_dict())
+
+# ✅ API Route: Page through the part of a long cell output that was left out of the reply
+@app.route("/python/outputs/<spool_id>", methods=["GET"])
+def spooled_output_endpoint(spool_id):
+    try:
+        page = read_spooled_output(
+            spool_id,
+            offset=request.args.get("offset", 0, type=int),
+            limit=request.args.get("limit", 65536, type=int),
+        )
+        return jsonify(page)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ✅ API Route: Execution job status
+@app.route("/python/jobs/<job_id>", methods=["GET"])
+def get_job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+# ✅ API Route: Execution job result
+@app.route("/python/jobs/<job_id>/result", methods=["GET"])
+def get_job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    wait = request.args.get("wait", type=float)  # Optional long-poll in seconds
+    if wait:
+        job.wait(min(wait, 60))
+    if not job.done.is_set():
+        return jsonify(job.to_dict()), 202
+    return jsonify(job.to_dict(include_result=True))
+
+# ✅ API Route: Cancel an execution job
+@app.route("/python/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+# ✅ Socket.IO: subscribe to a cell's streamed output
+@socketio.on("join_cell")
+def on_join_cell(data):
+    room = output_streamer.room_name(data.get("notebook_id") or "default", data.get("cell_id"))
+    join_room(room)
+    output_streamer.subscribe(room, ack=bool(data.get("ack")))
+
+@socketio.on("leave_cell")
+def on_leave_cell(data):
+    room = output_streamer.room_name(data.get("notebook_id") or "default", data.get("cell_id"))
+    leave_room(room)
+    output_streamer.unsubscribe(room, ack=bool(data.get("ack")))
+
+@socketio.on("cell_output_ack")
+def on_cell_output_ack(data):
+    room = output_streamer.room_name(data.get("notebook_id") or "default", data.get("cell_id"))
+    output_streamer.acknowledge(room, data.get("seq", 0))
 
-        return jsonify({"result": result, "notebook_state": serializable_updated_state})
+# ✅ API Route: List running kernels
+@app.route("/python/kernels", methods=["GET"])
+def list_kernels_endpoint():
+    return jsonify({"kernels": kernel_manager.list_kernels(), "pool": kernel_manager.pool_info()})
 
+# ✅ API Route: Per-cell resource usage history
+@app.route("/python/execution_history", methods=["GET"])
+def execution_history_endpoint():
+    try:
+        rows = execution_history.query(
+            user_id=request.args.get("user_id"),
+            notebook_id=request.args.get("notebook_id"),
+            cell_id=request.args.get("cell_id"),
+            language=request.args.get("language"),
+            since=request.args.get("since", type=float),
+            limit=min(request.args.get("limit", 100, type=int), 1000),
+        )
+        return jsonify({"executions": rows})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+# ✅ API Route: One cell's timing history against its own baseline
+@app.route("/python/execution_history/cells/<notebook_id>/<cell_id>", methods=["GET"])
+def cell_execution_history_endpoint(notebook_id, cell_id):
+    try:
+        limit = min(request.args.get("limit", 100, type=int), 1000)
+        return jsonify(execution_history.cell_history(notebook_id, cell_id, limit=limit))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ✅ API Route: Runs that were much slower than their cell's baseline, newest first
+@app.route("/python/execution_history/slowdowns", methods=["GET"])
+def execution_slowdowns_endpoint():
+    try:
+        rows = execution_history.slowdowns(
+            notebook_id=request.args.get("notebook_id"),
+            since=request.args.get("since", type=float),
+            limit=min(request.args.get("limit", 100, type=int), 1000),
+        )
+        return jsonify({"slowdowns": rows})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ✅ API Route: Resource usage totals per user
+@app.route("/python/execution_history/by_user", methods=["GET"])
+def execution_usage_by_user_endpoint():
+    try:
+        rows = execution_history.usage_by_user(
+            since=request.args.get("since", type=float),
+            limit=min(request.args.get("limit", 20, type=int), 1000),
+        )
+        return jsonify({"users": rows})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ✅ API Route: Stored variables of a notebook
+@app.route("/python/state/<notebook_id>", methods=["GET"])
+def notebook_state_endpoint(notebook_id):
+    try:
+        return jsonify({"storage": STATE_STORAGE_TYPE, "variables": state_store.manifest(notebook_id)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ✅ API Route: Snapshot a notebook's variables now
+@app.route("/python/state/<notebook_id>/snapshot", methods=["POST"])
+def snapshot_state_endpoint(notebook_id):
+    try:
+        names = (request.json or {}).get("names") if request.is_json else None
+        return jsonify({"report": kernel_manager.snapshot_state(notebook_id, names)})
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ✅ API Route: Forget a notebook's stored variables
+@app.route("/python/state/<notebook_id>", methods=["DELETE"])
+def clear_state_endpoint(notebook_id):
+    try:
+        state_store.clear(notebook_id)
+        return jsonify({"message": f"Stored state of notebook {notebook_id} cleared"})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ✅ API Route: Checkpoints of a notebook
+@app.route("/python/kernels/<notebook_id>/checkpoints", methods=["GET"])
+def list_checkpoints_endpoint(notebook_id):
+    try:
+        return jsonify({"checkpoints": list_checkpoints(notebook_id)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ✅ API Route: Checkpoint a notebook's kernel now
+@app.route("/python/kernels/<notebook_id>/checkpoint", methods=["POST"])
+def checkpoint_kernel_endpoint(notebook_id):
+    try:
+        manifest = kernel_manager.checkpoint(notebook_id)
+        manifest["variables"] = sorted(manifest["variables"])
+        return jsonify({"checkpoint": manifest})
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ✅ API Route: Restore a checkpoint (the latest unless "checkpoint_id" is given) into a notebook's kernel
+@app.route("/python/kernels/<notebook_id>/restore", methods=["POST"])
+def restore_kernel_endpoint(notebook_id):
+    try:
+        checkpoint_id = (request.json or {}).get("checkpoint_id") if request.is_json else None
+        reply = kernel_manager.restore(notebook_id, checkpoint_id)
+        return jsonify({key: reply[key] for key in ("checkpoint_id", "restored", "skipped")})
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ✅ API Route: Restart a notebook's kernel with its namespace, to hand leaked memory back
+@app.route("/python/kernels/<notebook_id>/recycle", methods=["POST"])
+def recycle_kernel_endpoint(notebook_id):
+    try:
+        report = kernel_manager.recycle(notebook_id)
+        if report is None:
+            return jsonify({"error": "Kernel not running or busy"}), 409
+        return jsonify({"recycle": report})
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ✅ API Route: Execution mode of a notebook ("pandas" or "pandas_on_spark", where pd is pyspark.pandas)
+@app.route("/python/kernels/<notebook_id>/mode", methods=["GET", "POST"])
+def kernel_mode_endpoint(notebook_id):
+    try:
+        if request.method == "GET":
+            return jsonify({"notebook_id": notebook_id, "mode": kernel_manager.get_mode(notebook_id)})
+        mode = (request.json or {}).get("mode", "")
+        return jsonify({"notebook_id": notebook_id, "mode": kernel_manager.set_mode(notebook_id, mode)})
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ✅ API Route: Shut down a notebook's kernel
+@app.route("/python/kernels/<notebook_id>", methods=["DELETE"])
+def shutdown_kernel_endpoint(notebook_id):
+    if not kernel_manager.shutdown_kernel(notebook_id):
+        return jsonify({"error": "Kernel not found"}), 404
+    return jsonify({"message": f"Kernel for notebook {notebook_id} shut down"}), 200
  
 # Route to install a package for Python execution
 @app.route('/install_package', methods=['POST'])
 def install_package():
-    package_name = request.json.get('package_name', '')
+    data = request.json or {}
+    package_name = data.get('package_name', '')
+    notebook_id = resolve_notebook_id(data)
     if not package_name:
         return jsonify({"status": "error", "message": "No package name provided"}), 400
    
     try:
-        os.system(f"pip install {package_name}")
-        return jsonify({"status": "success", "message": f"Package {package_name} installed successfully."}), 200
+        # ✅ pip runs on the installer's queue, into the notebook's overlay, not the server environment
+        task = package_installer.submit(notebook_id, package_name)
+        if data.get("wait"):
+            task.wait(min(float(data["wait"]), 600))
+        if task.status == "failed":
+            return jsonify({"status": "error", "message": task.error, "task": task.to_dict()}), 500
+        if task.status == "succeeded":
+            return jsonify({"status": "success", "message": f"Package {package_name} installed successfully.", "task": task.to_dict()}), 200
+        return jsonify({"status": task.status, "message": f"Installing {package_name} in the background.", "task": task.to_dict()}), 202
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
  
@@ -403,6 +766,8 @@ def handle_preflight():
 def download_notebook_ipynb():
     try:
         # Assuming notebook_state is a dictionary with code cells and outputs
+        notebook_id = resolve_notebook_id(request.args)
+        notebook_state = get_state_from_db(notebook_id)
         notebook_content = {
             "cells": [],
             "metadata": {},
@@ -438,6 +803,8 @@ def download_notebook_ipynb():
 def download_notebook_py():
     try:
         # Assuming notebook_state is a dictionary with code cells
+        notebook_id = resolve_notebook_id(request.args)
+        notebook_state = get_state_from_db(notebook_id)
         notebook_code = ""
         for cell_id, cell_data in notebook_state.items():
             notebook_code += f"# Cell {cell_id}\n{cell_data}\n\n"
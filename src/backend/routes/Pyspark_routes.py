@@ -5,7 +5,8 @@ import json
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import sys
-from core.Pyspark_execution import execute_pyspark_code, execute_pyspark_code_from_file
+from core.Pyspark_execution import execute_pyspark_code_measured, execute_pyspark_code_from_file
+from core.execution_history import execution_history
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -129,11 +130,16 @@ def execute_code():
         if not code:
             return jsonify({"error": "No code provided", "status": "error"}), 400
 
-        result, error = execute_pyspark_code(code, persist_session)
+        result, error, resources = execute_pyspark_code_measured(code, persist_session)
+        execution_history.record(
+            "pyspark", resources, user_id=request.headers.get("X-User-ID"),
+            notebook_id=request.json.get('notebook_id'), cell_id=request.json.get('cell_id'),
+            status="failed" if error else "succeeded", source=code,
+        )
 
         if error:
             logging.error(f"Error executing PySpark code: {error}")
-            return jsonify({"error": error, "status": "error"}), 500
+            return jsonify({"error": error, "status": "error", "resources": resources}), 500
         
         formatted_result = format_pyspark_output(result, page, page_size)
 
@@ -144,7 +150,7 @@ def execute_code():
         if isinstance(formatted_result, dict) and "data" in formatted_result and len(formatted_result["data"]) > 10000:
             return generate_large_response(formatted_result["data"])
 
-        return jsonify({"result": formatted_result, "execution_id": execution_id, "status": "success"}), 200
+        return jsonify({"result": formatted_result, "execution_id": execution_id, "resources": resources, "status": "success"}), 200
 
     except Exception as e:
         logging.error(f"Unexpected error in execute_code: {str(e)}")
@@ -0,0 +1,291 @@
+import io
+import json
+import logging
+from flask import Blueprint, request, jsonify, Response
+from core.dataflow import dataflow_registry
+from core.kernel_manager import kernel_manager, KernelError
+from core.job_manager import job_manager
+from core.shared_data import borrowed, release_shared
+
+# Initialize the blueprint
+notebook_bp = Blueprint("notebook_bp", __name__)
+
+logger = logging.getLogger(__name__)
+
+
+# Route to inspect a notebook's dataflow graph
+@notebook_bp.route("/<notebook_id>/graph", methods=["GET"])
+def get_notebook_graph(notebook_id):
+    try:
+        graph = dataflow_registry.get(notebook_id)
+        return jsonify({"status": "success", "graph": graph.to_dict(), "stale": graph.stale_cells()}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# Route to sync the notebook's cells (order and sources) with the graph
+@notebook_bp.route("/<notebook_id>/cells", methods=["PUT"])
+def sync_notebook_cells(notebook_id):
+    try:
+        cells = request.json.get("cells")
+        if not isinstance(cells, list):
+            return jsonify({"status": "error", "message": "cells must be a list of {cell_id, code}"}), 400
+
+        graph = dataflow_registry.get(notebook_id)
+        graph.sync_cells(cells)
+        return jsonify({"status": "success", "stale": graph.stale_cells()}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# Route to re-run an edited cell and only the cells downstream of it
+@notebook_bp.route("/<notebook_id>/cells/<cell_id>/rerun", methods=["POST"])
+def rerun_cell(notebook_id, cell_id):
+    """Re-run (mode=run) or just mark stale (mode=mark) an edited cell and its dependents.
+
+    In run mode the cells are queued as one batch and the batch and job ids
+    are returned right away; follow them at /python/batches/<batch_id>.
+    """
+    try:
+        data = request.json or {}
+        mode = data.get("mode", "run")
+        if mode not in ("run", "mark"):
+            return jsonify({"status": "error", "message": "mode must be 'run' or 'mark'"}), 400
+
+        graph = dataflow_registry.get(notebook_id)
+        if "code" in data:
+            graph.update_cell(cell_id, data["code"])
+        affected = graph.affected_cells([cell_id])
+        if not affected:
+            return jsonify({"status": "error", "message": f"Unknown cell {cell_id}"}), 404
+
+        if mode == "mark":
+            return jsonify({"status": "success", "stale": graph.stale_cells(), "affected": affected}), 200
+
+        def mark_executed(job):
+            if job.status == "succeeded":
+                graph.mark_executed(job.cell_id, job.code)
+
+        # One batch in dataflow order: a failure leaves the remaining dependents stale, and it cancels as a group
+        batch = job_manager.submit_batch(
+            notebook_id, [{"cell_id": affected_id, "code": graph.cells[affected_id].code} for affected_id in affected],
+            stop_on_error=True, on_complete=mark_executed,
+        )
+        return jsonify({
+            "status": "success",
+            "batch_id": batch.batch_id,
+            "jobs": [{"cell_id": job.cell_id, "job_id": job.job_id} for job in batch.jobs],
+            "affected": affected,
+            "stale": graph.stale_cells(),
+        }), 202
+
+    except Exception as e:
+        logger.error(f"Unexpected error during incremental re-execution: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# Route to list a kernel's variables with cheap summaries
+@notebook_bp.route("/<notebook_id>/variables", methods=["GET"])
+def list_variables(notebook_id):
+    """Type, length/shape, dtypes and shallow memory of each variable, paged by name."""
+    try:
+        page = kernel_manager.list_variables(
+            notebook_id,
+            offset=request.args.get("offset", 0, type=int),
+            limit=request.args.get("limit", 100, type=int),
+            include_modules=request.args.get("include_modules", "false").lower() == "true",
+        )
+        return jsonify({"status": "success", **page}), 200
+    except KernelError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# Route to expand one variable: rows, items, columns, describe, memory or attributes, paged
+@notebook_bp.route("/<notebook_id>/variables/<name>", methods=["GET"])
+def inspect_variable(notebook_id, name):
+    try:
+        page = kernel_manager.inspect_variable(
+            notebook_id, name,
+            section=request.args.get("section"),
+            offset=request.args.get("offset", 0, type=int),
+            limit=request.args.get("limit", 100, type=int),
+        )
+        return jsonify({"status": "success", "name": name, **page}), 200
+    except LookupError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except KernelError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# Route to complete code at a cursor from the kernel's live namespace
+@notebook_bp.route("/<notebook_id>/complete", methods=["POST"])
+def complete_code(notebook_id):
+    """Attribute, column and name completions plus the signature of the call around the cursor.
+
+    Answered by a side thread of the kernel, so it does not wait for a running cell.
+    """
+    try:
+        data = request.json or {}
+        cursor = data.get("cursor")
+        reply = kernel_manager.complete(notebook_id, data.get("code", ""), int(cursor) if cursor is not None else None)
+        return jsonify({"status": "success", **reply}), 200
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": f"Invalid cursor: {e}"}), 400
+    except LookupError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except KernelError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# Route to preview a kernel variable without pickling it out of the kernel
+@notebook_bp.route("/<notebook_id>/variables/<name>/preview", methods=["GET"])
+def preview_variable(notebook_id, name):
+    try:
+        rows = min(int(request.args.get("rows", 50)), 1000)
+        descriptor = kernel_manager.export_variable(notebook_id, name, rows=rows)  # The kernel writes only these rows
+        with borrowed(descriptor) as value:
+            if descriptor["kind"] == "arrow":
+                data = json.loads(value.to_pandas().to_json(orient="split", date_format="iso"))
+            else:
+                data = value.tolist()
+        return jsonify({"status": "success", "descriptor": descriptor, "data": data}), 200
+    except LookupError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except KernelError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# Route to export a kernel DataFrame straight from its Arrow mapping
+@notebook_bp.route("/<notebook_id>/variables/<name>/export", methods=["GET"])
+def export_variable(notebook_id, name):
+    try:
+        export_format = request.args.get("format", "csv")
+        if export_format not in ("csv", "parquet", "arrow"):
+            return jsonify({"status": "error", "message": "Unsupported format"}), 400
+
+        descriptor = kernel_manager.export_variable(notebook_id, name)
+        if descriptor["kind"] != "arrow":
+            release_shared(descriptor)
+            return jsonify({"status": "error", "message": "Only DataFrames can be exported"}), 400
+
+        import pyarrow as pa
+        output = io.BytesIO()
+        with borrowed(descriptor) as table:
+            if export_format == "csv":
+                import pyarrow.csv as pa_csv
+                pa_csv.write_csv(table, output)
+                mimetype = "text/csv"
+            elif export_format == "parquet":
+                import pyarrow.parquet as pq
+                pq.write_table(table, output)
+                mimetype = "application/octet-stream"
+            else:
+                with pa.ipc.new_file(output, table.schema) as writer:
+                    writer.write_table(table)
+                mimetype = "application/vnd.apache.arrow.file"
+
+        return Response(
+            output.getvalue(),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f"attachment;filename={name}.{export_format}"}
+        )
+    except LookupError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except KernelError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# Route to hand a kernel DataFrame to the SQL (DuckDB) or Spark engine
+@notebook_bp.route("/<notebook_id>/variables/<name>/handoff", methods=["POST"])
+def handoff_variable(notebook_id, name):
+    try:
+        data = request.json or {}
+        engine = data.get("engine", "sql")
+        table_name = data.get("table_name") or name
+        if not table_name.isidentifier():
+            return jsonify({"status": "error", "message": "Invalid table name"}), 400
+        if engine not in ("sql", "spark"):
+            return jsonify({"status": "error", "message": "engine must be 'sql' or 'spark'"}), 400
+
+        descriptor = kernel_manager.export_variable(notebook_id, name)
+        if descriptor["kind"] != "arrow":
+            release_shared(descriptor)
+            return jsonify({"status": "error", "message": "Only DataFrames can be handed off"}), 400
+
+        with borrowed(descriptor) as table:
+            if engine == "sql":
+                from core.sql_execution import get_db_connection
+                connection = get_db_connection()
+                if not connection:
+                    return jsonify({"status": "error", "message": "Database connection failed"}), 500
+                try:
+                    connection.register("kernel_variable", table)  # DuckDB scans the Arrow buffers in place
+                    connection.execute(f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM kernel_variable")
+                finally:
+                    connection.close()
+            else:
+                from core.Pyspark_execution import spark_executor
+                spark = spark_executor.get_spark_session()
+                spark.conf.set("spark.sql.execution.arrow.pyspark.enabled", "true")
+                spark.createDataFrame(table.to_pandas()).createOrReplaceTempView(table_name)
+
+        return jsonify({"status": "success", "engine": engine, "table_name": table_name, "rows": descriptor["rows"]}), 200
+    except LookupError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except KernelError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# Route to page through a DataFrame a cell returned, without sending it all
+@notebook_bp.route("/<notebook_id>/viewers/<handle_id>/rows", methods=["GET"])
+def view_rows(notebook_id, handle_id):
+    """Rows [offset, offset+limit) of a viewer, optionally sorted by one column and filtered.
+
+    `filters` is a JSON list of {column, op, value}; op is one of ==, !=, <,
+    <=, >, >=, contains, isnull, notnull.
+    """
+    try:
+        filters = json.loads(request.args["filters"]) if request.args.get("filters") else None
+        if filters is not None and not isinstance(filters, list):
+            return jsonify({"status": "error", "message": "filters must be a JSON list"}), 400
+        page = kernel_manager.view_rows(
+            notebook_id, handle_id,
+            offset=request.args.get("offset", 0, type=int),
+            limit=request.args.get("limit", 100, type=int),
+            sort=request.args.get("sort"),
+            ascending=request.args.get("ascending", "true").lower() != "false",
+            filters=filters,
+        )
+        return jsonify({"status": "success", "page": page}), 200
+    except json.JSONDecodeError:
+        return jsonify({"status": "error", "message": "filters is not valid JSON"}), 400
+    except LookupError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except KernelError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# Route to release a DataFrame viewer
+@notebook_bp.route("/<notebook_id>/viewers/<handle_id>", methods=["DELETE"])
+def close_viewer(notebook_id, handle_id):
+    try:
+        kernel_manager.close_viewer(notebook_id, handle_id)
+        return jsonify({"status": "success"}), 200
+    except (LookupError, KernelError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
@@ -5,6 +5,7 @@ from flask import Blueprint, request, jsonify
 import io
 import subprocess
 import logging
+import time
 from core.python_execution import (
     execute_python_code,
     validate_python_syntax,
@@ -12,8 +13,9 @@ from core.python_execution import (
     save_cell_output,
     save_cell_input,
     list_files,
-    read_cell_output
 )
+from core.output_stream import output_streamer
+from core.package_installer import package_installer
 from core.file_manager import (
     read_file,
     create_file,
@@ -40,14 +42,19 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-notebook_state = {}
+notebook_states = {}  # notebook_id -> state
 # Save notebook state (For testing purposes, keeping it in memory, can use a DB)
 def save_state_to_db():
     pass
 
 # Fetch notebook state (For testing purposes, return in-memory state)
-def get_state_from_db():
-    return notebook_state
+def get_state_from_db(notebook_id="default"):
+    return notebook_states.get(notebook_id, {})
+
+# Resolve which notebook (and so which kernel) a request targets
+def resolve_notebook_id(params=None):
+    """The request's notebook_id, else the caller's X-User-ID header, else "default"."""
+    return (params or {}).get("notebook_id") or request.headers.get("X-User-ID") or "default"
 
 # Route to execute Python code
 @python_bp.route("/execute_python", methods=["POST"])
@@ -57,6 +64,8 @@ def execute_python():
         code = data.get('code')
         cell_id = data.get('cell_id')  # Pass the cell_id to track state
         library_name = data.get('library_name', None)  # Optional: Library to install
+        notebook_id = resolve_notebook_id(data)
+        stream = bool(data.get('stream'))  # Optional: Stream output to the cell's Socket.IO room
 
         if not code:
             return jsonify({"error": "No Python code provided"}), 400
@@ -68,7 +77,7 @@ def execute_python():
 
         # Step 2: Install Library if Required
         if library_name:
-            install_result = install_library(library_name)
+            install_result = install_library(library_name, notebook_id)
             if "Error" in install_result:
                 return jsonify({"status": "error", "message": install_result}), 500
 
@@ -78,27 +87,39 @@ def execute_python():
             return jsonify({"status": "error", "message": save_input_result}), 500
 
         # Step 4: Execute Python Code
-        stdout_output, stderr_output, generated_files = execute_python_code(cell_id, code)
-        if stderr_output:
-            return jsonify({"status": "error", "message": stderr_output}), 500
+        started_at = time.time()
+        on_output = output_streamer.sink_for(notebook_id, cell_id) if stream else None
+        stdout_output, stderr_output, outputs, error = execute_python_code(
+            cell_id, code, on_output=on_output, notebook_id=notebook_id,
+        )
+        if stream:
+            summary = {
+                "stdout_chars": len(stdout_output),
+                "stderr_chars": len(stderr_output),
+                "outputs": len(outputs),
+                "duration": round(time.time() - started_at, 4),
+            }
+            status = "error" if error else "success"
+            output_streamer.emit_status(notebook_id, cell_id, status, summary)
+        if error:
+            return jsonify({"status": "error", "message": error, "stderr": stderr_output}), 500
 
         # Step 5: Save Cell Output
         save_output_result = save_cell_output(cell_id, stdout_output)
         if "Error" in save_output_result:
             return jsonify({"status": "error", "message": save_output_result}), 500
 
-        # Step 6: Read Cell Output (Optional)
-        read_output = read_cell_output(cell_id)
+        if stream:
+            return jsonify({"status": "success", "summary": summary, "outputs": outputs}), 200
 
-        # Return Success Response
+        # Return Success Response (stdout is bounded by the kernel, long output is spooled to disk)
         return jsonify({
             "status": "success",
             "message": "Python code executed successfully.",
             "execution_result": {
                 "stdout": stdout_output,
                 "stderr": stderr_output,
-                "generated_files": generated_files,
-                "read_output": read_output
+                "outputs": outputs,
             }
         }), 200
 
@@ -128,37 +149,60 @@ def validate_python():
         return jsonify({"error": str(e)}), 500
 
 
-# Route to install a library
+# Route to install a library into a notebook's package overlay
 @python_bp.route("/install_library", methods=["POST"])
 def install_library_route():
+    """Queue a pip install; waits up to `wait` seconds (default 0) before answering 202 with the task."""
     try:
-        library_name = request.json.get('package_name')
+        data = request.json or {}
+        library_name = data.get('package_name')
+        notebook_id = resolve_notebook_id(data)
         if not library_name:
             logger.error("No library name provided.")
             return jsonify({"error": "No library name provided"}), 400
 
-        # Check if the library is already installed
-        try:
-            subprocess.check_output([sys.executable, "-m", "pip", "show", library_name])
-            logger.info(f"Library {library_name} is already installed.")
-            return jsonify({"status": "success", "message": f"Library {library_name} is already installed."}), 200
-        except subprocess.CalledProcessError:
-            pass  # Library is not installed, proceed with installation
-        
-        # Install the library using pip
-        logger.info(f"Attempting to install library: {library_name}")
-        result = subprocess.check_output([sys.executable, "-m", "pip", "install", library_name], stderr=subprocess.STDOUT)
-        logger.info(f"Library {library_name} installed successfully.")
-        return jsonify({"status": "success", "message": f"Library {library_name} installed successfully."}), 200
-
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Library installation failed for {library_name}: {e.output.decode()}")
-        return jsonify({"status": "error", "message": e.output.decode()}), 500
+        task = package_installer.submit(notebook_id, library_name)
+        if data.get('wait'):
+            task.wait(min(float(data['wait']), 600))
+        if task.status == "failed":
+            logger.error(f"Library installation failed for {library_name}: {task.error}")
+            return jsonify({"status": "error", "message": task.log or task.error, "task": task.to_dict()}), 500
+        if task.status == "succeeded":
+            return jsonify({"status": "success", "message": f"Library {library_name} installed successfully.", "task": task.to_dict()}), 200
+        return jsonify({"status": task.status, "message": f"Installing {library_name} in the background.", "task": task.to_dict()}), 202
+
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         logger.error(f"Unexpected error during library installation: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+# Route to follow a background install
+@python_bp.route("/install_library/<task_id>", methods=["GET"])
+def install_task_route(task_id):
+    task = package_installer.get(task_id)
+    if task is None:
+        return jsonify({"status": "error", "message": "Install task not found"}), 404
+    wait = request.args.get("wait", type=float)  # Optional long-poll in seconds
+    if wait:
+        task.wait(min(wait, 60))
+    return jsonify({"status": "success", "task": task.to_dict()}), 200
+
+
+# Route to list a notebook's overlay packages and installs
+@python_bp.route("/packages/<notebook_id>", methods=["GET"])
+def list_packages_route(notebook_id):
+    try:
+        return jsonify({
+            "status": "success",
+            "packages": package_installer.installed_packages(notebook_id),
+            "tasks": package_installer.list_tasks(notebook_id),
+        }), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
 
 # Route to list files
 @python_bp.route("/list_files", methods=["GET"])
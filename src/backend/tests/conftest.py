@@ -0,0 +1,21 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Everything the backend writes goes to a throwaway workspace; set before any core module is imported
+WORKSPACE = tempfile.mkdtemp(prefix="datavita-tests-")
+os.environ["WORKSPACE_PATH"] = WORKSPACE
+os.environ["SHARED_DATA_DIR"] = os.path.join(WORKSPACE, "shared")
+os.environ["NOTEBOOK_STATE_DB"] = os.path.join(WORKSPACE, "notebook_states.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="module")
+def kernels():
+    """A small kernel pool of its own, started without preloading so the tests stay quick."""
+    from core.kernel_manager import KernelManager
+    manager = KernelManager(max_kernels=2, start_method="spawn", preload=(), warm_pool_size=0)
+    yield manager
+    manager.shutdown_all()
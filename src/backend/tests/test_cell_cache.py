@@ -0,0 +1,78 @@
+import ast
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.cell_cache import CellCache, fingerprint
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return CellCache(directory=str(tmp_path))
+
+
+def key(cache, code, namespace):
+    tree = ast.parse(code)
+    reads = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)}
+    return cache.make_key(tree, reads, namespace)
+
+
+def test_key_is_stable_for_unchanged_inputs(cache):
+    namespace = {"df": pd.DataFrame({"a": range(10)})}
+    assert key(cache, "total = df['a'].sum()", namespace) == key(cache, "total = df['a'].sum()  # note", namespace)
+
+
+def test_key_changes_when_an_upstream_value_changes(cache):
+    namespace = {"df": pd.DataFrame({"a": range(10)}), "factor": 2}
+    before = key(cache, "out = df['a'] * factor", namespace)
+    namespace["factor"] = 3
+    assert key(cache, "out = df['a'] * factor", namespace) != before
+
+
+def test_key_changes_when_a_frame_is_mutated_in_place(cache):
+    namespace = {"df": pd.DataFrame({"a": range(10)})}
+    before = key(cache, "total = df['a'].sum()", namespace)
+    namespace["df"].loc[3, "a"] = 100
+    assert key(cache, "total = df['a'].sum()", namespace) != before
+
+
+def test_key_changes_when_an_upstream_function_changes(cache):
+    namespace = {}
+    exec("def f(x):\n    return (lambda y: y + 1)(x)\n", namespace)
+    before = key(cache, "out = f(1)", namespace)
+    exec("def f(x):\n    return (lambda y: y + 2)(x)\n", namespace)
+    assert key(cache, "out = f(1)", namespace) != before
+
+
+def test_function_fingerprint_ignores_where_it_was_compiled():
+    source = "def f(x):\n    g = lambda y: y * 2\n    return [g(i) for i in x]\n"
+    first, second = {}, {}
+    exec(compile(source, "<cell>", "exec"), first)
+    exec(compile("\n\n" + source, "<cell>", "exec"), second)
+    assert fingerprint(first["f"]) == fingerprint(second["f"])
+
+
+def test_array_fingerprint_follows_content():
+    array = np.arange(1000)
+    before = fingerprint(array)
+    array[500] = -1
+    assert fingerprint(array) != before
+
+
+def test_store_and_load_round_trip(cache):
+    namespace = {"x": 1}
+    cache_key = key(cache, "y = x + 1", namespace)
+    assert cache.load(cache_key) is None
+    assert cache.store(cache_key, {"stdout": "", "stderr": "", "display": []}, {"y": 2})
+    assert cache.load(cache_key)["variables"] == {"y": 2}
+
+
+def test_kernel_reuses_and_invalidates_cached_cells(kernels):
+    kernels.execute("cache-nb", "x = 10")
+    assert kernels.execute("cache-nb", "y = x * 2\nprint(y)", cache=True)["cached"] is False
+    reply = kernels.execute("cache-nb", "y = x * 2\nprint(y)", cache=True)
+    assert reply["cached"] is True and reply["result"] == "20"
+    kernels.execute("cache-nb", "x = 11")
+    reply = kernels.execute("cache-nb", "y = x * 2\nprint(y)", cache=True)
+    assert reply["cached"] is False and reply["result"] == "22"
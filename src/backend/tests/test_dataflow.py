@@ -0,0 +1,53 @@
+from core.dataflow import NotebookGraph
+
+
+def graph_of(*sources):
+    graph = NotebookGraph("nb")
+    graph.sync_cells([{"cell_id": f"c{i}", "code": code} for i, code in enumerate(sources, 1)])
+    for cell_id in graph.order:
+        graph.mark_executed(cell_id, graph.cells[cell_id].code)
+    return graph
+
+
+def test_new_cells_start_stale():
+    graph = NotebookGraph("nb")
+    graph.sync_cells([{"cell_id": "c1", "code": "a = 1"}])
+    assert graph.stale_cells() == ["c1"]
+
+
+def test_edit_marks_the_cell_and_its_transitive_dependents_stale():
+    graph = graph_of("a = 1", "b = a + 1", "c = b * 2", "d = 5")
+    assert graph.stale_cells() == []
+    assert graph.update_cell("c1", "a = 2") == ["c1", "c2", "c3"]
+    assert graph.stale_cells() == ["c1", "c2", "c3"]
+
+
+def test_unchanged_source_marks_nothing():
+    graph = graph_of("a = 1", "b = a + 1")
+    assert graph.update_cell("c1", "a = 1") == []
+    assert graph.stale_cells() == []
+
+
+def test_dependents_stay_stale_until_they_run():
+    graph = graph_of("a = 1", "b = a + 1", "c = b * 2")
+    graph.update_cell("c1", "a = 2")
+    graph.mark_executed("c1", "a = 2")
+    assert graph.stale_cells() == ["c2", "c3"]
+
+
+def test_a_cell_depends_on_the_closest_earlier_definition():
+    graph = graph_of("a = 1", "a = 10", "b = a + 1")
+    assert graph.dependencies()["c3"] == ["c2"]
+    assert graph.update_cell("c1", "a = 2") == ["c1"]
+
+
+def test_removing_a_cell_marks_its_dependents_stale():
+    graph = graph_of("a = 1", "b = a + 1", "c = 3")
+    graph.sync_cells([{"cell_id": "c2", "code": "b = a + 1"}, {"cell_id": "c3", "code": "c = 3"}])
+    assert graph.stale_cells() == ["c2"]
+
+
+def test_reordering_marks_every_cell_stale():
+    graph = graph_of("a = 1", "b = 2")
+    graph.sync_cells([{"cell_id": "c2", "code": "b = 2"}, {"cell_id": "c1", "code": "a = 1"}])
+    assert graph.stale_cells() == ["c2", "c1"]
@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+from core.job_manager import JobManager
+
+
+@pytest.fixture(scope="module")
+def jobs(kernels):
+    return JobManager(kernels=kernels, time_limit=60, grace=2, workers=2)
+
+
+def test_execute_round_trip(kernels):
+    reply = kernels.execute("kernel-a", "print('hello')")
+    assert reply["status"] == "success"
+    assert reply["result"] == "hello"
+    assert reply["msg_id"]
+
+
+def test_namespace_persists_between_cells(kernels):
+    kernels.execute("kernel-a", "x = 41")
+    reply = kernels.execute("kernel-a", "print(x + 1)")
+    assert reply["result"] == "42"
+    assert reply["notebook_state"]["x"] == 41
+
+
+def test_error_keeps_the_kernel_and_its_namespace(kernels):
+    kernels.execute("kernel-a", "y = 'kept'")
+    reply = kernels.execute("kernel-a", "1 / 0")
+    assert reply["status"] == "error"
+    assert "division by zero" in reply["error"]
+    assert kernels.execute("kernel-a", "print(y)")["result"] == "kept"
+
+
+def test_notebooks_do_not_share_a_namespace(kernels):
+    kernels.execute("kernel-a", "shared = 1")
+    assert kernels.execute("kernel-b", "print('shared' in globals())")["result"] == "False"
+
+
+def _started(jobs, notebook_id):
+    """Run a first cell so the kernel is up; a signal sent while it is still starting would kill it."""
+    assert jobs.submit(notebook_id, "pass").wait(60)
+
+
+def _wait_until_running(job, timeout=30):
+    deadline = time.time() + timeout
+    while job.status != "running" and time.time() < deadline:
+        time.sleep(0.05)
+    assert job.status == "running"
+
+
+def test_time_limit_interrupts_the_cell(jobs):
+    _started(jobs, "kernel-limit")
+    job = jobs.submit("kernel-limit", "import time\ntime.sleep(30)", time_limit=1)
+    assert job.wait(30)
+    assert job.status == "timed_out"
+    assert "time limit" in job.error
+    follow_up = jobs.submit("kernel-limit", "print('alive')")
+    assert follow_up.wait(30)
+    assert follow_up.status == "succeeded"
+
+
+def test_cancel_running_job(jobs):
+    _started(jobs, "kernel-cancel")
+    job = jobs.submit("kernel-cancel", "import time\ntime.sleep(30)")
+    _wait_until_running(job)
+    jobs.cancel(job.job_id)
+    assert job.wait(30)
+    assert job.status == "cancelled"
+
+
+def test_cancel_queued_job_never_runs(jobs):
+    first = jobs.submit("kernel-queue", "import time\ntime.sleep(1)")
+    second = jobs.submit("kernel-queue", "ran = True")
+    jobs.cancel(second.job_id)
+    assert second.wait(30) and first.wait(30)
+    assert second.status == "cancelled"
+    assert first.status == "succeeded"
+    check = jobs.submit("kernel-queue", "print('ran' in globals())")
+    assert check.wait(30)
+    assert check.reply["result"] == "False"
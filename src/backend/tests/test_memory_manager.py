@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from core import memory_manager
+from core.lazy_variable import LazyVariable
+from core.memory_manager import KernelMemoryManager
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(memory_manager, "current_rss", lambda: 1024 ** 4)  # Always over the limit
+    manager = KernelMemoryManager(limit_mb=1, min_variable_mb=0, directory=str(tmp_path))
+    yield manager
+    manager.close()
+
+
+def frame():
+    return pd.DataFrame({"a": np.arange(10_000), "b": np.arange(10_000) * 0.5})
+
+
+def spill(manager, namespace, names):
+    manager.touch(namespace, names)
+    return manager.maybe_spill(namespace)
+
+
+def test_spilled_frame_is_replaced_by_a_proxy(manager):
+    namespace = {"df": frame()}
+    assert spill(manager, namespace, ["df"]) == ["df"]
+    assert type(namespace["df"]) is LazyVariable
+    assert isinstance(namespace["df"], pd.DataFrame)
+    assert "df" in manager.spilled
+
+
+def test_first_use_reads_the_frame_back_into_the_namespace(manager):
+    namespace = {"df": frame()}
+    spill(manager, namespace, ["df"])
+    assert namespace["df"]["a"].sum() == frame()["a"].sum()
+    assert type(namespace["df"]) is pd.DataFrame
+    assert manager.spilled == {}
+
+
+def test_functions_globals_and_eval_see_spilled_frames(manager):
+    namespace = {"df": frame()}
+    exec("def rows():\n    return len(df)", namespace)
+    spill(manager, namespace, ["df"])
+    exec("n = rows()\ncolumns = list(globals()['df'].columns)\ntotal = eval('df.b.sum()')", namespace)
+    assert namespace["n"] == 10_000
+    assert namespace["columns"] == ["a", "b"]
+    assert namespace["total"] == frame()["b"].sum()
+
+
+def test_load_brings_named_frames_back(manager):
+    namespace = {"df": frame()}
+    spill(manager, namespace, ["df"])
+    manager.load(namespace, ["df"])
+    pd.testing.assert_frame_equal(namespace["df"], frame())
+
+
+def test_forget_keeps_the_value_of_an_aliased_proxy(manager):
+    namespace = {"df": frame()}
+    spill(manager, namespace, ["df"])
+    namespace["alias"] = namespace["df"]
+    manager.forget(namespace, ["df"])
+    namespace["df"] = None  # The cell that triggered forget() rebinds the name
+    pd.testing.assert_frame_equal(namespace["alias"]._lazy_resolve(), frame())
+    assert manager.spilled == {}
+
+
+def test_forget_drops_an_unaliased_proxy(manager):
+    namespace = {"df": frame()}
+    spill(manager, namespace, ["df"])
+    manager.forget(namespace, ["df"])
+    assert manager.spilled == {}
+
+
+def test_arrays_become_memory_maps(manager):
+    namespace = {"arr": np.arange(100_000)}
+    assert spill(manager, namespace, ["arr"]) == ["arr"]
+    assert type(namespace["arr"]) is np.ndarray
+    assert not namespace["arr"].flags.owndata
+    assert namespace["arr"].sum() == np.arange(100_000).sum()
+
+
+def test_referenced_values_are_not_spilled(manager):
+    namespace = {"df": frame()}
+    held = namespace["df"]
+    assert spill(manager, namespace, ["df"]) == []
+    assert namespace["df"] is held
+
+
+def test_frames_with_non_string_labels_stay_in_memory(manager):
+    namespace = {"df": pd.DataFrame({0: np.arange(10_000)})}
+    assert spill(manager, namespace, ["df"]) == []
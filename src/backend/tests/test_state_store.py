@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from core import state_store as state_store_module
+from core.checkpoint import list_checkpoints, read_checkpoint, write_checkpoint
+from core.state_store import StateStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return StateStore(db_path=str(tmp_path / "state.db"), blob_dir=str(tmp_path / "blobs"))
+
+
+def namespace():
+    return {
+        "df": pd.DataFrame({"a": range(100), "b": [str(i) for i in range(100)]}),
+        "arr": np.arange(50, dtype=np.float64),
+        "config": {"k": 1},
+        "handle": open(os.devnull),
+    }
+
+
+def test_snapshot_round_trip(store):
+    values = namespace()
+    report, hashes = store.snapshot("nb", values, values, {})
+    assert sorted(report["written"]) == ["arr", "config", "df"]
+    assert "handle" in report["skipped"]
+
+    manifest = store.manifest("nb")
+    assert set(manifest) == {"arr", "config", "df"} == set(hashes)
+    pd.testing.assert_frame_equal(store.load(manifest["df"]), values["df"])
+    np.testing.assert_array_equal(store.load(manifest["arr"]), values["arr"])
+    assert store.load_json_state("nb") == {"config": {"k": 1}}
+    values["handle"].close()
+
+
+def test_snapshot_writes_only_what_changed(store):
+    values = namespace()
+    _, hashes = store.snapshot("nb", values, values, {})
+    values["config"]["k"] = 2
+    del values["arr"]
+    report, hashes = store.snapshot("nb", values, ["df", "config", "arr"], hashes)
+    assert report["written"] == ["config"]
+    assert report["unchanged"] == ["df"]
+    assert report["removed"] == ["arr"]
+    assert set(store.manifest("nb")) == {"config", "df"}
+    values["handle"].close()
+
+
+def test_collect_garbage_keeps_referenced_blobs(store, monkeypatch):
+    values = {"a": [1, 2], "b": [3, 4]}
+    _, hashes = store.snapshot("nb", values, values, {})
+    del values["b"]
+    store.snapshot("nb", values, ["a", "b"], hashes)
+    monkeypatch.setattr(state_store_module, "STATE_BLOB_GRACE_SECONDS", -1)
+    assert store.collect_garbage() == 1
+    assert store.load(store.manifest("nb")["a"]) == [1, 2]
+
+
+def test_checkpoint_round_trip():
+    values = namespace()
+    manifest = write_checkpoint("checkpoint-nb", values)
+    assert set(manifest["variables"]) == {"arr", "config", "df"}
+    assert "handle" in manifest["skipped"]
+
+    restored, read_manifest = read_checkpoint("checkpoint-nb")
+    assert read_manifest["checkpoint_id"] == manifest["checkpoint_id"]
+    pd.testing.assert_frame_equal(restored["df"], values["df"])
+    np.testing.assert_array_equal(restored["arr"], values["arr"])
+    assert restored["config"] == {"k": 1}
+    values["handle"].close()
+
+
+def test_automatic_checkpoints_are_pending_until_read():
+    write_checkpoint("pending-nb", {"x": 1}, reason="evicted")
+    assert list_checkpoints("pending-nb")[0]["pending"]
+    read_checkpoint("pending-nb")
+    assert not list_checkpoints("pending-nb")[0]["pending"]
+
+
+def test_kernel_restores_a_checkpoint(kernels):
+    kernels.execute("restore-nb", "import numpy as np\narr = np.arange(5)\nlabel = 'saved'")
+    kernels.checkpoint("restore-nb")
+    kernels.kill_kernel("restore-nb")
+    assert kernels.execute("restore-nb", "print('arr' in globals())")["result"] == "False"
+    kernels.restore("restore-nb")
+    assert kernels.execute("restore-nb", "print(arr.sum(), label)")["result"] == "10 saved"
+
+
+@pytest.fixture(scope="module")
+def stored_kernels():
+    """Kernels that keep their variables in the state store; the setting is read when a kernel starts."""
+    from core.kernel_manager import KernelManager
+    os.environ["STATE_STORAGE"] = "database"
+    manager = KernelManager(max_kernels=1, start_method="spawn", preload=(), warm_pool_size=0)
+    yield manager
+    manager.shutdown_all()
+    del os.environ["STATE_STORAGE"]
+
+
+def test_new_kernel_reads_stored_variables_on_first_use(stored_kernels):
+    code = "import pandas as pd\ndf = pd.DataFrame({'a': [1, 2, 3]})\nconfig = {'k': 5}"
+    assert stored_kernels.execute("stored-nb", code)["status"] == "success"
+    assert set(stored_kernels.snapshot_state("stored-nb")["written"]) >= {"df", "config"}
+    stored_kernels.kill_kernel("stored-nb")
+
+    # Neither name appears in the cells below, so only the lazy proxies can supply them
+    stored_kernels.execute("stored-nb", "def rows():\n    return len(globals()['df'])")
+    reply = stored_kernels.execute("stored-nb", "print(rows(), eval('config')['k'], isinstance(globals()['df'], pd.DataFrame))")
+    assert reply["status"] == "success"
+    assert reply["result"] == "3 5 True"